@@ -1,7 +1,9 @@
 from config import config  # pylint: disable=wrong-import-order
 
 import csv
+import os
 import sys
+import threading
 from pprint import pprint  # pylint: disable=unused-import
 from statistics import mean, stdev
 from math import ceil
@@ -9,18 +11,31 @@ from datetime import datetime
 
 import numpy as np
 import gspread
+import google.auth.transport.requests as greq
 
 import constants
 
 import date_helpers as dh
+from timing import timed
 
 conf = config.conf
 
+# Google sheets verride default timeout 120s -> 300s
+greq._DEFAULT_TIMEOUT = constants.GS_DEFAULT_TIMEOUT  # pylint: disable=protected-access
+
+
+# ranking several expirations in one run reads the same files - parse once
+# (until the file changes). Rows are shared, callers must not modify them
+_csv_cache = {}
+
 
 def read_csv(filename, delimiter="\t"):
-    with open(filename, "r", encoding="utf-8") as csv_file:
-        csv_reader = csv.reader(csv_file, delimiter=delimiter)
-        return list(map(lambda x: x, csv_reader))
+    key = (filename, delimiter, os.path.getmtime(filename))
+    if key not in _csv_cache:
+        with open(filename, "r", encoding="utf-8") as csv_file:
+            csv_reader = csv.reader(csv_file, delimiter=delimiter)
+            _csv_cache[key] = list(map(lambda x: x, csv_reader))
+    return _csv_cache[key]
 
 
 def parse_blacklist_csv():
@@ -230,35 +245,42 @@ def upload_to_google_sheets(sheet_name, worksheet="Sheet365", headers=1, resize=
     worksheet.batch_update(batch, value_input_option="USER_ENTERED")
 
 
+@timed
 def aggregator(expr=None):
     expr = expr or (
         dh.current_expr() if not dh.is_today_an_expr_date() else dh.next_expr()
     )
 
-    if (
-        not conf.strangle.weeklies_only
-        and dh.current_monthly_expr() == expr
-        or dh.current_monthly_expr() == dh.next_expr()
-    ):
-        all_tickers = parse_monthlies_csv()
-    else:
-        all_tickers = parse_weeklies_csv()
-
-    tickers = set(all_tickers) - set(parse_blacklist_csv())
-
-    parse_aggregate_csv(list(tickers), expires_this_week(expr))
-    parse_ivs_csv(f"ivs_{expr}.csv")
-    remove_range_outliers()
-    add_statistics()
-    add_weighted_averages()
-    add_expected_ranges()
-    add_zscores()
+    # d is module state: threads (condorer.buy_many reselecting) rank one at a
+    # time, and pooled workers calling this per expiration don't leak the last
+    with _lock:
+        d.clear()
 
-    # pprint(d)
-    return top()
+        if (
+            not conf.strangle.weeklies_only
+            and dh.current_monthly_expr() == expr
+            or dh.current_monthly_expr() == dh.next_expr()
+        ):
+            all_tickers = parse_monthlies_csv()
+        else:
+            all_tickers = parse_weeklies_csv()
+
+        tickers = set(all_tickers) - set(parse_blacklist_csv())
+
+        parse_aggregate_csv(list(tickers), expires_this_week(expr))
+        parse_ivs_csv(f"ivs_{expr}.csv")
+        remove_range_outliers()
+        add_statistics()
+        add_weighted_averages()
+        add_expected_ranges()
+        add_zscores()
+
+        # pprint(d)
+        return top()
 
 
 d = {}
+_lock = threading.Lock()
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
@@ -0,0 +1,293 @@
+from config import config  # pylint: disable=wrong-import-order
+
+import glob
+import os
+import sys
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import constants
+from models import condor, strangle
+
+redis = config.redis
+
+# one row per position / per order, same columns in every part file
+POSITION_KEY = "pk"
+ORDER_KEY = "oid"
+
+
+def to_datetime64(d):
+    return np.datetime64(int(d.timestamp()), "s")
+
+
+def order_row(o, pk, role):
+    # signed so that positive slippage is always in our favour
+    slippage = 0.0
+    if o.processed_quantity > 0:
+        slippage = o.actual_price - o.price
+        if o.direction == "debit":
+            slippage = -slippage
+
+    return {
+        "oid": o.id,
+        "pk": pk,
+        "expr": np.datetime64(o.expr, "D"),
+        "role": role,
+        "direction": o.direction,
+        "state": o.state,
+        "created_at": to_datetime64(o.created_at),
+        "price": o.price,
+        "quantity": o.quantity,
+        "processed_quantity": o.processed_quantity,
+        "processed_premium": o.processed_premium,
+        "fill_price": o.actual_price,
+        "slippage": slippage,
+    }
+
+
+def position_row(p, quantity, open_premium, close_premium, pnl):
+    return {
+        "pk": p.pk,
+        "ticker": p.ticker,
+        "expr": np.datetime64(p.expr, "D"),
+        "created_at": to_datetime64(p.created_at),
+        "result": p.result or "",
+        "quantity": quantity,
+        "open_premium": open_premium,
+        "close_premium": close_premium,
+        "pnl": pnl,
+    }
+
+
+def condor_rows(c):
+    quantity = c.o.processed_quantity
+    open_premium = c.o.processed_premium
+
+    # unfilled close -> condor was closed as a total loss
+    if c.sell_o and c.sell_o.is_filled():
+        close_premium = c.sell_o.processed_premium
+    else:
+        close_premium = c.collateral * 100 * quantity
+
+    orders = [order_row(c.o, c.pk, "open")]
+    if c.sell_o:
+        orders.append(order_row(c.sell_o, c.pk, "close"))
+
+    pnl = open_premium - close_premium
+    return position_row(c, quantity, open_premium, close_premium, pnl), orders
+
+
+def strangle_rows(s):
+    buys = [s.buy_call_o, s.buy_put_o]
+    sells = [o for o in s.get_sell_orders("call") + s.get_sell_orders("put") if o]
+
+    open_premium = sum(o.processed_premium for o in buys)
+    close_premium = sum(o.processed_premium for o in sells)
+
+    orders = [order_row(o, s.pk, "open") for o in buys]
+    orders += [order_row(o, s.pk, "close") for o in sells]
+
+    pnl = close_premium - open_premium
+    quantity = s.buy_call_o.processed_quantity
+    return position_row(s, quantity, open_premium, close_premium, pnl), orders
+
+
+############
+# ARCHIVER #
+############
+
+
+# ISO week of an expiration (2023-W19): dailies share one directory a week
+def week(expr):
+    year, number, _ = date.fromisoformat(expr).isocalendar()
+    return f"{year}-W{number:02d}"
+
+
+def part_path(kind, expr, table):
+    d = os.path.join(constants.ARCHIVE_DIR, kind, week(expr))
+    os.makedirs(d, exist_ok=True)
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    return os.path.join(d, f"{table}-{stamp}.npz")
+
+
+def write_part(path, rows):
+    """
+    Rows (dicts with the same keys) -> one compressed array per column.
+    Written under a temp name first so readers never see half a part
+    """
+    columns = {k: np.array([r[k] for r in rows]) for k in rows[0]}
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, **columns)
+    os.replace(tmp, path)
+
+
+def archive_positions(kind, positions, rows, purge):
+    by_week = defaultdict(list)
+    for p in positions:
+        by_week[week(p.expr)].append(p)
+
+    for group in by_week.values():
+        position_rows, order_rows = [], []
+        for p in group:
+            pos, ords = rows(p)
+            position_rows.append(pos)
+            order_rows += ords
+
+        expr = group[0].expr
+        write_part(part_path(kind, expr, "positions"), position_rows)
+        if order_rows:
+            write_part(part_path(kind, expr, "orders"), order_rows)
+
+        # only after both parts are on disk, a rerun just rewrites duplicates
+        for p in group:
+            purge(p)
+
+    return len(positions)
+
+
+def purge_condor(c):
+    for o in [c.o, c.sell_o]:
+        if o:
+            o.delete()
+    c.delete()
+
+
+def purge_strangle(s):
+    for o in s.orders():
+        if o:
+            o.delete()
+    redis.delete(s.sell_call_oids, s.sell_put_oids)
+    s.delete()
+
+
+def run(after_days=constants.ARCHIVE_AFTER_DAYS):
+    """
+    Moves closed positions expired more than after_days ago (and their
+    orders) out of redis into archive/<kind>/<ISO week of expiration>/
+    """
+    cutoff = (date.today() - timedelta(after_days)).isoformat()
+    return {
+        "condor": archive_positions(
+            "condor",
+            condor.closed_condors_expiring_before(cutoff),
+            condor_rows,
+            purge_condor,
+        ),
+        "strangle": archive_positions(
+            "strangle",
+            strangle.closed_strangles_expiring_before(cutoff),
+            strangle_rows,
+            purge_strangle,
+        ),
+    }
+
+
+###########
+# QUERIES #
+###########
+
+
+def load(kind, table="positions", start=None, end=None):
+    """
+    Columns for every archived row of kind expiring in [start, end]
+    (ISO dates, both optional). Duplicate rows from reruns are dropped
+    """
+    columns = defaultdict(list)
+    for path in sorted(glob.glob(os.path.join(constants.ARCHIVE_DIR, kind, "*"))):
+        w = os.path.basename(path)
+        if (start and w < week(start)) or (end and w > week(end)):
+            continue
+        for part in sorted(glob.glob(os.path.join(path, f"{table}-*.npz"))):
+            with np.load(part) as z:
+                for k in z.files:
+                    columns[k].append(z[k])
+
+    res = {k: np.concatenate(v) for k, v in columns.items()}
+    if not res:
+        return res
+
+    # weeks at either end of the range hold expirations outside it
+    keep = np.ones(len(res["expr"]), dtype=bool)
+    if start:
+        keep &= res["expr"] >= np.datetime64(start, "D")
+    if end:
+        keep &= res["expr"] <= np.datetime64(end, "D")
+    res = {k: v[keep] for k, v in res.items()}
+
+    key = POSITION_KEY if table == "positions" else ORDER_KEY
+    _, ix = np.unique(res[key], return_index=True)
+    ix.sort()
+    return {k: v[ix] for k, v in res.items()}
+
+
+def pnl(kind, start=None, end=None):
+    """
+    Realized P&L per expiration
+    """
+    p = load(kind, "positions", start, end)
+    if not p:
+        return {}
+    exprs, inverse = np.unique(p["expr"], return_inverse=True)
+    totals = np.bincount(inverse, weights=p["pnl"])
+    return {str(e): round(float(t), 2) for e, t in zip(exprs, totals)}
+
+
+def win_rate(kind, start=None, end=None):
+    p = load(kind, "positions", start, end)
+    values = p.get("pnl", np.array([]))
+    wins = int(np.count_nonzero(values > 0))
+    losses = int(np.count_nonzero(values < 0))
+    return {
+        "wins": wins,
+        "losses": losses,
+        "draws": len(values) - wins - losses,
+        "win_rate": round(wins / len(values), 4) if len(values) else 0.0,
+        "pnl": round(float(values.sum()), 2),
+    }
+
+
+def slippage(kind, start=None, end=None):
+    """
+    Fill price vs limit price per order role (open / close), filled orders
+    only. Positive means filled better than the limit
+    """
+    o = load(kind, "orders", start, end)
+    if not o:
+        return {}
+
+    res = {}
+    filled = o["processed_quantity"] > 0
+    for role in ["open", "close"]:
+        values = o["slippage"][filled & (o["role"] == role)]
+        if not len(values):
+            continue
+        res[role] = {
+            "count": len(values),
+            "mean": round(float(values.mean()), 4),
+            "median": round(float(np.median(values)), 4),
+            "worst": round(float(values.min()), 4),
+        }
+    return res
+
+
+def report(kind, start=None, end=None):
+    lines = [f"-- {kind} {start or '...'} -> {end or '...'} --", ""]
+    lines += [f"{k:>10}: {v}" for k, v in win_rate(kind, start, end).items()]
+    lines += ["", "slippage:"]
+    lines += [f"{k:>10}: {v}" for k, v in slippage(kind, start, end).items()]
+    lines += ["", "pnl by expiration:"]
+    lines += [f"{k:>10}: {v}" for k, v in pnl(kind, start, end).items()]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("Usage: archive.py run | archive.py <condor|strangle> [start] [end]")
+
+    if sys.argv[1] == "run":
+        print(run())
+    else:
+        print(report(*sys.argv[1:4]))
@@ -0,0 +1,380 @@
+from config import config  # pylint: disable=wrong-import-order
+
+import sys
+from collections import defaultdict
+from functools import lru_cache
+
+import numpy as np
+
+import condorer
+import condorer_spy
+import constants
+import optimizer
+import snapshots
+import strangler
+
+condor_params = config.conf.condor
+strangle_params = config.conf.strangle
+
+# settings.yml keys a replay reads, defaults are the live values
+CONDOR_PARAMS = [
+    "max_condors",
+    "max_collateral",
+    "min_credit_collateral_ratio",
+    "target_roi",
+    "optimal_strike_multiplier_buy",
+    "optimal_strike_multiplier_sell",
+    "buy_slack",
+    "sell_slack",
+]
+STRANGLE_PARAMS = ["max_bid", "roi_multiplier", "optimal_strike_multiplier"]
+
+# fill model
+MODEL_PARAMS = {
+    "entry_time": None,  # hh:mm UTC, first snapshot of the first day if None
+    "fill_ratio": constants.BACKTEST_FILL_RATIO,
+    "fill_window": constants.BACKTEST_FILL_WINDOW,
+}
+
+
+def default_params(strategy):
+    if strategy == "strangle":
+        return {k: strangle_params[k] for k in STRANGLE_PARAMS} | MODEL_PARAMS
+
+    params = {k: condor_params[k] for k in CONDOR_PARAMS} | MODEL_PARAMS
+    if strategy == "condor_spy":
+        params["min_credit_collateral_ratio"] = condor_params[
+            "min_credit_collateral_ratio_spy"
+        ]
+    return params
+
+
+class Path:
+    """
+    Every recorded snapshot of one ticker / expr up to expiration, indexed
+    globally in time order across days
+    """
+
+    def __init__(self, ticker, expr):
+        self.ticker = ticker
+        self.expr = expr
+        self.days = [
+            snapshots.Day(ticker, expr, d)
+            for d in snapshots.days(ticker, expr)
+            if d <= expr
+        ]
+        self.starts = np.cumsum([0] + [len(d) for d in self.days])
+        # strike selections per (snapshot, strategy, multipliers), slack free
+        self.selections = {}
+        # price series per (o_type, strike, field)
+        self.quotes = {}
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def locate(self, i):
+        k = int(np.searchsorted(self.starts, i, side="right")) - 1
+        return k, i - int(self.starts[k])
+
+    def entry(self, hhmm=None):
+        for k, day in enumerate(self.days):
+            if (i := day.first_at(hhmm)) is not None:
+                return int(self.starts[k]) + i
+        return None
+
+    def next_day(self, i):
+        """
+        First snapshot recorded on a later date than snapshot i
+        """
+        return int(self.starts[self.locate(i)[0] + 1])
+
+    def chain(self, i):
+        k, j = self.locate(i)
+        return self.days[k].chain(j)
+
+    def prices(self, o_type, strike, field):
+        if (o_type, strike, field) not in self.quotes:
+            self.quotes[(o_type, strike, field)] = np.concatenate(
+                [d.prices(o_type, strike, field) for d in self.days]
+            )
+        return self.quotes[(o_type, strike, field)]
+
+    def select(self, i, key, fn):
+        if (i, key) not in self.selections:
+            self.selections[(i, key)] = fn(self.chain(i))
+        # apply_slack only sets top level keys, legs can stay shared
+        d = self.selections[(i, key)]
+        return dict(d) if d else None
+
+
+@lru_cache(maxsize=constants.BACKTEST_PATH_CACHE)
+def load_path(ticker, expr):
+    return Path(ticker, expr)
+
+
+###############
+# FILL MODEL #
+###############
+
+
+def spread_prices(path, legs):
+    """
+    Natural and mid price of a credit spread for every snapshot. legs are
+    (o_type, strike, sign), +1 for sold legs. Natural credit sells at the
+    bids and buys at the asks, natural debit (closing) the other way round
+    """
+    credit = debit = mid = 0.0
+    for o_type, strike, sign in legs:
+        bid = path.prices(o_type, strike, "bid")
+        ask = path.prices(o_type, strike, "ask")
+        credit = credit + sign * (bid if sign > 0 else ask)
+        debit = debit + sign * (ask if sign > 0 else bid)
+        mid = mid + sign * (bid + ask) / 2
+    return credit, debit, mid
+
+
+def first_fill(hits, start):
+    """
+    Index of the first True in hits (from start on), None if never
+    """
+    if not len(ix := np.flatnonzero(hits)):
+        return None
+    return start + int(ix[0])
+
+
+def credit_fill(limit, natural, mid, p, start, end=None):
+    # a credit limit fills once it is within fill_ratio of natural -> mid
+    natural, mid = natural[start:end], mid[start:end]
+    return first_fill(limit <= natural + p["fill_ratio"] * (mid - natural), start)
+
+
+def debit_fill(limit, natural, mid, p, start, end=None):
+    natural, mid = natural[start:end], mid[start:end]
+    return first_fill(limit >= natural - p["fill_ratio"] * (natural - mid), start)
+
+
+def last_value(values, start):
+    ix = np.flatnonzero(np.isfinite(values[start:]))
+    return float(values[start + ix[-1]]) if len(ix) else None
+
+
+#############
+# STRATEGY #
+#############
+
+
+def replay_condor(path, p, adjacent_wings=False):
+    """
+    One condor through Select -> Buy -> Sell -> Close. None if nothing was
+    selected, a trade dict otherwise (pnl in $)
+    """
+    if (i := path.entry(p["entry_time"])) is None:
+        return None
+
+    multipliers = (
+        p["optimal_strike_multiplier_buy"],
+        p["optimal_strike_multiplier_sell"],
+    )
+    d = path.select(
+        i,
+        ("condor", adjacent_wings, *multipliers),
+        lambda chain: optimizer.optimal_condor(
+            chain, *multipliers, 0, adjacent_wings=adjacent_wings
+        ),
+    )
+    if not d or not (
+        condorer.Select.validate_collateral(d, p["max_collateral"])
+        and condorer.Select.validate_min_collateral_ratio(
+            d, p["min_credit_collateral_ratio"]
+        )
+    ):
+        return None
+    quantity = min(p["max_condors"], p["max_collateral"] // d["collateral"])
+    if not quantity:
+        return None
+
+    legs = [
+        (o_type, d[o_type][side]["strike"], 1 if side == "sell" else -1)
+        for o_type in ["call", "put"]
+        for side in ["buy", "sell"]
+    ]
+    credit, debit, mid = spread_prices(path, legs)
+    trade = {"ticker": path.ticker, "expr": path.expr, "quantity": quantity}
+
+    # Buy: slack ladder on the one selection, fill_window snapshots per rung
+    # (at least one rung, even when buy_slack starts above the live cap of 2)
+    filled_at, w = None, p["fill_window"]
+    rungs = range(p["buy_slack"], max(p["buy_slack"], 2) + 1)
+    for start, slack in zip(range(i, len(path), w), rungs):
+        limit = round(optimizer.apply_slack(d, slack)["credit_with_slack"], 2)
+        filled_at = credit_fill(limit, credit, mid, p, start, start + w)
+        if filled_at is not None:
+            break
+    if filled_at is None:
+        return trade | {"filled": False, "pnl": 0.0}
+
+    # Sell: take profit order from the following day on
+    roi = p["target_roi"]
+    target = round((limit * (100 + roi) - roi * d["collateral"]) / 100, 2)
+    closed_at = debit_fill(target, debit, mid, p, path.next_day(filled_at))
+    exit_price = target
+    if closed_at is None:
+        exit_price = eject_price(debit, mid, p, filled_at, d["collateral"])
+
+    return trade | {
+        "filled": True,
+        "credit": limit,
+        "debit": exit_price,
+        "pnl": round((limit - exit_price) * 100 * quantity, 2),
+        "exit": "target" if closed_at is not None else "eject",
+    }
+
+
+def eject_price(debit, mid, p, start, collateral):
+    """
+    Close at expiration: starts sell_slack under the last natural debit and
+    walks up until the fill model takes it, capped at (and if there is no
+    quote at all, equal to) the collateral
+    """
+    if (natural := last_value(debit, start)) is None:
+        return collateral
+    threshold = natural - p["fill_ratio"] * (natural - last_value(mid, start))
+    price = max(natural - p["sell_slack"] / 100, threshold)
+    return round(min(np.ceil(price * 100) / 100, collateral), 2)
+
+
+def replay_strangle(
+    path, p, slack=strangler._SLACK_MULTIPLIER  # pylint: disable=protected-access
+):
+    """
+    Long strangle: both legs bought at the ask (+ slack ticks), each sold at
+    the roi multiplier price or at the last bid at expiration
+    """
+    if (i := path.entry(p["entry_time"])) is None:
+        return None
+
+    multiplier = p["optimal_strike_multiplier"]
+    d = path.select(
+        i,
+        ("strangle", multiplier),
+        lambda chain: optimizer.optimal_strangle(chain, multiplier, slack),
+    )
+    if not d or not validate_strangle(d, p["max_bid"]):
+        return None
+
+    trade = {"ticker": path.ticker, "expr": path.expr, "filled": True, "pnl": 0.0}
+    for o_type in ["call", "put"]:
+        leg = d[o_type]
+        quantity = round(p["max_bid"] / leg["ask"])
+        bid = path.prices(o_type, leg["strike"], "bid")
+        ask = path.prices(o_type, leg["strike"], "ask")
+        mid = (bid + ask) / 2
+
+        target = 2 * (1 + p["roi_multiplier"] / 100) * leg["ask"]
+        # a sell (credit) on one leg: natural is the bid
+        if credit_fill(target, bid, mid, p, i + 1) is not None:
+            exit_price = target
+        else:
+            exit_price = last_value(bid, i) or 0.0
+
+        trade[o_type] = {"quantity": quantity, "buy": leg["ask"], "sell": exit_price}
+        trade["pnl"] += (exit_price - leg["ask"]) * 100 * quantity
+
+    trade["pnl"] = round(trade["pnl"], 2)
+    return trade
+
+
+def validate_strangle(d, max_bid):
+    select = strangler.Select
+    call, put = d["call"], d["put"]
+    return (
+        call
+        and put
+        and select.validate_max_bid_price(call["ask"], max_bid)
+        and select.validate_max_bid_price(put["ask"], max_bid)
+        and select.validate_max_bid_ask_ratio(call["bid"], call["ask"])
+        and select.validate_max_bid_ask_ratio(put["bid"], put["ask"])
+        and select.validate_max_cost_ratio(call["ask"], put["ask"], max_bid)
+    )
+
+
+STRATEGIES = {
+    "condor": replay_condor,
+    "condor_spy": lambda path, p: replay_condor(path, p, adjacent_wings=True),
+    "strangle": replay_strangle,
+}
+
+
+###########
+# RESULTS #
+###########
+
+
+def stats(trades):
+    """
+    P&L, win rate and max drawdown (of cumulative P&L in expiration order)
+    over filled trades
+    """
+    filled = sorted((t for t in trades if t["filled"]), key=lambda t: t["expr"])
+    pnl = np.array([t["pnl"] for t in filled])
+    equity = np.cumsum(pnl)
+    drawdown = np.maximum.accumulate(np.maximum(equity, 0)) - equity
+
+    return {
+        "selected": len(trades),
+        "filled": len(filled),
+        "wins": int(np.count_nonzero(pnl > 0)),
+        "win_rate": round(float(np.mean(pnl > 0)), 4) if len(pnl) else 0.0,
+        "pnl": round(float(pnl.sum()), 2),
+        "max_drawdown": round(float(drawdown.max()), 2) if len(pnl) else 0.0,
+    }
+
+
+def positions(strategy, tickers=None, start=None, end=None):
+    """
+    (ticker, expr) pairs with recorded snapshots, expirations in [start, end]
+    """
+    if strategy == "condor_spy":
+        tickers = [condorer_spy.Select.ticker]
+    return [
+        (ticker, expr)
+        for ticker in tickers or snapshots.tickers()
+        for expr in snapshots.exprs(ticker)
+        if (not start or expr >= start) and (not end or expr <= end)
+    ]
+
+
+def run(strategy, params=None, tickers=None, start=None, end=None):
+    """
+    Replays recorded expirations through strategy with params (missing keys
+    fall back to settings.yml). Like the live bots an expiration gets at most
+    one play, the first ticker with a valid selection. Live that order is
+    the aggregator ranking, which is not recorded: tickers are tried in the
+    order given (alphabetical by default), so when several qualify the P&L
+    is not directly comparable to live trading
+    """
+    p = default_params(strategy) | (params or {})
+    replay = STRATEGIES[strategy]
+
+    by_expr = defaultdict(list)
+    for ticker, expr in positions(strategy, tickers, start, end):
+        by_expr[expr].append(ticker)
+
+    trades = []
+    for expr in sorted(by_expr):
+        for ticker in by_expr[expr]:
+            if t := replay(load_path(ticker, expr), p):
+                trades.append(t)
+                break
+
+    return {"params": p, "trades": trades} | stats(trades)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("Usage: backtest.py <condor|condor_spy|strangle> [start] [end]")
+
+    res = run(sys.argv[1], None, None, *sys.argv[2:4])
+    for k, v in res.items():
+        if k != "trades":
+            print(f"{k:>14}: {v}")
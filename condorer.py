@@ -1,16 +1,26 @@
 from config import config  # pylint: disable=wrong-import-order
 
+import contextvars
+import math
 import multiprocessing
 import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date
 from pprint import pformat, pprint  # pylint: disable=unused-import
 
+import constants
+import date_helpers as dh
 import discord_logging as dlog
 import helpers  # pylint: disable=unused-import
 import hood
 from aggregator import aggregator
 from decorators import log, retry
 from models import order, condor
+import optimizer
+import order_watcher
+from timing import timed
 
 
 redis = config.redis
@@ -33,23 +43,34 @@ class Buy:
     """
 
     @classmethod
-    def exec(cls, expr):
-        return cls(expr).run()
+    def exec(cls, expr, buy_data=None, max_collateral=_MAX_COLLATERAL):
+        return cls(expr, buy_data, max_collateral).run()
 
-    def __init__(self, expr):
+    def __init__(self, expr, buy_data=None, max_collateral=_MAX_COLLATERAL):
         self.expr = expr
 
-        self.buy_data = {}
+        # a play chosen up front (MultiSelect) and the capital it was given
+        self.buy_data = buy_data or {}
+        self.max_collateral = max_collateral
 
         self.oid = None
         self.order = None
 
         self.buy_slack = _BUY_SLACK
 
-    def run(self):
+    def run(self, max_age=constants.SELECT_SNAPSHOT_MAX_AGE):
+        selected_at = time.monotonic() if self.buy_data else None
         while self.buy_slack <= 2:
-            # 1. Select optimal play
-            self.buy_data = Select.exec(self.expr, self.buy_slack)
+            # 1. Select optimal play, later rungs only reprice the same
+            # selection unless it is older than max_age
+            if selected_at is None or time.monotonic() - selected_at > max_age:
+                self.buy_data = Select.exec(
+                    self.expr, self.buy_slack, max_collateral=self.max_collateral
+                )
+                selected_at = time.monotonic()
+            else:
+                optimizer.apply_slack(self.buy_data, self.buy_slack)
+
             if not self.buy_data:
                 dlog.fatal("Could not find any plays!")
                 sys.exit()
@@ -69,17 +90,23 @@ class Buy:
 
             self.buy_slack += 1
 
+    @timed
     @log
     def open_order(self):
         if js := hood.open_condor(self.buy_data["ticker"], self.expr, self.buy_data):
             return order.create(js | self.buy_data["min_ticks"])
         return None
 
+    @timed
     @log
-    @retry(skip_first_delay=False, attempts=100)
     def confirm_order(self):
-        return self.order.sync().is_filled()
+        return order_watcher.wait_for(
+            self.order,
+            order.OrderWrapper.is_filled,
+            timeout=constants.BUY_CONFIRM_TIMEOUT,
+        )
 
+    @timed
     @log
     def init_condor(self, target_roi=_TARGET_ROI):
         if c := condor.find(self.order.ticker, self.order.expr):
@@ -98,6 +125,7 @@ class Buy:
 
         return condor.new(self.order, self.buy_data).save()
 
+    @timed
     @log
     def cancel_order(self, oid):
         hood.cancel_order(oid)
@@ -134,8 +162,11 @@ class Select:
     """
 
     @classmethod
-    def exec(cls, expr, slack, dry_run=False):
-        return cls(expr, slack).choose_play(dry_run=dry_run)
+    @timed
+    def exec(cls, expr, slack, dry_run=False, max_collateral=_MAX_COLLATERAL):
+        return cls(expr, slack).choose_play(
+            max_collateral=max_collateral, dry_run=dry_run
+        )
 
     def __init__(self, expr, slack):
         self.expr = expr
@@ -147,27 +178,55 @@ class Select:
         max_collateral=_MAX_COLLATERAL,
         max_quantity=_MAX_CONDORS,
         dry_run=False,
+        window=constants.SELECT_WINDOW,
     ):
-        for ticker in self.get_tickers()[:max_plays]:
-            if condor.exists(ticker, self.expr):
-                continue
-            if not (d := self.get_optimal_strikes(ticker)):
-                continue
+        """
+        Candidates are evaluated up to `window` tickers ahead on a thread pool
+        but consumed in ranked order, so the play is the same one a
+        sequential walk would pick
+        """
+        tickers = iter(self.get_tickers()[:max_plays])
+        args = (max_collateral, max_quantity, dry_run)
+
+        executor = ThreadPoolExecutor(max_workers=window)
+        pending = deque()
+
+        def submit():
+            if (ticker := next(tickers, None)) is not None:
+                # own context copy per task keeps timing spans nested
+                ctx = contextvars.copy_context()
+                pending.append(executor.submit(ctx.run, self.evaluate, ticker, *args))
+
+        try:
+            for _ in range(window):
+                submit()
+
+            while pending:
+                if (d := pending.popleft().result()) and not dry_run:
+                    return d
+                if d:
+                    pprint(d)
+                submit()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
-            if not dry_run and not self.validate(d):
-                continue
+        return None
 
-            if not (quantity := min(max_quantity, max_collateral // d["collateral"])):
-                continue
+    def evaluate(self, ticker, max_collateral, max_quantity, dry_run):
+        if condor.exists(ticker, self.expr):
+            return None
+        if not (d := self.get_optimal_strikes(ticker)):
+            return None
 
-            d["ticker"] = ticker
-            d["quantity"] = quantity
+        if not dry_run and not self.validate(d):
+            return None
 
-            if dry_run:
-                pprint(d)
-                continue
+        if not (quantity := min(max_quantity, max_collateral // d["collateral"])):
+            return None
 
-            return d
+        d["ticker"] = ticker
+        d["quantity"] = quantity
+        return d
 
     # aggregator returns tickers sorted by option value
     def get_tickers(self):
@@ -177,6 +236,7 @@ class Select:
     def get_option_chain(self, ticker):
         return hood.get_option_chain(ticker, self.expr)
 
+    @timed
     def get_optimal_strikes(
         self,
         ticker,
@@ -186,134 +246,10 @@ class Select:
         if not (chain := hood.get_option_chain(ticker, self.expr)):
             return None
 
-        d = {"call": {}, "put": {}}
-        roi_buy = (1 + multiplier_buy / 100) * 2
-        roi_sell = (1 + multiplier_sell / 100) * 2
-
-        optimal_call_val_buy = sys.maxsize
-        optimal_put_val_buy = 0
-        optimal_call_val_sell = sys.maxsize
-        optimal_put_val_sell = 0
-
-        strike = None
-        strikes = set()
-        chain_data = {"call": {}, "put": {}}
-        for c in chain:
-            try:
-                o_type = c.get("type").lower()
-                strike = float(c.get("strike_price"))
-                ask = float(c.get("ask_price"))
-                bid = float(c.get("bid_price"))
-                mark = float(c.get("mark_price"))
-                min_ticks = c.get("min_ticks")
-
-                strikes.add(strike)
-                chain_data[o_type][strike] = {"ask": ask, "bid": bid}
-            except TypeError:
-                dlog.warn(f"get_optimal_strikes: bad option - {ticker} ${strike}")
-                continue
-
-            d["min_ticks"] = min_ticks
-
-            if o_type == "call":
-                target = strike + roi_buy * mark
-                if target < optimal_call_val_buy:
-                    optimal_call_val_buy = target
-                    d[o_type]["buy"] = {
-                        "strike": strike,
-                        "ask": ask,
-                        "bid": bid,
-                        "mark": mark,
-                        "target": optimal_call_val_buy,
-                    }
-
-                target = strike + roi_sell * mark
-                if target < optimal_call_val_sell:
-                    optimal_call_val_sell = target
-                    d[o_type]["sell"] = {
-                        "strike": strike,
-                        "ask": ask,
-                        "bid": bid,
-                        "mark": mark,
-                        "target": optimal_call_val_sell,
-                    }
-
-            else:
-                target = strike - roi_buy * mark
-                if target > optimal_put_val_buy:
-                    optimal_put_val_buy = target
-                    d[o_type]["buy"] = {
-                        "strike": strike,
-                        "ask": ask,
-                        "bid": bid,
-                        "mark": mark,
-                        "target": optimal_put_val_buy,
-                        "min_ticks": min_ticks,
-                    }
-
-                target = strike - roi_sell * mark
-                if target > optimal_put_val_sell:
-                    optimal_put_val_sell = target
-                    d[o_type]["sell"] = {
-                        "strike": strike,
-                        "ask": ask,
-                        "bid": bid,
-                        "mark": mark,
-                        "target": optimal_put_val_sell,
-                        "min_ticks": min_ticks,
-                    }
-
-        # strike extermity check (cleanup: move to validation)
-        strikes = sorted(list(strikes))
-
-        if "buy" not in d["call"] or "buy" not in d["put"]:
-            return None
-        if "sell" not in d["call"] or "sell" not in d["put"]:
-            return None
-
-        if d["call"]["buy"]["strike"] == d["call"]["sell"]["strike"]:
-            i = strikes.index(d["call"]["buy"]["strike"])
-            if i == len(strikes) - 1:
-                dlog.warn("CALL leg: sell target is highest strike")
-                return None
-            d["call"]["buy"]["strike"] = strikes[i + 1]
-            d["call"]["buy"]["ask"] = chain_data["call"][strikes[i + 1]]["ask"]
-            d["call"]["buy"]["bid"] = chain_data["call"][strikes[i + 1]]["bid"]
-
-        if d["put"]["buy"]["strike"] == d["put"]["sell"]["strike"]:
-            i = strikes.index(d["put"]["buy"]["strike"])
-            if i == 0:
-                dlog.warn("PUT leg: sell target is lowest strike")
-                return None
-            d["put"]["buy"]["strike"] = strikes[i - 1]
-            d["put"]["buy"]["ask"] = chain_data["put"][strikes[i - 1]]["ask"]
-            d["put"]["buy"]["bid"] = chain_data["put"][strikes[i - 1]]["bid"]
-        # end srike extermity check
-
-        d["collateral"] = max(
-            d["call"]["buy"]["strike"] - d["call"]["sell"]["strike"],
-            d["put"]["sell"]["strike"] - d["put"]["buy"]["strike"],
-        )
-
-        d["call"]["credit"] = round(
-            d["call"]["sell"]["bid"] - d["call"]["buy"]["ask"], 2
-        )
-        d["put"]["credit"] = round(d["put"]["sell"]["bid"] - d["put"]["buy"]["ask"], 2)
-
-        d["credit"] = d["call"]["credit"] + d["put"]["credit"]
-        d["credit_collateral_ratio"] = d["credit"] / d["collateral"] * 100
-
-        d["credit_with_slack"] = d["credit"] - self.slack * d["collateral"] / 100
-        d["credit_with_slack_collateral_ratio"] = (
-            d["credit_with_slack"] / d["collateral"] * 100
+        return optimizer.optimal_condor(
+            optimizer.Chain(chain, ticker), multiplier_buy, multiplier_sell, self.slack
         )
 
-        d["multiplier_buy"] = multiplier_buy
-        d["multiplier_sell"] = multiplier_sell
-
-        # pprint(d)
-        return d
-
     def validate(self, d):
         call_data = d["call"]
         put_data = d["put"]
@@ -334,6 +270,65 @@ class Select:
         return d["credit_collateral_ratio"] >= ratio
 
 
+class MultiSelect:
+    """
+    Plays for several expirations in one pass. Tickers are still ranked per
+    expiration (the aggregator's csv reads are shared), chains for every
+    (ticker, expr) are evaluated on one thread pool, and max_collateral
+    holds for all plays together. Nearer expirations get first call on it
+    """
+
+    def __init__(self, exprs, slack):
+        self.selects = {expr: Select(expr, slack) for expr in sorted(exprs)}
+
+    @timed
+    def choose_plays(
+        self,
+        max_plays=100,
+        max_collateral=_MAX_COLLATERAL,
+        max_quantity=_MAX_CONDORS,
+        window=constants.SELECT_WINDOW,
+    ):
+        # aggregator keeps module state, rank sequentially before the pool
+        tickers = {
+            expr: iter(s.get_tickers()[:max_plays]) for expr, s in self.selects.items()
+        }
+        args = (max_collateral, max_quantity, False)
+
+        executor = ThreadPoolExecutor(max_workers=window * len(self.selects))
+        pending = {expr: deque() for expr in self.selects}
+
+        def submit(expr):
+            if (ticker := next(tickers[expr], None)) is not None:
+                ctx = contextvars.copy_context()
+                pending[expr].append(
+                    executor.submit(ctx.run, self.selects[expr].evaluate, ticker, *args)
+                )
+
+        plays, budget = {}, max_collateral
+        try:
+            for expr in self.selects:
+                for _ in range(window):
+                    submit(expr)
+
+            for expr in self.selects:
+                while pending[expr]:
+                    if d := pending[expr].popleft().result():
+                        quantity = min(d["quantity"], budget // d["collateral"])
+                        if quantity:
+                            plays[expr] = d | {"quantity": quantity}
+                            budget -= quantity * d["collateral"]
+                            break
+                    submit(expr)
+
+                for f in pending[expr]:
+                    f.cancel()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return plays
+
+
 class Sell:
     """
     Sell strategy:
@@ -367,6 +362,91 @@ class Sell:
                 _condor.sell_confirmed()
 
 
+class ExitLadder:
+    """
+    Limit prices for buying back a condor on expiration day.
+
+    Starts at the mid of one batched quote of the four legs (less sell
+    slack) and steps up towards the collateral. Steps grow as the close
+    nears, and are never smaller than what it takes to reach the collateral
+    with the rungs left, going by how long rungs have taken so far. Legs are
+    requoted every few rungs, the price never goes down
+    """
+
+    def __init__(self, _condor, slack=_SELL_SLACK):
+        self.condor = _condor
+        self.slack = slack
+        self.mid = None
+        # cancel, replace and confirm window - measured once rungs have run
+        self.rung_seconds = constants.EXIT_CONFIRM_TIMEOUT
+        # instrument id -> +1 sold at open (bought back at the ask), -1 bought
+        self.legs = self.leg_ids()
+
+    def leg_ids(self):
+        _order = self.condor.o
+        instruments = hood.get_option_instruments(_order.chain_id, self.condor.expr)
+        ids = {(float(i["strike_price"]), i["type"]): i["id"] for i in instruments}
+        res = {}
+        for leg in _order.legs:
+            if (key := (float(leg["strike_price"]), leg["option_type"])) not in ids:
+                return None
+            res[ids[key]] = 1 if leg["side"] == "sell" else -1
+        return res
+
+    @timed
+    def quote(self):
+        if not self.legs:
+            return False
+        res = hood.get_option_quotes(list(self.legs))
+        quotes = {q["instrument_id"]: q for q in res}
+        if len(quotes) < len(self.legs):
+            return False
+
+        mid = 0.0
+        for oid, sign in self.legs.items():
+            bid, ask = float(quotes[oid]["bid_price"]), float(quotes[oid]["ask_price"])
+            mid += sign * (bid + ask) / 2
+        self.mid = mid
+        return True
+
+    def start_price(self):
+        if self.quote():
+            return self.mid - self.slack / 100
+        # no quote: the old start, natural credit of the open legs
+        return hood.eject_price_condor(self.condor) - self.slack / 100
+
+    def step(self, price, seconds_left):
+        steps = constants.EXIT_LADDER_STEPS
+        pressure = 1 - min(max(seconds_left / constants.EXIT_LADDER_WINDOW, 0), 1)
+        rungs_left = max(seconds_left / self.rung_seconds, 1)
+        return max(
+            steps[min(int(pressure * len(steps)), len(steps) - 1)],
+            (self.condor.collateral - price) / rungs_left,
+        )
+
+    def round_up(self, price):
+        _order = self.condor.o
+        tick = _order.above_tick if price >= _order.cutoff_price else _order.below_tick
+        tick = tick or 0.01
+        return round(math.ceil(round(price / tick, 6)) * tick, 2)
+
+    def prices(self):
+        """
+        Rising limit prices, stops before reaching the collateral
+        """
+        price = self.round_up(max(self.start_price(), 0.01))
+        rung, started = 0, time.monotonic()
+        while price < self.condor.collateral:
+            yield price
+
+            rung += 1
+            self.rung_seconds = (time.monotonic() - started) / rung
+            if rung % constants.EXIT_REQUOTE_EVERY == 0 and self.quote():
+                price = max(price, self.mid - self.slack / 100)
+            seconds_left = dh.absolute_seconds_until_expr(self.condor.expr)
+            price = self.round_up(price + self.step(price, seconds_left))
+
+
 class Close:
     """
     Close strategy:
@@ -385,53 +465,109 @@ class Close:
         self.sell_slack = condor_params.sell_slack
 
     @log
-    def run(self):
-        for _condor in self.condors:
-            _order = _condor.sell_o
-            if not _order:
-                continue
-
-            _order.sync()
-
-            if _order.is_filled():
-                _condor.close()
-                continue
-
-            if _condor.expr != date.today().isoformat():
-                continue
+    def run(self, max_workers=constants.CLOSE_MAX_WORKERS):
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # own context copy per task keeps timing spans nested
+            futures = {
+                executor.submit(contextvars.copy_context().run, self.exec_locked, c): c
+                for c in self.condors
+            }
+            for future in as_completed(futures):
+                if err := future.exception():
+                    dlog.error(f"{futures[future].pk} - close failed: {err!r}")
+
+    def exec_locked(self, _condor):
+        if not _condor.lock():
+            return
+        try:
+            self.close_condor(_condor)
+        finally:
+            _condor.unlock()
+
+    @timed
+    def close_condor(self, _condor):
+        _order = _condor.sell_o
+        if not _order:
+            return
+
+        _order.sync()
+
+        if _order.is_filled():
+            _condor.close()
+            return
+
+        if _condor.expr != date.today().isoformat():
+            return
+
+        # eject scenario
+        for price in ExitLadder(_condor, self.sell_slack).prices():
+            if not _condor.refresh_lock():
+                dlog.warn(f"{_condor.pk} - lock expired. Skipping ...")
+                return
+
+            if not hood.cancel_order_now(_condor.sell_oid):
+                dlog.warn(f"{_condor.pk} - Failed to cancel order. Skipping ...")
+                break
 
-            # eject scenario
-            price = hood.eject_price_condor(_condor) - self.sell_slack / 100
-            while price < _condor.collateral:
-                if not hood.cancel_order(_condor.sell_oid):
-                    dlog.warn(f"{_condor.pk} - Failed to cancel order. Skipping ...")
+            if js := hood.close_condor(_condor, price=price):
+                o = order.create(js | _order.min_ticks)
+                _condor.sell_oid = o.id
+                _condor.save()
+                if self.confirm_order(_condor, timeout=constants.EXIT_CONFIRM_TIMEOUT):
+                    _condor.close()
                     break
 
-                if js := hood.close_condor(_condor, price=price):
-                    o = order.create(js | _order.min_ticks)
-                    _condor.sell_oid = o.id
-                    _condor.save()
-                    if self.confirm_order(_condor):
-                        _condor.close()
-                        break
+        if _condor.is_closed():
+            return
 
-                price += 0.01
-
-            if _condor.is_closed():
-                continue
-
-            _condor.close(total_loss=True)
+        _condor.close(total_loss=True)
 
+    @timed
     @log
-    @retry(skip_first_delay=False, attempts=5)
-    def confirm_order(self, _condor):
-        return _condor.sell_o.sync().is_filled()
+    def confirm_order(
+        self,
+        _condor,
+        timeout=constants.HOOD_API_MAX_RETRY_ATTEMPTS * constants.HOOD_API_RETRY_DELAY,
+    ):
+        return order_watcher.wait_for(
+            _condor.sell_o,
+            order.OrderWrapper.is_filled,
+            timeout=timeout,
+            poll_delay=min(timeout, constants.EXIT_CONFIRM_POLL),
+        )
 
 
 def buy(expr):
     Buy.exec(expr)
 
 
+def buy_many(exprs):
+    """
+    One selection pass over every expiration, then the buys run side by side
+    """
+    if not (plays := MultiSelect(exprs, _BUY_SLACK).choose_plays()):
+        dlog.fatal("Could not find any plays!")
+        return
+
+    with ThreadPoolExecutor(max_workers=len(plays)) as executor:
+        futures = {
+            executor.submit(contextvars.copy_context().run, buy_play, expr, d): expr
+            for expr, d in plays.items()
+        }
+        for future in as_completed(futures):
+            if err := future.exception():
+                dlog.error(f"{futures[future]} - buy failed: {err!r}")
+
+
+# Buy.run sys.exit()s when a reselection comes back empty - that must not
+# take the other expirations down
+def buy_play(expr, d):
+    try:
+        Buy.exec(expr, d, max_collateral=d["collateral"] * d["quantity"])
+    except SystemExit:
+        pass
+
+
 def sell():
     Sell.exec()
 
@@ -1,14 +1,20 @@
 from config import config  # pylint: disable=wrong-import-order
 
+import bisect
 import multiprocessing
 import sys
+import time
 from datetime import date
 from pprint import pformat, pprint  # pylint: disable=unused-import
 
+import constants
 import discord_logging as dlog
 import hood
 from decorators import log, retry
 from models import order, condor
+import optimizer
+import order_watcher
+from timing import timed
 
 
 redis = config.redis
@@ -31,13 +37,14 @@ class Buy:
     """
 
     @classmethod
-    def exec(cls, expr):
-        return cls(expr).run()
+    def exec(cls, expr, buy_data=None):
+        return cls(expr, buy_data).run()
 
-    def __init__(self, expr):
+    def __init__(self, expr, buy_data=None):
         self.expr = expr
 
-        self.buy_data = {}
+        # play handed over by the Monitor, used for the first rung
+        self.buy_data = buy_data or {}
 
         self.oid = None
         self.order = None
@@ -47,7 +54,8 @@ class Buy:
     def run(self):
         while self.buy_slack <= 2:
             # 1. Select optimal play
-            self.buy_data = Select.exec(self.expr, self.buy_slack)
+            if not self.buy_data or self.buy_slack != _BUY_SLACK:
+                self.buy_data = Select.exec(self.expr, self.buy_slack)
             if not self.buy_data:
                 dlog.fatal("Could not find any plays!")
                 sys.exit()
@@ -67,17 +75,23 @@ class Buy:
 
             self.buy_slack += 1
 
+    @timed
     @log
     def open_order(self):
         if js := hood.open_condor(self.buy_data["ticker"], self.expr, self.buy_data):
             return order.create(js | self.buy_data["min_ticks"])
         return None
 
+    @timed
     @log
-    @retry(skip_first_delay=False, attempts=10)
     def confirm_order(self):
-        return self.order.sync().is_filled()
+        return order_watcher.wait_for(
+            self.order,
+            order.OrderWrapper.is_filled,
+            timeout=10 * constants.HOOD_API_RETRY_DELAY,
+        )
 
+    @timed
     @log
     def init_condor(self, target_roi=_TARGET_ROI):
         if c := condor.find(self.order.ticker, self.order.expr):
@@ -96,6 +110,7 @@ class Buy:
 
         return condor.new(self.order, self.buy_data).save()
 
+    @timed
     @log
     def cancel_order(self, oid):
         if oid:
@@ -134,6 +149,7 @@ class Select:
     ticker = "SPY"
 
     @classmethod
+    @timed
     def exec(cls, expr, slack, dry_run=False):
         return cls(expr, slack).choose_play(dry_run=dry_run)
 
@@ -169,6 +185,7 @@ class Select:
     def get_option_chain(self, ticker):
         return hood.get_option_chain(ticker, self.expr)
 
+    @timed
     def get_optimal_strikes(
         self,
         multiplier_buy=_OPTIMAL_STRIKE_MULTIPLIER_BUY,
@@ -177,126 +194,14 @@ class Select:
         if not (chain := hood.get_option_chain(self.ticker, self.expr)):
             return None
 
-        d = {"call": {}, "put": {}}
-        roi_sell = (1 + multiplier_sell / 100) * 2
-
-        optimal_call_val_sell = sys.maxsize
-        optimal_put_val_sell = 0
-
-        strike = None
-        strikes = set()
-        chain_data = {"call": {}, "put": {}}
-        for c in chain:
-            try:
-                o_type = c.get("type").lower()
-                strike = float(c.get("strike_price"))
-                ask = float(c.get("ask_price"))
-                bid = float(c.get("bid_price"))
-                mark = float(c.get("mark_price"))
-                min_ticks = c.get("min_ticks")
-
-                strikes.add(strike)
-                chain_data[o_type][strike] = {"ask": ask, "bid": bid}
-            except TypeError:
-                dlog.warn(f"get_optimal_strikes: bad option - {self.ticker} ${strike}")
-                continue
-
-            d["min_ticks"] = min_ticks
-
-            if o_type == "call":
-                target = strike + roi_sell * mark
-                if target < optimal_call_val_sell:
-                    optimal_call_val_sell = target
-
-                    d[o_type]["sell"] = {
-                        "strike": strike,
-                        "ask": ask,
-                        "bid": bid,
-                        "mark": mark,
-                        "target": optimal_call_val_sell,
-                    }
-
-                    d[o_type]["buy"] = {
-                        "strike": strike,
-                        "ask": ask,
-                        "bid": bid,
-                        "mark": mark,
-                        "target": optimal_call_val_sell + 1,
-                    }
-
-            else:
-                target = strike - roi_sell * mark
-                if target > optimal_put_val_sell:
-                    optimal_put_val_sell = target
-                    d[o_type]["sell"] = {
-                        "strike": strike,
-                        "ask": ask,
-                        "bid": bid,
-                        "mark": mark,
-                        "target": optimal_put_val_sell,
-                        "min_ticks": min_ticks,
-                    }
-
-                    d[o_type]["buy"] = {
-                        "strike": strike,
-                        "ask": ask,
-                        "bid": bid,
-                        "mark": mark,
-                        "target": optimal_put_val_sell - 1,
-                        "min_ticks": min_ticks,
-                    }
-
-        # strike extermity check (cleanup: move to validation)
-        strikes = sorted(list(strikes))
-
-        if "buy" not in d["call"] or "buy" not in d["put"]:
-            return None
-        if "sell" not in d["call"] or "sell" not in d["put"]:
-            return None
-
-        if d["call"]["buy"]["strike"] == d["call"]["sell"]["strike"]:
-            i = strikes.index(d["call"]["buy"]["strike"])
-            if i == len(strikes) - 1:
-                dlog.warn("CALL leg: sell target is highest strike")
-                return None
-            d["call"]["buy"]["strike"] = strikes[i + 1]
-            d["call"]["buy"]["ask"] = chain_data["call"][strikes[i + 1]]["ask"]
-            d["call"]["buy"]["bid"] = chain_data["call"][strikes[i + 1]]["bid"]
-
-        if d["put"]["buy"]["strike"] == d["put"]["sell"]["strike"]:
-            i = strikes.index(d["put"]["buy"]["strike"])
-            if i == 0:
-                dlog.warn("PUT leg: sell target is lowest strike")
-                return None
-            d["put"]["buy"]["strike"] = strikes[i - 1]
-            d["put"]["buy"]["ask"] = chain_data["put"][strikes[i - 1]]["ask"]
-            d["put"]["buy"]["bid"] = chain_data["put"][strikes[i - 1]]["bid"]
-        # end srike extermity check
-
-        d["collateral"] = max(
-            d["call"]["buy"]["strike"] - d["call"]["sell"]["strike"],
-            d["put"]["sell"]["strike"] - d["put"]["buy"]["strike"],
-        )
-
-        d["call"]["credit"] = round(
-            d["call"]["sell"]["bid"] - d["call"]["buy"]["ask"], 2
-        )
-        d["put"]["credit"] = round(d["put"]["sell"]["bid"] - d["put"]["buy"]["ask"], 2)
-
-        d["credit"] = d["call"]["credit"] + d["put"]["credit"]
-        d["credit_collateral_ratio"] = d["credit"] / d["collateral"] * 100
-
-        d["credit_with_slack"] = d["credit"] - self.slack * d["collateral"] / 100
-        d["credit_with_slack_collateral_ratio"] = (
-            d["credit_with_slack"] / d["collateral"] * 100
+        return optimizer.optimal_condor(
+            optimizer.Chain(chain, self.ticker),
+            multiplier_buy,
+            multiplier_sell,
+            self.slack,
+            adjacent_wings=True,
         )
 
-        d["multiplier_buy"] = multiplier_buy
-        d["multiplier_sell"] = multiplier_sell
-
-        # pprint(d)
-        return d
-
     def validate(self, d):
         call_data = d["call"]
         put_data = d["put"]
@@ -317,6 +222,112 @@ class Select:
         return d["credit_collateral_ratio"] >= ratio
 
 
+class Monitor:
+    """
+    Watches the SPY chain ahead of entry and hands over the first condor
+    whose credit / collateral ratio crosses the minimum.
+
+    One full chain fetch picks the strikes within `band` of the current
+    legs. Every poll after that is one batched quote of just those
+    instruments, applied as a diff (see optimizer.ChainState)
+    """
+
+    ticker = Select.ticker
+
+    def __init__(
+        self,
+        expr,
+        slack=_BUY_SLACK,
+        band=constants.SPY_MONITOR_BAND,
+        multiplier_buy=_OPTIMAL_STRIKE_MULTIPLIER_BUY,
+        multiplier_sell=_OPTIMAL_STRIKE_MULTIPLIER_SELL,
+    ):
+        self.expr = expr
+        self.slack = slack
+        self.band = band
+        self.multipliers = (multiplier_buy, multiplier_sell)
+
+        self.state = None
+        self.condor = None
+
+    @property
+    def d(self):
+        return self.condor.d if self.condor else None
+
+    @property
+    def stats(self):
+        if not self.condor:
+            return {}
+        return self.state.stats | self.condor.stats
+
+    def running(self, chain):
+        self.state = optimizer.ChainState(chain, self.ticker)
+        self.condor = optimizer.RunningCondor(
+            self.state, *self.multipliers, self.slack, adjacent_wings=True
+        )
+        return self.d
+
+    @timed
+    def load(self):
+        if not (chain := hood.get_option_chain(self.ticker, self.expr)):
+            return False
+        if not self.running(chain):
+            return False
+
+        strikes = [float(s) for s in self.state.chain.strikes]
+        legs = [k for t in ["call", "put"] for k in self.condor.leg_strikes(t)]
+        lo = bisect.bisect_left(strikes, min(legs)) - self.band
+        hi = bisect.bisect_left(strikes, max(legs)) + self.band
+        lo, hi = strikes[max(lo, 0)], strikes[min(hi, len(strikes) - 1)]
+
+        return self.running(
+            [
+                c
+                for c in chain
+                if c.get("strike_price") is not None
+                and lo <= float(c["strike_price"]) <= hi
+            ]
+        )
+
+    def poll(self):
+        quotes = hood.get_option_quotes(list(self.state.rows))
+        return self.condor.update(self.state.apply(quotes))
+
+    def play(self, max_collateral=_MAX_COLLATERAL, max_quantity=_MAX_CONDORS):
+        d = self.d
+        if not (d and Select.validate_collateral(d, max_collateral)):
+            return None
+        if not (quantity := min(max_quantity, max_collateral // d["collateral"])):
+            return None
+        return d | {"ticker": self.ticker, "quantity": quantity}
+
+    @timed
+    def run(
+        self,
+        window=constants.SPY_MONITOR_WINDOW,
+        cadence=constants.SPY_MONITOR_CADENCE,
+        ratio=_MIN_CREDIT_COLLATERAL_RATIO,
+    ):
+        """
+        Polls every `cadence` seconds until the ratio is crossed (returns
+        the play) or `window` seconds pass (None)
+        """
+        if not self.load():
+            return None
+
+        deadline = time.monotonic() + window
+        while True:
+            tick = time.monotonic()
+            if self.d and self.d["credit_collateral_ratio"] >= ratio:
+                if d := self.play():
+                    return d
+            if tick >= deadline:
+                return None
+
+            time.sleep(max(cadence - (time.monotonic() - tick), 0))
+            self.poll()
+
+
 class Sell:
     """
     Sell strategy:
@@ -349,6 +360,16 @@ def buy(expr):
     Buy.exec(expr)
 
 
+def monitor(expr):
+    m = Monitor(expr)
+    d = m.run()
+    dlog.info(f"SPY monitor {expr}: {m.stats}")
+    if not d:
+        dlog.fatal("Could not find any plays!")
+        return
+    Buy.exec(expr, d)
+
+
 def sell():
     Sell.exec()
 
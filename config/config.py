@@ -36,6 +36,8 @@ redis_host = conf.redis.host
 redis_port = conf.redis.port
 os.environ["REDIS_OM_URL"] = f"redis://@{redis_host}:{redis_port}"
 
-from redis_om.connections import get_redis_connection
+# same client redis_om.get_redis_connection() builds, minus importing redis_om
+# (pydantic etc.) on every cron tick. models import redis_om when needed
+import redis as _redis
 
-redis = get_redis_connection()
+redis = _redis.Redis.from_url(os.environ["REDIS_OM_URL"], decode_responses=True)
@@ -1,9 +1,4 @@
 import os
-import google.auth.transport.requests as greq
-
-
-# Google sheets verride default timeout 120s -> 300s
-greq._DEFAULT_TIMEOUT = 300  # pylint: disable=protected-access
 
 # CSVs
 
@@ -12,6 +7,16 @@ BLACKLIST_CSV = "csv/blacklist.csv"
 WEEKLIES_CSV = "csv/weeklies.csv"
 MONTHLIES_CSV = "csv/monthlies.csv"
 
+# Timing spans (rolling daily JSONL)
+
+SPANS_DIR = "spans"
+SPANS_RETENTION_DAYS = 30
+
+# Job profiles (cProfile dumps + top-N summaries)
+
+PROFILES_DIR = "profiles"
+PROFILE_TOP_N = 30
+
 # Defaults
 
 CONSISTENCY_CONSTANT = 3.5 / 0.6745
@@ -34,6 +39,7 @@ RANGE_WEIGHTS = [
 GS_MAIN_SHEET = "stonks"
 GS_CONSTANTS_WORKSHEET = "Constants"
 GS_GF_KILL_SWITCH_CELL = "B7"
+GS_DEFAULT_TIMEOUT = 300
 
 # Big daddy mode
 
@@ -43,3 +49,64 @@ BIG_DADDY_MODE = os.environ.get("BD_MODE")
 
 HOOD_API_MAX_RETRY_ATTEMPTS = 5
 HOOD_API_RETRY_DELAY = 10
+
+# Close loop defaults
+
+CLOSE_MAX_WORKERS = 8
+POSITION_LOCK_TTL_MS = 300 * 1000
+
+# Eject exit ladder (condorer.Close)
+
+EXIT_LADDER_STEPS = [0.01, 0.02, 0.05, 0.10]  # $ per rung, larger near the close
+EXIT_LADDER_WINDOW = 60 * 60  # seconds before the close over which steps grow
+EXIT_REQUOTE_EVERY = 3  # rungs between leg quotes
+EXIT_CONFIRM_TIMEOUT = 5  # seconds a rung waits for a fill
+EXIT_CONFIRM_POLL = 1
+
+# SPY entry monitor (condorer_spy)
+
+SPY_MONITOR_WINDOW = 15 * 60  # seconds polled before the regular entry time
+SPY_MONITOR_CADENCE = 1.0
+SPY_MONITOR_BAND = 10  # strikes watched beyond the current legs
+
+# Order watcher
+
+ORDER_STREAM_MAXLEN = 10000
+ORDER_WATCHER_INTERVAL = 2
+ORDER_WATCHER_LOCK_TTL_MS = 30 * 1000
+ORDER_SYNC_MAX_LOOKBACK = 3600  # seconds, older orders are synced one by one
+
+# Trade archive (closed positions as weekly NumPy parts)
+
+ARCHIVE_DIR = "archive"
+ARCHIVE_AFTER_DAYS = 7
+
+# Compact order encoding (short hash fields, packed legs, dead order TTL)
+
+COMPACT_ORDERS = os.environ.get("COMPACT_ORDERS") == "1"
+DEAD_ORDER_TTL = 14 * 24 * 3600
+
+# Candidate selection (tickers evaluated ahead of the current one)
+
+SELECT_WINDOW = 8
+
+# Buy slack ladder (seconds a selection is reused across slack retries)
+
+BUY_CONFIRM_TIMEOUT = 100 * HOOD_API_RETRY_DELAY  # seconds a rung waits for a fill
+# a rung only moves on once its confirm window is over: reuse the selection
+# for the rung right after the one it was made for, reselect after that
+SELECT_SNAPSHOT_MAX_AGE = BUY_CONFIRM_TIMEOUT + 120
+
+# Chain snapshots + backtests
+
+SNAPSHOTS_DIR = "snapshots"
+RECORD_CHAINS = os.environ.get("RECORD_CHAINS", "1") == "1"
+BACKTEST_FILL_RATIO = 0.5  # limit fills within this share of natural -> mid
+BACKTEST_FILL_WINDOW = 3  # snapshots a buy order rests before the next slack rung
+BACKTEST_PATH_CACHE = 1024
+
+# Parameter sweeps
+
+SWEEP_DIR = "sweeps"
+SWEEP_CHUNK = 16  # parameter sets per worker task
+SWEEP_RANDOM_SAMPLES = 1000
@@ -6,11 +6,9 @@ from datetime import date, datetime, timedelta
 from pprint import pprint as pp  # pylint: disable=unused-import
 
 import dateutil.parser
-import numpy as np
 import pytz
 
 from helpers import key_join
-import hood
 
 r = config.redis
 
@@ -57,6 +55,8 @@ def third_expr_of_month(year, month):
 
 
 def get_exprs_from_api(ticker=_DEFAULT_TICKER, cache=True):
+    import hood  # pylint: disable=import-outside-toplevel
+
     res = hood.get_chains(ticker)["expiration_dates"]
     if cache:
         r.sadd(_EXPR_DATES_SET_KEY, *res)
@@ -122,6 +122,8 @@ def all_exprs_dailies():
 
 
 def get_exprs_from_api_dailies(ticker=_DEFAULT_TICKER_DAILIES, cache=True):
+    import hood  # pylint: disable=import-outside-toplevel
+
     res = hood.get_chains(ticker)["expiration_dates"]
     if cache:
         r.sadd(_EXPR_DATES_SET_KEY_DAILIES, *res)
@@ -156,6 +158,8 @@ def get_market_hours(iso_date, force_api=False, cache=True):
         if res:
             return json.loads(res)
 
+    import hood  # pylint: disable=import-outside-toplevel
+
     res = hood.get_market_hours(iso_date)
     if cache:
         cache_market_hours(iso_date, res)
@@ -335,6 +339,8 @@ def utc_to_local(utc_dt):
 
 
 def week_of_month(iso_date):
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
     d = datetime.fromisoformat(iso_date)
     x = np.array(calendar.monthcalendar(d.year, d.month))
     return np.where(x == d.day)[0][0] + 1
@@ -1,9 +1,15 @@
 import importlib
+from datetime import date
 
 
 def key_join(*segments, delimiter=":"):
     return delimiter.join([str(x) for x in segments])
 
 
+# sorted set score for an ISO date, equal dates -> equal scores
+def date_score(iso_date):
+    return date.fromisoformat(iso_date).toordinal()
+
+
 def reload(mod):
     importlib.reload(mod)
@@ -1,13 +1,44 @@
 from pprint import pprint, pformat  # pylint: disable=unused-import
 import json
-
-import robin_stocks.robinhood as rh
+import threading
 
 import auth
+import constants
 from decorators import retry, log_api
 import discord_logging as log
+from timing import timed
+
+
+class LazyRobinhood:
+    """
+    Defers importing robin_stocks and logging in until the first API call.
+    Keeps `import hood` cheap for runs that never touch the broker.
+    """
+
+    def __init__(self):
+        self.api = None
+        self.login_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.connect(), name)
+
+    # close loops call in from several threads at once
+    def connect(self):
+        with self.login_lock:
+            if self.api is None:
+                import robin_stocks.robinhood  # pylint: disable=import-outside-toplevel
+
+                auth.hood()
+                self.api = robin_stocks.robinhood
+        return self.api
+
+
+rh = LazyRobinhood()
+
+
+def login():
+    return rh.connect()
 
-auth.hood()
 
 _MIC = "XNYS"  # NYSE market code
 
@@ -21,6 +52,7 @@ class HoodException(Exception):
     """
 
 
+@timed
 def get_order_by_id(oid):
     return rh.orders.get_option_order_info(oid)
 
@@ -33,6 +65,18 @@ def get_open_orders():
     return rh.get_open_option_positions()
 
 
+@timed
+def get_orders_since(timestamp):
+    """
+    Every option order updated at or after timestamp (ISO 8601), all pages.
+    One request per page of orders instead of one per order
+    """
+    url = rh.urls.option_orders_url()
+    res = rh.helper.request_get(url, "pagination", {"updated_at[gte]": timestamp})
+    return [js for js in res or [] if js]
+
+
+@timed
 def get_price(ticker):
     return rh.stocks.get_latest_price(ticker)[0]
 
@@ -45,9 +89,10 @@ def get_tradable_options(ticker, expr, option_type=None):
     return rh.find_tradable_options(ticker, expr, optionType=option_type)
 
 
+@timed
 def get_option_chain(ticker, expr):
     try:
-        return rh.options.find_options_by_expiration(ticker, expr)
+        res = rh.options.find_options_by_expiration(ticker, expr)
     except AttributeError as err:
         print(f"Unexpected {err=}, {type(err)=}")
         print(f"Failed to get option chain data for {ticker}")
@@ -57,7 +102,23 @@ def get_option_chain(ticker, expr):
         print(f"Failed to get option chain data for {ticker}")
         return []
 
+    record_chain(ticker, expr, res)
+    return res
 
+
+# every fetch is kept for backtests, never at the cost of the caller
+def record_chain(ticker, expr, chain):
+    if not (constants.RECORD_CHAINS and chain):
+        return
+    try:
+        import snapshots  # pylint: disable=import-outside-toplevel
+
+        snapshots.record(ticker, expr, chain)
+    except Exception as err:  # pylint: disable=broad-except
+        log.warn(f"Failed to record {ticker} {expr} chain: {err!r}")
+
+
+@timed
 def get_option_chain_by_strike(ticker, expr, strike):
     try:
         return rh.options.find_options_by_expiration_and_strike(ticker, expr, strike)
@@ -71,6 +132,7 @@ def get_option_chain_by_strike(ticker, expr, strike):
         return []
 
 
+@timed
 def get_option_chain_by_strike_and_type(ticker, expr, strike, option_type):
     res = get_option_chain_by_strike(ticker, expr, strike)
     for option in res:
@@ -79,6 +141,23 @@ def get_option_chain_by_strike_and_type(ticker, expr, strike, option_type):
     return None
 
 
+@timed
+def get_option_instruments(chain_id, expr):
+    url = rh.urls.option_instruments_url()
+    params = {"chain_id": chain_id, "expiration_dates": expr, "state": "active"}
+    return [js for js in rh.helper.request_get(url, "pagination", params) or [] if js]
+
+
+@timed
+def get_option_quotes(ids):
+    """
+    Market data for several option instruments in one request
+    """
+    url = rh.urls.marketdata_options_url()
+    res = rh.helper.request_get(url, "results", {"ids": ",".join(ids)})
+    return [js for js in res or [] if js]
+
+
 def get_market_hours(iso_date):
     return rh.get_market_hours(_MIC, iso_date)
 
@@ -123,6 +202,7 @@ def get_ticks(ticker):
     return {"min_ticks": rh.get_chains(ticker)["min_ticks"]}
 
 
+@timed
 @log_api
 @retry(_API_RETRY_TRIES, _API_RETRY_DELAY)
 def buy_to_open(ticker, expr, o_type, d):
@@ -149,6 +229,7 @@ def buy_to_open(ticker, expr, o_type, d):
     return None
 
 
+@timed
 @log_api
 @retry(_API_RETRY_TRIES, _API_RETRY_DELAY)
 def sell_to_close(o, price, time_in_force="gfd"):
@@ -179,14 +260,13 @@ def sell_to_close(o, price, time_in_force="gfd"):
 
     Order Info:
 
-    {pformat(o.__dict__)}"""
+    {pformat(o.to_dict())}"""
         )
 
     return None
 
 
-@retry(_API_RETRY_TRIES + 1, _API_RETRY_DELAY, skip_first_delay=False)
-def cancel_order(oid):
+def _cancel_order(oid):
     # empty result indicates success
     if res := rh.orders.cancel_option_order(oid):
         log.warn(f"cancel_order API failed for {oid}:\n\n{res}")
@@ -194,6 +274,20 @@ def cancel_order(oid):
     return True
 
 
+@timed
+@retry(_API_RETRY_TRIES + 1, _API_RETRY_DELAY, skip_first_delay=False)
+def cancel_order(oid):
+    return _cancel_order(oid)
+
+
+# no delay before the first attempt - the exit ladder cancels on every rung
+@timed
+@retry(_API_RETRY_TRIES, _API_RETRY_DELAY)
+def cancel_order_now(oid):
+    return _cancel_order(oid)
+
+
+@timed
 @log_api
 @retry(_API_RETRY_TRIES, _API_RETRY_DELAY)
 def open_condor(ticker, expr, d):
@@ -258,6 +352,7 @@ def open_condor(ticker, expr, d):
     return None
 
 
+@timed
 @log_api
 @retry(_API_RETRY_TRIES, _API_RETRY_DELAY)
 def close_condor(_condor, slack=0.00, price=0.00):
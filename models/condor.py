@@ -15,8 +15,9 @@ import date_helpers as dh
 import discord_logging as dlog
 import notifications
 
-from helpers import key_join
+from helpers import date_score, key_join
 from models import order
+from mutex import Mutex, fence_key
 
 redis = config.redis
 
@@ -25,11 +26,17 @@ redis = config.redis
 NS_INDEX = "i"
 NS_CONDOR = "condor"
 NS_STATE = "state"
+NS_CREATED = "created"
+NS_EXPR = "expr"
 
 # condor indexes
 
 INDEX_STATE = key_join(NS_INDEX, NS_CONDOR, NS_STATE)
 
+# sorted per state: i:condor:created:<state> / i:condor:expr:<state>
+INDEX_CREATED = key_join(NS_INDEX, NS_CONDOR, NS_CREATED)
+INDEX_EXPR = key_join(NS_INDEX, NS_CONDOR, NS_EXPR)
+
 # condor states
 
 _STATE_BUY_FILLED = "buy_filled"
@@ -51,6 +58,12 @@ _ALL_STATE_INDEXES = [
     _FAILED_CONDOR_INDEX,
 ]
 
+_ALL_STATES = [_STATE_BUY_FILLED, _STATE_SELL_CONFIRMED, _STATE_CLOSED, _STATE_FAILED]
+
+_ALL_SORTED_INDEXES = [
+    key_join(i, state) for i in [INDEX_CREATED, INDEX_EXPR] for state in _ALL_STATES
+]
+
 
 class CondorWrapper:
     """
@@ -59,7 +72,6 @@ class CondorWrapper:
 
     mutable_attrs = [
         "result",
-        "locked",
         "sell_oid",
     ]
 
@@ -71,18 +83,25 @@ class CondorWrapper:
     def get(cls, pk):
         return cls(cls.Condor.get(pk))
 
-    def __init__(self, _condor):
+    # bulk loaders pass in prefetched state + orders (see find_many)
+    def __init__(self, _condor, state=None, orders=None):
         self.c = _condor
         for k, v in vars(self.c).items():
             setattr(self, k, v)
 
         self.ticker, self.expr = self.c.pk.split(":")
-        self.state = self.current_state()
+        self.state = state or self.current_state()
+        self.mutex = None
 
-        self.o = order.find(self.oid)
+        orders = orders or {}
+        self.o = orders[self.oid] if self.oid in orders else order.find(self.oid)
         self.sell_o = None
         if self.sell_oid:
-            self.sell_o = order.find(self.sell_oid)
+            self.sell_o = (
+                orders[self.sell_oid]
+                if self.sell_oid in orders
+                else order.find(self.sell_oid)
+            )
 
         self.created_at = self.o.created_at
 
@@ -97,23 +116,46 @@ class CondorWrapper:
         return self
 
     def sync(self):
-        self.o.sync()
-        if self.sell_oid:
-            self.sell_o.sync()
+        order.sync_many([self.o, self.sell_o if self.sell_oid else None])
         return self
 
     ### condor state logic ###
 
+    # MULTI/EXEC so the position is never in zero or two state indexes
     def change_to_state(self, to_state, from_state=None):
-        if from_state:
-            redis.srem(key_join(INDEX_STATE, from_state), self.pk)
-
-        redis.sadd(key_join(INDEX_STATE, to_state), self.pk)
+        def queue(pipe):
+            if from_state:
+                pipe.srem(key_join(INDEX_STATE, from_state), self.pk)
+                self.unindex(pipe, from_state)
+            pipe.sadd(key_join(INDEX_STATE, to_state), self.pk)
+            self.index(pipe, to_state)
+
+        with redis.pipeline() as pipe:
+            # under the close lock only while it's still ours (LockLost)
+            if self.mutex:
+                self.mutex.fenced(pipe, queue)
+            else:
+                queue(pipe)
+                pipe.execute()
         setattr(self, "state", to_state)
 
+    def index(self, pipe, state):
+        created = self.created_at.timestamp()
+        pipe.zadd(key_join(INDEX_CREATED, state), {self.pk: created})
+        pipe.zadd(key_join(INDEX_EXPR, state), {self.pk: date_score(self.expr)})
+
+    def unindex(self, pipe, state):
+        pipe.zrem(key_join(INDEX_CREATED, state), self.pk)
+        pipe.zrem(key_join(INDEX_EXPR, state), self.pk)
+
+    # one round trip of SISMEMBERs instead of SMEMBERS on every index
     def current_state(self):
-        for i in _ALL_STATE_INDEXES:
-            if self.pk in redis.smembers(i):
+        with redis.pipeline(transaction=False) as pipe:
+            for i in _ALL_STATE_INDEXES:
+                pipe.sismember(i, self.pk)
+            res = pipe.execute()
+        for i, is_member in zip(_ALL_STATE_INDEXES, res):
+            if is_member:
                 return i.rsplit(":", 1)[1]
         return "unknown"
 
@@ -147,17 +189,31 @@ class CondorWrapper:
     ### uncategorized ###
 
     def delete(self):
-        for i in _ALL_STATE_INDEXES:
-            redis.srem(i, self.pk)
+        with redis.pipeline() as pipe:
+            for i in _ALL_STATE_INDEXES:
+                pipe.srem(i, self.pk)
+            for i in _ALL_SORTED_INDEXES:
+                pipe.zrem(i, self.pk)
+            pipe.delete(fence_key(self.lock_name()))
+            pipe.execute()
         self.c.delete(self.pk)
 
+    # returns the fencing token or None if someone else holds the lock
     def lock(self):
-        self.locked = 1
-        self.save()
+        self.mutex = Mutex(self.lock_name())
+        return self.mutex.acquire()
+
+    def lock_name(self):
+        return key_join(NS_CONDOR, self.pk)
 
     def unlock(self):
-        self.locked = 0
-        self.save()
+        if self.mutex:
+            self.mutex.release()
+            self.mutex = None
+
+    # long eject loops push the lock TTL out as they go
+    def refresh_lock(self):
+        return self.mutex is None or self.mutex.extend()
 
     def dte(self):
         created_at = self.buy_call_o.created_at
@@ -185,7 +241,6 @@ class CondorWrapper:
         oid: str
         sell_oid: Optional[str]
         result: Optional[str]
-        locked: Optional[int]
 
         credit: float
         collateral: float
@@ -207,6 +262,41 @@ def find_by_pk(pk):
     return CondorWrapper.get(pk)
 
 
+def find_many(pks):
+    """
+    Loads condors in a constant number of round trips:
+    1. condor hashes + state index membership for every pk
+    2. every referenced buy / sell order
+    Missing condors are skipped
+    """
+    pks = list(pks)
+    model = CondorWrapper.Condor
+    stride = 1 + len(_ALL_STATE_INDEXES)
+
+    with redis.pipeline(transaction=False) as pipe:
+        for pk in pks:
+            pipe.hgetall(model.make_primary_key(pk))
+            for i in _ALL_STATE_INDEXES:
+                pipe.sismember(i, pk)
+        res = pipe.execute()
+
+    loaded = []
+    for n in range(len(pks)):
+        doc, *is_member = res[n * stride : (n + 1) * stride]
+        if not doc:
+            continue
+        state = next(
+            (i.rsplit(":", 1)[1] for i, m in zip(_ALL_STATE_INDEXES, is_member) if m),
+            "unknown",
+        )
+        loaded.append((model.parse_obj(doc), state))
+
+    orders = order.find_many(
+        oid for c, _ in loaded for oid in (c.oid, c.sell_oid) if oid
+    )
+    return [CondorWrapper(c, state=state, orders=orders) for c, state in loaded]
+
+
 def exists(ticker, expr):
     try:
         return find(ticker, expr)
@@ -227,7 +317,6 @@ def new(o, buy_data):
         multiplier_buy=buy_data["multiplier_buy"],
         multiplier_sell=buy_data["multiplier_sell"],
         target_roi=buy_data["target_roi"],
-        locked=0,
     )
 
 
@@ -235,26 +324,72 @@ def seconds_until_expr(o):
     return dh.market_seconds_until_expr(o.expr, o.created_at)
 
 
-def buy_filled_condors():
-    res = [find_by_pk(s) for s in redis.smembers(_BUY_FILLED_CONDOR_INDEX)]
+def sorted_index(index, state):
+    """
+    Sorted index for a state. Backfills positions that only made it into the
+    state set (indexed before the sorted indexes existed)
+    """
+    key = key_join(index, state)
+    with redis.pipeline(transaction=False) as pipe:
+        pipe.scard(key_join(INDEX_STATE, state))
+        pipe.zcard(key)
+        n_state, n_sorted = pipe.execute()
+
+    if n_state != n_sorted:
+        pks = redis.smembers(key_join(INDEX_STATE, state))
+        condors = find_many(pks)
+        with redis.pipeline() as pipe:
+            for i in [INDEX_CREATED, INDEX_EXPR]:
+                pipe.delete(key_join(i, state))
+            for c in condors:
+                c.index(pipe, state)
+            # drop pks whose condor hash is gone
+            for pk in pks - {c.pk for c in condors}:
+                pipe.srem(key_join(INDEX_STATE, state), pk)
+            pipe.execute()
+    return key
+
+
+def condors_in_state(state):
+    return find_many(redis.zrange(sorted_index(INDEX_CREATED, state), 0, -1))
+
+
+def condors_opened_between(start, end, state=_STATE_CLOSED):
+    """
+    start / end are datetimes, both inclusive
+    """
+    key = sorted_index(INDEX_CREATED, state)
+    return find_many(redis.zrangebyscore(key, start.timestamp(), end.timestamp()))
+
+
+def condors_expiring_on(iso_date, state=_STATE_CLOSED):
+    key = sorted_index(INDEX_EXPR, state)
+    score = date_score(iso_date)
+    res = find_many(redis.zrangebyscore(key, score, score))
     res.sort(key=operator.attrgetter("created_at"))
     return res
 
 
+# exclusive of iso_date
+def closed_condors_expiring_before(iso_date):
+    key = sorted_index(INDEX_EXPR, _STATE_CLOSED)
+    return find_many(redis.zrangebyscore(key, "-inf", f"({date_score(iso_date)}"))
+
+
+def buy_filled_condors():
+    return condors_in_state(_STATE_BUY_FILLED)
+
+
 def sell_confirmed_condors():
-    res = [find_by_pk(s) for s in redis.smembers(_SELL_CONFIRMED_CONDOR_INDEX)]
-    res.sort(key=operator.attrgetter("created_at"))
-    return res
+    return condors_in_state(_STATE_SELL_CONFIRMED)
 
 
 def closed_condors():
-    res = [find_by_pk(s) for s in redis.smembers(_CLOSED_CONDOR_INDEX)]
-    res.sort(key=operator.attrgetter("created_at"))
-    return res
+    return condors_in_state(_STATE_CLOSED)
 
 
 def closed_condors_for_week_ending(iso_date):
-    return [s for s in closed_condors() if s.expr == iso_date]
+    return condors_expiring_on(iso_date, _STATE_CLOSED)
 
 
 def publish_eow_results(iso_date=None):
@@ -266,8 +401,12 @@ def publish_eow_results(iso_date=None):
 
 def remove_condor_from_state_indexes(_condor):
     try:
-        for i in _ALL_STATE_INDEXES:
-            redis.srem(i, _condor.pk)
+        with redis.pipeline() as pipe:
+            for i in _ALL_STATE_INDEXES:
+                pipe.srem(i, _condor.pk)
+            for i in _ALL_SORTED_INDEXES:
+                pipe.zrem(i, _condor.pk)
+            pipe.execute()
     except NotFoundError:
         pass
 
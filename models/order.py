@@ -8,7 +8,8 @@ from typing import Optional  # pylint: disable=unused-import
 from redis_om import HashModel
 from redis_om.model.model import NotFoundError
 
-from helpers import key_join  # pylint: disable=unused-import
+import constants
+from helpers import key_join
 import hood
 
 
@@ -33,11 +34,125 @@ RH_ORDER_FINAL_STATES = [
     _RH_ORDER_FAILED,
 ]
 
+# strangle sell fill totals
+
+NS_SELL_TOTALS = "sell_totals"
+
+# KEYS: order hash, sell totals hash
+# ARGV: option type, new processed quantity, new processed premium, hash fields...
+# totals move by the difference to what's stored, read + written in one step
+# so concurrent syncs of the same order can't double count.
+# Only an existing totals hash is moved: a missing one (strangles opened
+# before totals were kept) is rebuilt whole by its reader from the orders.
+# Stored hash may be in either encoding, it's rewritten whole
+_SAVE_SELL_ORDER_SCRIPT = redis.register_script(
+    """
+local function stored(short, long)
+    local v = redis.call("hget", KEYS[1], short) or redis.call("hget", KEYS[1], long)
+    return tonumber(v or "0")
+end
+local q = stored("xq", "processed_quantity")
+local p = stored("xm", "processed_premium")
+redis.call("del", KEYS[1])
+redis.call("hset", KEYS[1], unpack(ARGV, 4))
+if redis.call("exists", KEYS[2]) == 0 then
+    return 1
+end
+if tonumber(ARGV[2]) ~= q then
+    redis.call("hincrbyfloat", KEYS[2], ARGV[1] .. ":quantity", tonumber(ARGV[2]) - q)
+end
+if tonumber(ARGV[3]) ~= p then
+    redis.call("hincrbyfloat", KEYS[2], ARGV[1] .. ":premium", tonumber(ARGV[3]) - p)
+end
+return 1
+"""
+)
+
+# KEYS: sell totals hash, call sell order zset, put sell order zset
+# ARGV: order hash key prefix
+# totals for strangles opened before they were kept, summed from the stored
+# order hashes and written in one step so a sell save can't land in between
+# (the save script leaves a missing totals hash alone). An existing hash is
+# returned as is. Returns the totals as field, value pairs
+_REBUILD_SELL_TOTALS_SCRIPT = redis.register_script(
+    """
+if redis.call("exists", KEYS[1]) == 1 then
+    return redis.call("hgetall", KEYS[1])
+end
+local function stored(key, short, long)
+    local v = redis.call("hget", key, short) or redis.call("hget", key, long)
+    return tonumber(v or "0")
+end
+local res = {}
+for i, o_type in ipairs({"call", "put"}) do
+    local q, p = 0, 0
+    for _, oid in ipairs(redis.call("zrange", KEYS[i + 1], 0, -1)) do
+        q = q + stored(ARGV[1] .. oid, "xq", "processed_quantity")
+        p = p + stored(ARGV[1] .. oid, "xm", "processed_premium")
+    end
+    table.insert(res, o_type .. ":quantity")
+    table.insert(res, tostring(q))
+    table.insert(res, o_type .. ":premium")
+    table.insert(res, tostring(p))
+end
+redis.call("hset", KEYS[1], unpack(res))
+return res
+"""
+)
+
+# compact encoding
+
+COMPACT_FIELDS = {
+    "pk": "i",
+    "chain_symbol": "t",
+    "chain_id": "c",
+    "direction": "d",
+    "state": "s",
+    "price": "p",
+    "quantity": "q",
+    "pending_quantity": "pq",
+    "processed_quantity": "xq",
+    "premium": "m",
+    "processed_premium": "xm",
+    "cutoff_price": "cp",
+    "above_tick": "at",
+    "below_tick": "bt",
+    "created_at": "ca",
+    "updated_at": "ua",
+    "legs": "l",
+}
+
+FULL_FIELDS = {v: k for k, v in COMPACT_FIELDS.items()}
+
+# the only leg keys anything reads, packed as "v|v|v;v|v|v"
+LEG_FIELDS = [
+    "expiration_date",
+    "option_type",
+    "strike_price",
+    "side",
+    "position_effect",
+]
+
+# no contracts traded - nothing left to account for once they're final
+_DEAD_ORDER_STATES = [_RH_ORDER_REJECTED, _RH_ORDER_CANCELLED, _RH_ORDER_FAILED]
+
+
+def pack_legs(legs):
+    return ";".join("|".join(str(leg[k]) for k in LEG_FIELDS) for leg in legs)
+
+
+def unpack_legs(v):
+    return [dict(zip(LEG_FIELDS, leg.split("|"))) for leg in v.split(";")]
+
 
 class OrderWrapper:
     """
-    Wrapper to extend redis_om functionality since its behavior is somewhat magical.
-    Best strategy is to keep the models as concise as possible.
+    Slotted record over an order hash.
+
+    redis_om is only used to validate orders coming from the hood API (new)
+    and for the key layout. Loading from redis builds the record straight
+    from HGETALL, and legs / datetimes are parsed on first access, so
+    scanning order history stays cheap.
     """
 
     class Order(HashModel):
@@ -66,6 +181,20 @@ class OrderWrapper:
 
     order_fields = list(Order.__fields__.keys())
 
+    string_fields = ["pk", "chain_symbol", "chain_id", "direction", "state"]
+
+    float_fields = [
+        "price",
+        "quantity",
+        "pending_quantity",
+        "processed_quantity",
+        "premium",
+        "processed_premium",
+        "cutoff_price",
+        "above_tick",
+        "below_tick",
+    ]
+
     mutable_attrs_order = [
         "updated_at",
         "price",
@@ -77,6 +206,11 @@ class OrderWrapper:
         "processed_premium",
     ]
 
+    # raw values (str / datetime) for the lazily parsed fields
+    # + encoding of the stored hash
+    __slots__ = string_fields + float_fields
+    __slots__ += ["_created_at", "_updated_at", "_legs", "_stored_compact"]
+
     @classmethod
     def parse(cls, js):
         d = js.copy()
@@ -86,76 +220,194 @@ class OrderWrapper:
 
     @classmethod
     def new(cls, js):
-        return cls(cls.Order(**cls.parse(js)))
+        return cls(cls.Order(**cls.parse(js)).dict())
 
     @classmethod
     def find(cls, oid):
-        return cls(cls.Order.get(oid))
-
-    def __init__(self, _order):
-        self.o = _order
-
-        for k, v in vars(self.o).items():
-            if k in self.order_fields:
-                setattr(self, k, v)
-
-        # aliases
-        self.id = self.pk
-        self.ticker = self.chain_symbol
-
-        # ticks
-        self.min_ticks = {
-            "above_tick": _order.above_tick,
-            "below_tick": _order.below_tick,
-            "cutoff_price": _order.cutoff_price,
+        if not (doc := redis.hgetall(cls.Order.make_primary_key(oid))):
+            raise NotFoundError
+        return cls(doc)
+
+    def __init__(self, doc):
+        self._stored_compact = "i" in doc
+        if self._stored_compact:
+            doc = {FULL_FIELDS[k]: v for k, v in doc.items()}
+
+        for k in self.string_fields:
+            setattr(self, k, doc[k])
+        for k in self.float_fields:
+            setattr(self, k, float(doc[k]))
+
+        self._created_at = doc["created_at"]
+        self._updated_at = doc["updated_at"]
+        self._legs = doc["legs"]
+
+    ### lazily parsed fields ###
+
+    @staticmethod
+    def parse_datetime(v):
+        return dt.datetime.fromisoformat(v) if isinstance(v, str) else v
+
+    @staticmethod
+    def format_datetime(v):
+        return v.isoformat() if isinstance(v, dt.datetime) else v
+
+    @property
+    def created_at(self):
+        self._created_at = self.parse_datetime(self._created_at)
+        return self._created_at
+
+    @property
+    def updated_at(self):
+        self._updated_at = self.parse_datetime(self._updated_at)
+        return self._updated_at
+
+    @updated_at.setter
+    def updated_at(self, v):
+        self._updated_at = v
+
+    @property
+    def legs(self):
+        if isinstance(self._legs, str):
+            if self._legs.startswith("["):
+                self._legs = json.loads(self._legs)
+            else:
+                self._legs = unpack_legs(self._legs)
+        return self._legs
+
+    ### aliases + derived fields ###
+
+    @property
+    def id(self):
+        return self.pk
+
+    @property
+    def ticker(self):
+        return self.chain_symbol
+
+    @property
+    def min_ticks(self):
+        return {
+            "above_tick": self.above_tick,
+            "below_tick": self.below_tick,
+            "cutoff_price": self.cutoff_price,
         }
 
-        # unpack + override legs
-        self.legs = json.loads(self.legs)
-
-        # assumption is that all leg expirations are the same
-        self.expr = self.legs[0]["expiration_date"]
-
-        # strangle specific params
-        if len(self.legs) == 1:
-            self.option_type = self.legs[0]["option_type"]
-            self.strike_price = self.legs[0]["strike_price"]
-
-            # pretty formatting for logging and such
-            strike = round(float(self.strike_price), 2)
-            if round(strike % 1, 2) == 0.00:
-                strike = int(strike)
-            self.human_id = " ".join(
-                [
-                    self.expr,
-                    self.chain_symbol,
-                    "$" + str(strike),
-                    self.option_type.upper(),
-                ]
-            )
-
-        self.actual_price = 0
-        if float(self.o.processed_quantity) > 0:
-            self.actual_price = (
-                float(self.o.processed_premium) / float(self.o.processed_quantity) / 100
-            )
+    # assumption is that all leg expirations are the same
+    @property
+    def expr(self):
+        return self.legs[0]["expiration_date"]
+
+    # strangle specific params - only defined on single legged orders
+    def single_leg(self, k):
+        if len(self.legs) != 1:
+            raise AttributeError(k)
+        return self.legs[0][k]
+
+    @property
+    def option_type(self):
+        return self.single_leg("option_type")
+
+    @property
+    def strike_price(self):
+        return self.single_leg("strike_price")
+
+    # pretty formatting for logging and such
+    @property
+    def human_id(self):
+        strike = round(float(self.strike_price), 2)
+        if round(strike % 1, 2) == 0.00:
+            strike = int(strike)
+        return " ".join(
+            [self.expr, self.chain_symbol, "$" + str(strike), self.option_type.upper()]
+        )
+
+    @property
+    def actual_price(self):
+        if self.processed_quantity > 0:
+            return self.processed_premium / self.processed_quantity / 100
+        return 0
+
+    ### persistence ###
+
+    def key(self):
+        return self.Order.make_primary_key(self.pk)
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self.order_fields}
+
+    # same encoding HashModel.save() writes
+    def to_hash(self):
+        d = {k: getattr(self, k) for k in self.string_fields + self.float_fields}
+        d["created_at"] = self.format_datetime(self._created_at)
+        d["updated_at"] = self.format_datetime(self._updated_at)
+        d["legs"] = json.dumps(self.legs)
+        if isinstance(self._legs, str) and self._legs.startswith("["):
+            d["legs"] = self._legs  # stored JSON as is, no need to parse it
+        return d
+
+    def to_compact_hash(self):
+        d = {COMPACT_FIELDS[k]: v for k, v in self.to_hash().items()}
+        d["l"] = pack_legs(self.legs)
+        return d
+
+    def encode(self):
+        return self.to_compact_hash() if constants.COMPACT_ORDERS else self.to_hash()
+
+    def is_dead(self):
+        return self.state in _DEAD_ORDER_STATES and self.processed_quantity == 0
+
+    @property
+    def o(self):
+        return self.Order.parse_obj(self.to_hash())
+
+    # single legged credit orders are strangle sells
+    def is_strangle_sell(self):
+        return self.direction == "credit" and len(self.legs) == 1
 
     def save(self, d=None):
-        for k, v in (d or vars(self)).items():
+        for k, v in (d or {}).items():
             if k in self.mutable_attrs_order:
-                setattr(self, k, v)
-                setattr(self.o, k, v)
-        self.o.save()
-
-        if float(self.o.processed_quantity) > 0:
-            self.actual_price = (
-                float(self.o.processed_premium) / float(self.o.processed_quantity) / 100
-            )
+                setattr(self, k, float(v) if k in self.float_fields else v)
+
+        h = self.encode()
+        with redis.pipeline() as pipe:
+            if self.is_strangle_sell():
+                _SAVE_SELL_ORDER_SCRIPT(
+                    keys=[self.key(), sell_totals_key(self.ticker, self.expr)],
+                    args=[
+                        self.option_type,
+                        self.processed_quantity,
+                        self.processed_premium,
+                        *[x for kv in h.items() for x in kv],
+                    ],
+                    client=pipe,
+                )
+            else:
+                # switching encodings, drop the old field names
+                if self._stored_compact != constants.COMPACT_ORDERS:
+                    pipe.delete(self.key())
+                pipe.hset(self.key(), mapping=h)
+            if constants.COMPACT_ORDERS and self.is_dead():
+                pipe.expire(self.key(), constants.DEAD_ORDER_TTL)
+            pipe.execute()
+
+        self._stored_compact = constants.COMPACT_ORDERS
         return self
 
+    def delete(self):
+        identity_map.orders.pop(self.id, None)
+        return redis.delete(self.key())
+
     def sync(self):
         return self.save(self.parse(hood.get_order_by_id(self.id)))
 
+    # pick up what another process (order watcher) saved
+    def refresh(self):
+        if doc := redis.hgetall(self.key()):
+            self.__init__(doc)
+        return self
+
     def is_put(self):
         return self.option_type == "put"
 
@@ -186,19 +438,199 @@ class OrderWrapper:
         return self.sync()
 
     def debug(self):
-        pprint(self.o.__dict__)
+        pprint(self.to_dict())
+
+
+def sell_totals_key(ticker, expr):
+    return key_join(NS_SELL_TOTALS, ticker, expr)
+
+
+def rebuild_sell_totals(ticker, expr, call_oids_key, put_oids_key):
+    res = _REBUILD_SELL_TOTALS_SCRIPT(
+        keys=[sell_totals_key(ticker, expr), call_oids_key, put_oids_key],
+        args=[OrderWrapper.Order.make_primary_key("")],
+    )
+    return dict(zip(res[::2], res[1::2]))
+
+
+def sync_many(orders, max_lookback=constants.ORDER_SYNC_MAX_LOOKBACK):
+    """
+    Syncs orders with a single paginated list call: everything updated since
+    the oldest stored updated_at. Orders missing from the response haven't
+    changed since they were last saved.
+
+    Final orders can't change and are left alone. Orders not updated within
+    max_lookback seconds are synced one by one rather than paging through
+    all the order history since then
+    """
+    if not (orders := [o for o in orders if o]):
+        return orders
+
+    cutoff = dt.datetime.now(dt.timezone.utc) - dt.timedelta(seconds=max_lookback)
+    recent = []
+    for o in orders:
+        if o.state in RH_ORDER_FINAL_STATES:
+            continue
+        if utc(o.updated_at) < cutoff:
+            o.sync()
+        else:
+            recent.append(o)
+
+    if recent:
+        since = min(utc(o.updated_at) for o in recent)
+        res = {js["id"]: js for js in hood.get_orders_since(since.isoformat())}
+        for o in recent:
+            if js := res.get(o.id):
+                o.save(o.parse(js))
+    return orders
+
+
+# hood timestamps are UTC, naive ones included
+def utc(d):
+    return d if d.tzinfo else d.replace(tzinfo=dt.timezone.utc)
+
+
+class IdentityMap:
+    """
+    Orders loaded during a run, keyed by id. find() hands back the same
+    instance every time and save() / sync() update that instance in place,
+    so repeated lookups in the close logic never go back to redis.
+    """
+
+    def __init__(self):
+        self.orders = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, oid):
+        if o := self.orders.get(oid):
+            self.hits += 1
+            return o
+        self.misses += 1
+        return None
+
+    def add(self, o):
+        if o:
+            self.orders[o.id] = o
+        return o
+
+    def clear(self):
+        self.orders.clear()
+        self.hits, self.misses = 0, 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.orders),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+identity_map = IdentityMap()
 
 
 def find(oid):
+    if o := identity_map.get(oid):
+        return o
     try:
-        return OrderWrapper.find(oid)
+        return identity_map.add(OrderWrapper.find(oid))
     except NotFoundError:
         return None
 
 
+def find_many(oids):
+    """
+    Orders not already in the identity map are fetched with HGETALL in a
+    single pipeline round trip.
+    Returns {oid: OrderWrapper}, orders that don't exist map to None
+    """
+    oids = [oid for oid in dict.fromkeys(oids) if oid]
+    res = {oid: identity_map.get(oid) for oid in oids}
+    missing = [oid for oid, o in res.items() if not o]
+
+    model = OrderWrapper.Order
+    with redis.pipeline(transaction=False) as pipe:
+        for oid in missing:
+            pipe.hgetall(model.make_primary_key(oid))
+        docs = pipe.execute()
+    for oid, doc in zip(missing, docs):
+        res[oid] = identity_map.add(OrderWrapper(doc)) if doc else None
+    return res
+
+
 def create(js):
-    return OrderWrapper.new(js).save()
+    return identity_map.add(OrderWrapper.new(js).save())
+
+
+#########################
+# MIGRATION + REPORTING #
+#########################
+
+
+def order_keys():
+    return redis.scan_iter(OrderWrapper.Order.make_primary_key("*"), count=1000)
+
+
+def migrate(compact=True, batch=500):
+    """
+    Rewrites every order hash in the given encoding (compact=False reverts).
+    Saved through OrderWrapper.save so sell totals and TTLs stay consistent
+    """
+    constants.COMPACT_ORDERS = compact
+    keys, n = [], 0
+    for k in order_keys():
+        keys.append(k)
+        if len(keys) == batch:
+            n += migrate_keys(keys)
+            keys = []
+    return n + migrate_keys(keys)
+
+
+def migrate_keys(keys):
+    with redis.pipeline(transaction=False) as pipe:
+        for k in keys:
+            pipe.hgetall(k)
+        docs = pipe.execute()
+
+    n = 0
+    for doc in docs:
+        if doc and ("i" in doc) != constants.COMPACT_ORDERS:
+            OrderWrapper(doc).save()
+            n += 1
+    return n
+
+
+def memory_report(sample=1000):
+    """
+    MEMORY USAGE over a sample of order hashes, extrapolated to all of them
+    """
+    keys = list(order_keys())
+    with redis.pipeline(transaction=False) as pipe:
+        for k in keys[:sample]:
+            pipe.memory_usage(k)
+            pipe.hexists(k, "i")
+            pipe.ttl(k)
+        res = pipe.execute()
+
+    sizes, compact, ttls = res[::3], res[1::3], res[2::3]
+    avg = sum(x or 0 for x in sizes) / len(sizes) if sizes else 0
+    return {
+        "orders": len(keys),
+        "sampled": len(sizes),
+        "compact_share": round(sum(compact) / len(compact), 4) if compact else 0,
+        "avg_bytes": round(avg),
+        "est_total_bytes": round(avg * len(keys)),
+        "expiring": sum(1 for t in ttls if t > 0),
+        "used_memory": redis.info("memory").get("used_memory_human"),
+    }
 
 
 if __name__ == "__main__":
-    pass
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        print(f"Migrated {migrate('--revert' not in sys.argv)} orders")
+    else:
+        pprint(memory_report())
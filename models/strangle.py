@@ -14,8 +14,9 @@ from redis_om.model.model import NotFoundError
 import date_helpers as dh
 import notifications
 
-from helpers import key_join
+from helpers import date_score, key_join
 from models import order
+from mutex import Mutex, fence_key
 
 redis = config.redis
 
@@ -24,6 +25,8 @@ redis = config.redis
 NS_INDEX = "i"
 NS_STRANGLE = "strangle"
 NS_STATE = "state"
+NS_CREATED = "created"
+NS_EXPR = "expr"
 NS_SELL_ORDERS_CALLS = "sell_orders:calls"
 NS_SELL_ORDERS_PUTS = "sell_orders:puts"
 
@@ -31,6 +34,10 @@ NS_SELL_ORDERS_PUTS = "sell_orders:puts"
 
 INDEX_STATE = key_join(NS_INDEX, NS_STRANGLE, NS_STATE)
 
+# sorted per state: i:strangle:created:<state> / i:strangle:expr:<state>
+INDEX_CREATED = key_join(NS_INDEX, NS_STRANGLE, NS_CREATED)
+INDEX_EXPR = key_join(NS_INDEX, NS_STRANGLE, NS_EXPR)
+
 # strangle states
 
 _STATE_ACTIVE = "active"
@@ -49,6 +56,12 @@ _ALL_STATE_INDEXES = [
     _FAILED_STRANGLE_INDEX,
 ]
 
+_ALL_STATES = [_STATE_ACTIVE, _STATE_CLOSED, _STATE_FAILED]
+
+_ALL_SORTED_INDEXES = [
+    key_join(i, state) for i in [INDEX_CREATED, INDEX_EXPR] for state in _ALL_STATES
+]
+
 # other
 
 _MIN_MINUTES_BEFORE_CLOSE = 3
@@ -61,7 +74,6 @@ class StrangleWrapper:
 
     mutable_attrs = [
         "result",
-        "locked",
     ]
 
     @classmethod
@@ -72,7 +84,8 @@ class StrangleWrapper:
     def get(cls, pk):
         return cls(cls.Strangle.get(pk))
 
-    def __init__(self, _strangle):
+    # bulk loaders pass in prefetched state + orders (see find_many)
+    def __init__(self, _strangle, state=None, orders=None):
         self.s = _strangle
         for k, v in vars(self.s).items():
             setattr(self, k, v)
@@ -82,13 +95,17 @@ class StrangleWrapper:
             self.s.eject_sec_to_expr, self.expr
         )
 
-        self.buy_call_o = order.find(self.buy_call_oid)
-        self.buy_put_o = order.find(self.buy_put_oid)
+        if orders is None:
+            orders = order.find_many([self.buy_call_oid, self.buy_put_oid])
+        self.buy_call_o = orders[self.buy_call_oid]
+        self.buy_put_o = orders[self.buy_put_oid]
 
         self.sell_calls_key = _strangle.sell_call_oids
         self.sell_puts_key = _strangle.sell_put_oids
 
-        self.state = self.current_state()
+        self.state = state or self.current_state()
+        self.sell_orders = {}
+        self.mutex = None
         self.created_at = min([self.buy_call_o.created_at, self.buy_put_o.created_at])
 
     def save(self):
@@ -101,10 +118,9 @@ class StrangleWrapper:
 
     def sync(self):
         sell_orders = self.get_sell_orders("call") + self.get_sell_orders("put")
-        for o in sell_orders:
-            if o.state in order.RH_ORDER_FINAL_STATES:
-                continue
-            o.sync()
+        order.sync_many(
+            o for o in sell_orders if o.state not in order.RH_ORDER_FINAL_STATES
+        )
 
     def orders(self):
         arr = [self.buy_call_o, self.buy_put_o]
@@ -117,11 +133,14 @@ class StrangleWrapper:
     def append_sell_order(self, o):
         if o.direction == "credit":
             redis.zadd(zset_key(o), {o.id: o.created_at.timestamp()})
+            self.sell_orders = {}
 
     def get_sell_orders(self, o_type):
-        if o_type == "call":
-            return [order.find(o) for o in redis.zrange(self.sell_call_oids, 0, -1)]
-        return [order.find(o) for o in redis.zrange(self.sell_put_oids, 0, -1)]
+        # prefetched by find_many(..., sell_orders=True)
+        if o_type in self.sell_orders:
+            return self.sell_orders[o_type]
+        key = self.sell_call_oids if o_type == "call" else self.sell_put_oids
+        return live_orders(key, order.find_many(redis.zrange(key, 0, -1)))
 
     def most_recent_sell_order(self, o_type):
         return self.get_sell_orders(o_type)[-1]
@@ -143,11 +162,30 @@ class StrangleWrapper:
     # 2. sell processed quantity can be spread over multiple orders
     # 3. therefore sell quantity must be summed over multiple orders
 
+    # 4. totals are kept in a hash, moved by OrderWrapper.save() whenever
+    #    a sell order's processed quantity / premium changes
+
+    def sell_totals(self):
+        if d := redis.hgetall(order.sell_totals_key(self.ticker, self.expr)):
+            return d
+        return self.rebuild_sell_totals()
+
+    # strangles opened before totals were kept, or after a manual fix up.
+    # Summed server side from the stored orders, not the identity map
+    def rebuild_sell_totals(self):
+        return order.rebuild_sell_totals(
+            self.ticker, self.expr, self.sell_call_oids, self.sell_put_oids
+        )
+
     def get_sell_processed_quantity(self, o_type):
-        return sum(o.processed_quantity for o in self.get_sell_orders(o_type))
+        if o_type in self.sell_orders:
+            return sum(o.processed_quantity for o in self.sell_orders[o_type])
+        return float(self.sell_totals().get(f"{o_type}:quantity", 0))
 
     def get_sell_processed_premium(self, o_type):
-        return sum(o.processed_premium for o in self.get_sell_orders(o_type))
+        if o_type in self.sell_orders:
+            return sum(o.processed_premium for o in self.sell_orders[o_type])
+        return float(self.sell_totals().get(f"{o_type}:premium", 0))
 
     def sell_is_filled(self, o_type):
         pq = self.get_sell_processed_quantity(o_type)
@@ -166,17 +204,41 @@ class StrangleWrapper:
 
     ### strangle state logic ###
 
+    # MULTI/EXEC so the position is never in zero or two state indexes
     def change_to_state(self, to_state, from_state=None):
-        if from_state:
-            k = key_join(INDEX_STATE, from_state)
-            redis.srem(k, self.pk)
-        k = key_join(INDEX_STATE, to_state)
-        redis.sadd(k, self.pk)
+        def queue(pipe):
+            if from_state:
+                pipe.srem(key_join(INDEX_STATE, from_state), self.pk)
+                self.unindex(pipe, from_state)
+            pipe.sadd(key_join(INDEX_STATE, to_state), self.pk)
+            self.index(pipe, to_state)
+
+        with redis.pipeline() as pipe:
+            # under the close lock only while it's still ours (LockLost)
+            if self.mutex:
+                self.mutex.fenced(pipe, queue)
+            else:
+                queue(pipe)
+                pipe.execute()
         setattr(self, "state", to_state)
 
+    def index(self, pipe, state):
+        created = self.created_at.timestamp()
+        pipe.zadd(key_join(INDEX_CREATED, state), {self.pk: created})
+        pipe.zadd(key_join(INDEX_EXPR, state), {self.pk: date_score(self.expr)})
+
+    def unindex(self, pipe, state):
+        pipe.zrem(key_join(INDEX_CREATED, state), self.pk)
+        pipe.zrem(key_join(INDEX_EXPR, state), self.pk)
+
+    # one round trip of SISMEMBERs instead of SMEMBERS on every index
     def current_state(self):
-        for i in _ALL_STATE_INDEXES:
-            if self.pk in redis.smembers(i):
+        with redis.pipeline(transaction=False) as pipe:
+            for i in _ALL_STATE_INDEXES:
+                pipe.sismember(i, self.pk)
+            res = pipe.execute()
+        for i, is_member in zip(_ALL_STATE_INDEXES, res):
+            if is_member:
                 return i.rsplit(":", 1)[1]
         return "unknown"
 
@@ -191,17 +253,32 @@ class StrangleWrapper:
     ### uncategorized ###
 
     def delete(self):
-        for i in _ALL_STATE_INDEXES:
-            redis.srem(i, self.pk)
+        with redis.pipeline() as pipe:
+            for i in _ALL_STATE_INDEXES:
+                pipe.srem(i, self.pk)
+            for i in _ALL_SORTED_INDEXES:
+                pipe.zrem(i, self.pk)
+            pipe.delete(fence_key(self.lock_name()))
+            pipe.delete(order.sell_totals_key(self.ticker, self.expr))
+            pipe.execute()
         self.s.delete(self.pk)
 
+    # returns the fencing token or None if someone else holds the lock
     def lock(self):
-        self.locked = 1
-        self.save()
+        self.mutex = Mutex(self.lock_name())
+        return self.mutex.acquire()
+
+    def lock_name(self):
+        return key_join(NS_STRANGLE, self.pk)
 
     def unlock(self):
-        self.locked = 0
-        self.save()
+        if self.mutex:
+            self.mutex.release()
+            self.mutex = None
+
+    # long eject loops push the lock TTL out as they go
+    def refresh_lock(self):
+        return self.mutex is None or self.mutex.extend()
 
     def dte(self):
         created_at = self.buy_call_o.created_at
@@ -232,7 +309,6 @@ class StrangleWrapper:
         sell_put_oids: str
         eject_sec_to_expr: int
         result: Optional[str]
-        locked: Optional[int]
 
 
 def find(ticker, expr):
@@ -246,6 +322,61 @@ def find_by_pk(pk):
     return StrangleWrapper.get(pk)
 
 
+def find_many(pks, sell_orders=False):
+    """
+    Loads strangles in a constant number of round trips:
+    1. strangle hashes + state index membership for every pk
+    2. (sell_orders) the call / put sell order ZSETs
+    3. every referenced buy (and sell) order
+    Missing strangles are skipped
+    """
+    pks = list(pks)
+    model = StrangleWrapper.Strangle
+    stride = 1 + len(_ALL_STATE_INDEXES)
+
+    with redis.pipeline(transaction=False) as pipe:
+        for pk in pks:
+            pipe.hgetall(model.make_primary_key(pk))
+            for i in _ALL_STATE_INDEXES:
+                pipe.sismember(i, pk)
+        res = pipe.execute()
+
+    loaded = []
+    for n in range(len(pks)):
+        doc, *is_member = res[n * stride : (n + 1) * stride]
+        if not doc:
+            continue
+        state = next(
+            (i.rsplit(":", 1)[1] for i, m in zip(_ALL_STATE_INDEXES, is_member) if m),
+            "unknown",
+        )
+        loaded.append((model.parse_obj(doc), state))
+
+    oids = [oid for s, _ in loaded for oid in (s.buy_call_oid, s.buy_put_oid)]
+
+    sell_oids = []
+    if sell_orders:
+        with redis.pipeline(transaction=False) as pipe:
+            for s, _ in loaded:
+                pipe.zrange(s.sell_call_oids, 0, -1)
+                pipe.zrange(s.sell_put_oids, 0, -1)
+            sell_oids = pipe.execute()
+        oids += [oid for zset in sell_oids for oid in zset]
+
+    orders = order.find_many(oids)
+
+    res = []
+    for n, (s, state) in enumerate(loaded):
+        wrapper = StrangleWrapper(s, state=state, orders=orders)
+        if sell_orders:
+            wrapper.sell_orders = {
+                "call": live_orders(s.sell_call_oids, orders, sell_oids[2 * n]),
+                "put": live_orders(s.sell_put_oids, orders, sell_oids[2 * n + 1]),
+            }
+        res.append(wrapper)
+    return res
+
+
 def exists(ticker, expr):
     try:
         return find(ticker, expr)
@@ -253,6 +384,18 @@ def exists(ticker, expr):
         return False
 
 
+def live_orders(key, orders, oids=None):
+    """
+    Orders of a sell order ZSET, in ZSET order. Dead orders expire (see
+    DEAD_ORDER_TTL) while their ids stay in the ZSET: those are dropped here
+    and removed from it. They never traded, so no totals move
+    """
+    oids = list(orders) if oids is None else oids
+    if expired := [oid for oid in oids if orders.get(oid) is None]:
+        redis.zrem(key, *expired)
+    return [orders[oid] for oid in oids if orders.get(oid) is not None]
+
+
 def zset_key(o):
     ns = NS_SELL_ORDERS_CALLS if o.option_type == "call" else NS_SELL_ORDERS_PUTS
     return key_join(ns, o.ticker, o.expr)
@@ -272,22 +415,75 @@ def new(buy_call, buy_put):
         sell_call_oids=zset_key(buy_call),
         sell_put_oids=zset_key(buy_put),
         eject_sec_to_expr=eject_in,
-        locked=0,
     )
 
 
+def has_active_strangles():
+    return redis.scard(_ACTIVE_STRANGLE_INDEX) > 0
+
+
 def active_strangles():
-    res = [find_by_pk(s) for s in redis.smembers(_ACTIVE_STRANGLE_INDEX)]
+    res = find_many(redis.smembers(_ACTIVE_STRANGLE_INDEX))
     res.sort(key=operator.attrgetter("eject_at"))
     return res
 
 
+def sorted_index(index, state):
+    """
+    Sorted index for a state. Backfills positions that only made it into the
+    state set (indexed before the sorted indexes existed)
+    """
+    key = key_join(index, state)
+    with redis.pipeline(transaction=False) as pipe:
+        pipe.scard(key_join(INDEX_STATE, state))
+        pipe.zcard(key)
+        n_state, n_sorted = pipe.execute()
+
+    if n_state != n_sorted:
+        pks = redis.smembers(key_join(INDEX_STATE, state))
+        strangles = find_many(pks)
+        with redis.pipeline() as pipe:
+            for i in [INDEX_CREATED, INDEX_EXPR]:
+                pipe.delete(key_join(i, state))
+            for s in strangles:
+                s.index(pipe, state)
+            # drop pks whose strangle hash is gone
+            for pk in pks - {s.pk for s in strangles}:
+                pipe.srem(key_join(INDEX_STATE, state), pk)
+            pipe.execute()
+    return key
+
+
+def strangles_opened_between(start, end, state=_STATE_CLOSED):
+    """
+    start / end are datetimes, both inclusive
+    """
+    key = sorted_index(INDEX_CREATED, state)
+    return find_many(redis.zrangebyscore(key, start.timestamp(), end.timestamp()))
+
+
+def strangles_expiring_on(iso_date, state=_STATE_CLOSED, sell_orders=False):
+    key = sorted_index(INDEX_EXPR, state)
+    score = date_score(iso_date)
+    res = find_many(redis.zrangebyscore(key, score, score), sell_orders=sell_orders)
+    res.sort(key=operator.attrgetter("created_at"))
+    return res
+
+
+# exclusive of iso_date
+def closed_strangles_expiring_before(iso_date):
+    key = sorted_index(INDEX_EXPR, _STATE_CLOSED)
+    pks = redis.zrangebyscore(key, "-inf", f"({date_score(iso_date)}")
+    return find_many(pks, sell_orders=True)
+
+
 def closed_strangles():
-    return [find_by_pk(s) for s in redis.smembers(_CLOSED_STRANGLE_INDEX)]
+    key = sorted_index(INDEX_CREATED, _STATE_CLOSED)
+    return find_many(redis.zrange(key, 0, -1), sell_orders=True)
 
 
 def closed_strangles_for_week_ending(iso_date):
-    return [s for s in closed_strangles() if s.expr == iso_date]
+    return strangles_expiring_on(iso_date, _STATE_CLOSED, sell_orders=True)
 
 
 def publish_eow_results(iso_date=None):
@@ -299,8 +495,12 @@ def publish_eow_results(iso_date=None):
 
 def remove_strangle_from_state_indexes(_strangle):
     try:
-        for i in _ALL_STATE_INDEXES:
-            redis.srem(i, _strangle.pk)
+        with redis.pipeline() as pipe:
+            for i in _ALL_STATE_INDEXES:
+                pipe.srem(i, _strangle.pk)
+            for i in _ALL_SORTED_INDEXES:
+                pipe.zrem(i, _strangle.pk)
+            pipe.execute()
     except NotFoundError:
         pass
 
@@ -0,0 +1,108 @@
+from config import config  # pylint: disable=wrong-import-order
+
+from redis.exceptions import WatchError
+
+import constants
+from helpers import key_join
+
+redis = config.redis
+
+# namespaces
+
+NS_MUTEX = "mutex"
+NS_FENCE = "fence"
+
+# delete only if we're still the holder
+_RELEASE_SCRIPT = redis.register_script(
+    """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+)
+
+# extend only if we're still the holder
+_EXTEND_SCRIPT = redis.register_script(
+    """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+)
+
+
+def fence_key(name):
+    return key_join(NS_MUTEX, NS_FENCE, name)
+
+
+class LockLost(Exception):
+    """
+    the lock expired and changed hands before a fenced write
+    """
+
+
+class Mutex:
+    """
+    Distributed lock: SET NX PX with a fencing token.
+
+    Every acquire draws a new token from a per-lock INCR counter and stores it
+    as the lock value, so a holder whose lock expired (slow API call, crash)
+    can tell it has been superseded before doing anything with side effects.
+    Redis writes made under the lock check the token in their transaction
+    (see fenced)
+    """
+
+    def __init__(self, name, ttl_ms=constants.POSITION_LOCK_TTL_MS):
+        self.name = name
+        self.key = key_join(NS_MUTEX, name)
+        self.fence_key = fence_key(name)
+        self.ttl_ms = ttl_ms
+        self.token = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def acquire(self):
+        token = redis.incr(self.fence_key)
+        if redis.set(self.key, token, nx=True, px=self.ttl_ms):
+            self.token = token
+            return token
+        return None
+
+    def release(self):
+        if self.token is None:
+            return False
+        res = _RELEASE_SCRIPT(keys=[self.key], args=[self.token])
+        self.token = None
+        return bool(res)
+
+    def extend(self, ttl_ms=None):
+        if self.token is None:
+            return False
+        args = [self.token, ttl_ms or self.ttl_ms]
+        return bool(_EXTEND_SCRIPT(keys=[self.key], args=args))
+
+    # call before any side effect (placing / cancelling orders)
+    def is_held(self):
+        return self.token is not None and redis.get(self.key) == str(self.token)
+
+    def fenced(self, pipe, queue):
+        """
+        Runs queue(pipe) in a MULTI/EXEC that only commits while the lock
+        still holds this token: the lock key is WATCHed and compared first.
+        Raises LockLost otherwise
+        """
+        try:
+            pipe.watch(self.key)
+            if self.token is None or pipe.get(self.key) != str(self.token):
+                raise LockLost(self.name)
+            pipe.multi()
+            queue(pipe)
+            return pipe.execute()
+        except WatchError as err:
+            raise LockLost(self.name) from err
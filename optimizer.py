@@ -0,0 +1,408 @@
+import sys
+
+import numpy as np
+
+import discord_logging as dlog
+
+_TYPES = ["call", "put"]
+TICK_FIELDS = ["cutoff_price", "above_tick", "below_tick"]
+
+
+class Chain:
+    """
+    Option chain as NumPy arrays per option type, parsed once per fetch.
+
+    Rows keep chain order so argmin / argmax pick the first of equal targets,
+    same as the running minimum loops this replaces. Rows with missing
+    prices are dropped (and logged)
+    """
+
+    # chain keys -> column names
+    fields = {
+        "strike_price": "strike",
+        "ask_price": "ask",
+        "bid_price": "bid",
+        "mark_price": "mark",
+    }
+
+    def __init__(self, chain, ticker=None):
+        cols = {t: {k: [] for k in ["pos", *self.fields.values()]} for t in _TYPES}
+        self.min_ticks = {t: [] for t in _TYPES}
+        self.last_min_ticks = None
+
+        for pos, c in enumerate(chain):
+            o_type = c.get("type").lower()
+            row = [c.get(k) for k in self.fields]
+            if None in row:
+                dlog.warn(f"get_optimal_strikes: bad option - {ticker} ${row[0]}")
+                continue
+
+            for k, v in zip(self.fields.values(), row):
+                cols[o_type][k].append(v)
+            cols[o_type]["pos"].append(pos)
+            self.min_ticks[o_type].append(c.get("min_ticks"))
+            self.last_min_ticks = c.get("min_ticks")
+
+        self.data = {
+            t: {k: np.asarray(v, dtype=float) for k, v in cols[t].items()}
+            for t in _TYPES
+        }
+        self.index_strikes()
+
+    @classmethod
+    def from_columns(cls, cols, ticker=None):
+        """
+        Chain from stored snapshot columns (see snapshots.py), rows are
+        already clean so there are no per-option dicts to walk
+        """
+        self = cls.__new__(cls)
+        self.data, self.min_ticks = {}, {}
+        ticks = np.column_stack([cols[k] for k in TICK_FIELDS]).tolist()
+        for t in _TYPES:
+            rows = np.flatnonzero(cols["type"] == t)
+            self.data[t] = {"pos": rows.astype(float)} | {
+                k: cols[k][rows].astype(float) for k in cls.fields.values()
+            }
+            self.min_ticks[t] = [min_ticks(ticks[i]) for i in rows]
+        self.last_min_ticks = min_ticks(ticks[-1]) if ticks else None
+        self.index_strikes()
+        return self
+
+    def index_strikes(self):
+        # every strike of either type, the wing adjustment steps through these
+        self.strikes = np.unique(
+            np.concatenate([self.data[t]["strike"] for t in _TYPES])
+        )
+
+    def __len__(self):
+        return sum(len(self.data[t]["strike"]) for t in _TYPES)
+
+    def targets(self, o_type, roi):
+        x = self.data[o_type]
+        if o_type == "call":
+            return x["strike"] + roi * x["mark"]
+        return x["strike"] - roi * x["mark"]
+
+    def best(self, o_type, roi):
+        """
+        Row index of the optimal strike: lowest call target (strike + roi *
+        mark), highest positive put target (strike - roi * mark). None if
+        nothing qualifies
+        """
+        t = self.targets(o_type, roi)
+        if not len(t):
+            return None
+        if o_type == "call":
+            return int(np.argmin(t))
+        i = int(np.argmax(t))
+        return i if t[i] > 0 else None
+
+    def row(self, o_type, i, target):
+        x = self.data[o_type]
+        return {
+            "strike": float(x["strike"][i]),
+            "ask": float(x["ask"][i]),
+            "bid": float(x["bid"][i]),
+            "mark": float(x["mark"][i]),
+            "target": float(target),
+        }
+
+    def neighbour_strike(self, strike, step):
+        i = int(np.searchsorted(self.strikes, strike)) + step
+        if 0 <= i < len(self.strikes):
+            return float(self.strikes[i])
+        return None
+
+    def quote(self, o_type, strike):
+        x = self.data[o_type]
+        if not len(ix := np.flatnonzero(x["strike"] == strike)):
+            return None
+        i = ix[-1]  # later rows overwrote earlier ones in the old dict lookup
+        return {"ask": float(x["ask"][i]), "bid": float(x["bid"][i])}
+
+
+class ChainState:
+    """
+    A Chain kept current from repeated quote fetches, keyed by instrument
+    id. apply() only writes the rows whose prices moved and reports them, so
+    the work per poll follows market activity instead of chain size
+    """
+
+    # quote keys -> Chain columns
+    fields = {"ask_price": "ask", "bid_price": "bid", "mark_price": "mark"}
+
+    def __init__(self, chain, ticker=None):
+        self.chain = Chain(chain, ticker)
+        self.rows = {}  # instrument id -> (o_type, row)
+        for t in _TYPES:
+            for i, pos in enumerate(self.chain.data[t]["pos"]):
+                self.rows[chain[int(pos)]["id"]] = (t, i)
+        self.changed = {t: {} for t in _TYPES}
+        self.stats = {"polls": 0, "changed": 0, "last": 0, "max": 0}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def apply(self, quotes):
+        """
+        Writes a batch of quotes (marketdata dicts). Returns the rows that
+        changed, {o_type: {row: [columns]}}
+        """
+        changed = {t: {} for t in _TYPES}
+        for q in quotes:
+            if (key := self.rows.get(q.get("instrument_id"))) is None:
+                continue
+            if None in (prices := [q.get(k) for k in self.fields]):
+                continue
+
+            o_type, i = key
+            x = self.chain.data[o_type]
+            for k, v in zip(self.fields.values(), prices):
+                if (v := float(v)) != x[k][i]:
+                    x[k][i] = v
+                    changed[o_type].setdefault(i, []).append(k)
+
+        n = sum(len(rows) for rows in changed.values())
+        self.stats["polls"] += 1
+        self.stats["changed"] += n
+        self.stats["last"] = n
+        self.stats["max"] = max(self.stats["max"], n)
+        self.changed = changed
+        return changed
+
+    def changed_strikes(self):
+        """
+        (o_type, strike) of the rows the last apply() changed
+        """
+        return {
+            (t, float(self.chain.data[t]["strike"][i]))
+            for t, rows in self.changed.items()
+            for i in rows
+        }
+
+
+class RunningCondor:
+    """
+    optimal_condor kept current over a ChainState. The full search only
+    reruns when a changed mark can move a leg (it is on a leg, or its target
+    ties / beats the best one), bid / ask changes on the legs only reprice
+    the credit
+    """
+
+    def __init__(
+        self, state, multiplier_buy, multiplier_sell, slack, adjacent_wings=False
+    ):
+        self.state = state
+        self.multipliers = (multiplier_buy, multiplier_sell)
+        self.slack = slack
+        self.adjacent_wings = adjacent_wings
+        self.stats = {"recomputed": 0, "repriced": 0}
+        self.d = self.recompute()
+
+    def recompute(self):
+        self.d = optimal_condor(
+            self.state.chain,
+            *self.multipliers,
+            self.slack,
+            adjacent_wings=self.adjacent_wings,
+        )
+        self.stats["recomputed"] += 1
+        return self.d
+
+    def update(self, changed):
+        if not any(changed.values()):
+            return self.d
+        if self.moves(changed):
+            return self.recompute()
+        if self.on_legs(changed):
+            self.reprice()
+        return self.d
+
+    def leg_strikes(self, o_type):
+        return [self.d[o_type][side]["strike"] for side in ["buy", "sell"]]
+
+    def moves(self, changed):
+        if not self.d:
+            return True
+
+        # adjacent wings: the buy leg follows the sell leg, its mark is unused
+        sides = {"sell": roi(self.multipliers[1])}
+        if not self.adjacent_wings:
+            sides["buy"] = roi(self.multipliers[0])
+
+        chain = self.state.chain
+        for o_type, rows in changed.items():
+            rows = [i for i, fields in rows.items() if "mark" in fields]
+            if not rows:
+                continue
+            legs = [self.d[o_type][side]["strike"] for side in sides]
+            if np.isin(chain.data[o_type]["strike"][rows], legs).any():
+                return True
+            for side, _roi in sides.items():
+                targets = chain.targets(o_type, _roi)[rows]
+                best = self.d[o_type][side]["target"]
+                if o_type == "call" and (targets <= best).any():
+                    return True
+                if o_type == "put" and (targets >= best).any():
+                    return True
+        return False
+
+    def on_legs(self, changed):
+        data = self.state.chain.data
+        return any(
+            np.isin(data[t]["strike"][list(rows)], self.leg_strikes(t)).any()
+            for t, rows in changed.items()
+            if rows
+        )
+
+    def reprice(self):
+        for o_type in _TYPES:
+            for side in ["buy", "sell"]:
+                leg = self.d[o_type][side]
+                leg |= self.state.chain.quote(o_type, leg["strike"])
+        price_condor(self.d, self.slack)
+        self.stats["repriced"] += 1
+
+
+def min_ticks(values):
+    if any(v != v for v in values):  # NaN, chain came without ticks
+        return None
+    return dict(zip(TICK_FIELDS, values))
+
+
+def roi(multiplier):
+    return (1 + multiplier / 100) * 2
+
+
+def widen_wing(chain, d, o_type):
+    """
+    Buy and sell legs on the same strike: move the buy leg one strike out.
+    False when there is no strike further out (or no quote on it)
+    """
+    step = 1 if o_type == "call" else -1
+    strike = chain.neighbour_strike(d[o_type]["buy"]["strike"], step)
+    if strike is None:
+        side = "highest" if o_type == "call" else "lowest"
+        dlog.warn(f"{o_type.upper()} leg: sell target is {side} strike")
+        return False
+    if not (quote := chain.quote(o_type, strike)):
+        dlog.warn(f"{o_type.upper()} leg: no quote for ${strike}")
+        return False
+
+    d[o_type]["buy"] |= {"strike": strike} | quote
+    return True
+
+
+def optimal_condor(chain, multiplier_buy, multiplier_sell, slack, adjacent_wings=False):
+    """
+    Optimal iron condor strikes, same dict shape the Select classes return.
+
+    adjacent_wings: buy legs start on the sell strike (target +- 1) and are
+    always widened to the next strike out, instead of their own roi
+    """
+    roi_buy, roi_sell = roi(multiplier_buy), roi(multiplier_sell)
+
+    d = {"call": {}, "put": {}}
+    if chain.last_min_ticks is not None:
+        d["min_ticks"] = chain.last_min_ticks
+
+    for o_type in _TYPES:
+        if (i_sell := chain.best(o_type, roi_sell)) is None:
+            return None
+        target_sell = chain.targets(o_type, roi_sell)[i_sell]
+
+        if adjacent_wings:
+            i_buy = i_sell
+            target_buy = target_sell + (1 if o_type == "call" else -1)
+        elif (i_buy := chain.best(o_type, roi_buy)) is None:
+            return None
+        else:
+            target_buy = chain.targets(o_type, roi_buy)[i_buy]
+
+        d[o_type]["buy"] = chain.row(o_type, i_buy, target_buy)
+        d[o_type]["sell"] = chain.row(o_type, i_sell, target_sell)
+
+        if o_type == "put":
+            d[o_type]["buy"]["min_ticks"] = chain.min_ticks[o_type][i_buy]
+            d[o_type]["sell"]["min_ticks"] = chain.min_ticks[o_type][i_sell]
+
+    for o_type in _TYPES:
+        if d[o_type]["buy"]["strike"] == d[o_type]["sell"]["strike"]:
+            if not widen_wing(chain, d, o_type):
+                return None
+
+    price_condor(d, slack)
+
+    d["multiplier_buy"] = multiplier_buy
+    d["multiplier_sell"] = multiplier_sell
+
+    return d
+
+
+def price_condor(d, slack):
+    """
+    Collateral and credits from the legs' strikes and bid / ask
+    """
+    d["collateral"] = max(
+        d["call"]["buy"]["strike"] - d["call"]["sell"]["strike"],
+        d["put"]["sell"]["strike"] - d["put"]["buy"]["strike"],
+    )
+
+    d["call"]["credit"] = round(d["call"]["sell"]["bid"] - d["call"]["buy"]["ask"], 2)
+    d["put"]["credit"] = round(d["put"]["sell"]["bid"] - d["put"]["buy"]["ask"], 2)
+
+    d["credit"] = d["call"]["credit"] + d["put"]["credit"]
+    d["credit_collateral_ratio"] = d["credit"] / d["collateral"] * 100
+
+    return apply_slack(d, slack)
+
+
+def apply_slack(d, slack):
+    """
+    (Re)prices a condor from optimal_condor for slack, nothing else in d
+    depends on it
+    """
+    d["credit_with_slack"] = d["credit"] - slack * d["collateral"] / 100
+    d["credit_with_slack_collateral_ratio"] = (
+        d["credit_with_slack"] / d["collateral"] * 100
+    )
+    return d
+
+
+def optimal_strangle(chain, multiplier, slack):
+    """
+    Optimal strangle strikes. Buy price is the ask plus slack ticks, to make
+    complete fills more likely
+    """
+    _roi = roi(multiplier)
+    d = {"call": {}, "put": {}}
+
+    for o_type in _TYPES:
+        if (i := chain.best(o_type, _roi)) is None:
+            continue
+
+        min_ticks = chain.min_ticks[o_type][i]
+        ask = chain.data[o_type]["ask"][i]
+        if ask > float(min_ticks["cutoff_price"]):
+            ask += slack * float(min_ticks["above_tick"])
+        else:
+            ask += slack * float(min_ticks["below_tick"])
+
+        d[o_type] = chain.row(o_type, i, chain.targets(o_type, _roi)[i]) | {
+            "ask": round(float(ask), 2),
+            "min_ticks": min_ticks,
+        }
+        if o_type == "put":
+            pos = chain.data["put"]["pos"][i]
+            d[o_type]["target"] = running_call_target(chain, _roi, pos)
+
+    return d
+
+
+# the put leg has always reported the best call target seen so far in chain
+# order (sys.maxsize before any call) - kept as is for the logs
+def running_call_target(chain, _roi, pos):
+    before = chain.data["call"]["pos"] < pos
+    if not before.any():
+        return sys.maxsize
+    return float(chain.targets("call", _roi)[before].min())
@@ -1,5 +1,10 @@
+# Strategy modules (and through them aggregator, numpy, gspread, hood) are
+# imported inside the job functions below. Most cron ticks run no job at all
+# so they should not pay for those imports or for the broker login.
+# pylint: disable=import-outside-toplevel
 import multiprocessing
 import os
+import subprocess
 import sys
 import time
 import traceback
@@ -8,12 +13,9 @@ from pprint import pformat, pprint  # pylint: disable=unused-import
 import date_helpers as dh
 import decorators
 import discord_logging as log  # pylint: disable=unused-import
-import iv
-import strangler
-from models import strangle
+import profiling
+import timing
 from scheduler import jobs
-import condorer
-import condorer_spy
 
 # Days to expiration to open strangle(s) on
 _DTE_MIN = 1
@@ -54,41 +56,203 @@ def condor_get_exprs():
 
 @decorators.log
 def iv_scrape(expr):
+    import iv
+
     iv.iv_scraper(expr)
 
 
 @decorators.log
 def po_buy(expr):
+    import strangler
+
     strangler.buy(expr)
 
 
 @decorators.log
 def po_open_sells():
+    import strangler
+
     strangler.open_sells()
 
 
 @decorators.log
 def condor_buy(expr):
+    import condorer
+
     condorer.buy(expr)
 
 
+@decorators.log
+def condor_buy_all():
+    import condorer
+
+    condorer.buy_many(condor_get_exprs())
+
+
 @decorators.log
 def condor_set_sell_limits():
+    import condorer
+
     condorer.sell()
 
 
 @decorators.log
 def condor_close():
+    import condorer
+
     condorer.close()
 
 
 @decorators.log
 def condor_buy_spy():
+    import condorer_spy
+
     condorer_spy.buy(dh.next_expr_dailies())
 
 
-# spawn process for strangle_open
-def spawn_processes(f, _type="strangle"):
+@decorators.log
+def condor_monitor_spy():
+    import condorer_spy
+
+    condorer_spy.monitor(dh.next_expr_dailies())
+
+
+def log_active_strangles():
+    import strangler
+
+    strangler.log_active_strangles()
+
+
+def publish_eow_results():
+    from models import strangle
+
+    strangle.publish_eow_results()
+
+
+def archive_closed_positions():
+    import archive
+
+    log.info(f"Archived positions: {archive.run()}")
+
+
+def compact_chain_snapshots():
+    import snapshots
+
+    log.info(f"Compacted chain snapshot parts: {snapshots.compact_all()}")
+
+
+def close_active_strangles():
+    from models import strangle
+
+    # cheap SCARD first so an empty index never imports strangler
+    if not strangle.has_active_strangles():
+        return
+
+    import strangler
+
+    strangler.close_strangles(strangle.active_strangles())
+
+
+# set when a worker's initializer failed. Raising from the initializer makes
+# the pool respawn workers forever, so the failure is reported per work item
+_init_error = None
+
+
+def init_worker():
+    global _init_error  # pylint: disable=global-statement
+    try:
+        import condorer  # pylint: disable=unused-import
+        import iv  # pylint: disable=unused-import
+        import strangler  # pylint: disable=unused-import
+        import hood
+
+        hood.login()
+    except Exception as err:  # pylint: disable=broad-except
+        _init_error = err
+
+
+# strategies sys.exit() when there is nothing to do. SystemExit would take the
+# pool worker down with it and the parent would wait on the result forever
+def run_work_item(f, expr, profile=False):
+    if _init_error:
+        raise RuntimeError(f"worker failed to start: {_init_error!r}")
+    try:
+        with timing.span(f.__qualname__, expr=expr):
+            with profiling.profile(f"{f.__qualname__}_{expr}", enabled=profile):
+                return f(expr)
+    except SystemExit as err:
+        return err.code
+    finally:
+        reset_order_cache(f"{f.__qualname__}({expr!r})")
+
+
+# the order identity map lives as long as the process: pool workers take
+# many work items, so it is logged and emptied after each job / work item
+# instead of handing stale orders to the next one.
+# Only if the run actually loaded orders - don't import models just for this
+def reset_order_cache(title):
+    if not (order := sys.modules.get("models.order")):
+        return
+    if (stats := order.identity_map.stats())["hits"] + stats["misses"]:
+        log.debug(f"{title} order identity map: {stats}")
+    order.identity_map.clear()
+
+
+class WorkerPool:
+    """
+    Spawned workers shared by the per-expiration jobs of one oracle run.
+    Workers import the strategy modules and log in to the broker once, then
+    take (job, expr) work items, so a run with several such jobs pays for
+    the spawns once. Started on first use and sized to the expirations at
+    hand; the pool goes away with the run
+    """
+
+    def __init__(self):
+        self.pool = None
+        self.size = 0
+
+    def start(self, processes):
+        if self.pool and self.size >= processes:
+            return self.pool
+        self.close()
+        ctx = multiprocessing.get_context()
+        self.pool = ctx.Pool(processes, initializer=init_worker)
+        self.size = processes
+        return self.pool
+
+    def submit(self, items, profile=False):
+        _pool = self.start(len(items))
+        return [
+            (f, expr, _pool.apply_async(run_work_item, (f, expr, profile)))
+            for f, expr in items
+        ]
+
+    # exceptions raised in a worker are re-raised by AsyncResult.get() -
+    # log them per expiration so one bad expr doesn't hide the others
+    def run(self, items, profile=False):
+        if not items:
+            return []
+        res = []
+        for f, expr, async_res in self.submit(items, profile):
+            try:
+                res.append(async_res.get())
+            except Exception as err:
+                trace = pformat(traceback.format_exception(err))
+                log.error(f"{f.__qualname__}({expr!r}) failed:\n\n{trace}")
+                res.append(err)
+        return res
+
+    def close(self):
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+            self.pool, self.size = None, 0
+
+
+worker_pool = WorkerPool()
+
+
+def run_per_expr(f, _type="strangle", profile=False):
     if _type == "strangle":
         exprs = get_exprs()
     elif _type == "condor":
@@ -97,33 +261,79 @@ def spawn_processes(f, _type="strangle"):
         log.fatal(f"Invalid type: {_type}")
         raise ValueError("Invalid type")
 
-    procs = []
-    for expr in exprs:
-        p = multiprocessing.Process(target=f, args=(expr,))
-        procs.append(p)
-        p.start()
-    return procs
+    return worker_pool.run([(f, expr) for expr in exprs], profile)
 
 
-# spawn process for close
-# vulnerable to race conditions despite mutex
-# so temporarily swapping back to synchronous sells
-# def spawn_processes_close(f):
-#     procs = []
-#     for s in strangler.strangle.active_strangles():
-#         p = multiprocessing.Process(target=f, args=(s,))
-#         procs.append(p)
-#         p.start()
-#     return procs
+# parses `python -X importtime` output:
+# import time: self [us] | cumulative | imported package
+def parse_importtime(stderr):
+    res = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _self, cumulative, name = line[len("import time:") :].split("|")
+        res.append((name.strip(), int(_self), int(cumulative)))
+    return res
 
 
-if __name__ == "__main__":
-    # Necessary to run on linux
-    if sys.platform != "darwin":
-        multiprocessing.set_start_method("spawn")
+def startup_profile(argv, top=25):
+    """
+    Re-runs oracle under `python -X importtime` and reports per-module
+    import cost alongside total wall clock for the minute
+    """
+    cmd = [sys.executable, "-X", "importtime", os.path.abspath(__file__)] + argv
+    _start = time.perf_counter()
+    res = subprocess.run(cmd, stderr=subprocess.PIPE, text=True, check=False)
+    _finish = time.perf_counter()
+
+    imports = parse_importtime(res.stderr)
+    total_self = sum(x[1] for x in imports)
+
+    print(f"\nWall clock:     {round((_finish - _start) * 1000, 1)} ms")
+    print(f"Modules:        {len(imports)}")
+    print(f"Import time:    {round(total_self / 1000, 1)} ms\n")
+    print(f"{'self ms':>10} {'cumulative ms':>14}  module")
+    for name, _self, cumulative in sorted(imports, key=lambda x: -x[1])[:top]:
+        print(f"{_self / 1000:>10.1f} {cumulative / 1000:>14.1f}  {name}")
+
+    # anything that isn't importtime output (tracebacks etc.)
+    if other := [x for x in res.stderr.splitlines() if not x.startswith("import ")]:
+        print("\n" + "\n".join(other))
+
+    return res.returncode
+
+
+# one poll loop for every order the jobs below wait on
+def start_order_watcher():
+    import order_watcher
+
+    return order_watcher.OrderWatcher().start()
+
 
+# module -> actions that block on order fills (order_watcher.wait_for)
+WAITS_ON_ORDERS = {
+    "strangler": ["buy", "open_sells"],
+    "condorer": ["buy", "buy_all", "sell"],
+    "condorer_spy": ["buy", "monitor"],
+}
+
+
+def waits_on_orders(j):
+    return j["active"] and j["action"] in WAITS_ON_ORDERS.get(j["module"], [])
+
+
+# profile every job that runs with --profile, or a single job by adding
+# "profile": True to its Scheduler entry. Per expiration jobs are profiled
+# inside the pool workers, one artifact per expiration. Work a job hands to
+# a thread pool is not in its profile (see profiling.profile)
+def main(profile_all=False):
+    watcher = None
     try:
-        for j in jobs():
+        _jobs = jobs()
+        if any(waits_on_orders(j) for j in _jobs):
+            watcher = start_order_watcher()
+
+        for j in _jobs:
             if not j["active"]:
                 continue
 
@@ -131,58 +341,84 @@ if __name__ == "__main__":
             _start = time.perf_counter()
 
             mod, action = j["module"], j["action"]
-
-            if mod == "strangler":
-                if action == "buy":
-                    for _p in spawn_processes(po_buy):
-                        _p.join()
-                if action == "open_sells":
-                    po_open_sells()
-
-            if mod == "condorer":
-                if action == "buy":
-                    for _p in spawn_processes(condor_buy, _type="condor"):
-                        _p.join()
-                if action == "set_sell_limits":
-                    condor_set_sell_limits()
-                if action == "sell":
-                    condor_close()
-
-            if mod == "condorer_spy":
-                if action == "buy":
-                    condor_buy_spy()
-
-            if mod == "iv":
-                os.system("rm ivs*.csv")
-                if action == "run":
-                    for _p in spawn_processes(iv_scrape):
-                        _p.join()
-                if action == "run_condor":
-                    for _p in spawn_processes(iv_scrape, _type="condor"):
-                        _p.join()
-
-            if mod == "strangle":
-                if action == "log_active_strangles":
-                    strangler.log_active_strangles()
-                if action == "eow_results":
-                    strangle.publish_eow_results()
-
-            if mod == "date_helpers":
-                if action == "expire_current_expr":
-                    dh.expire_current_expr()
-                    dh.expire_current_expr_dailies()
-
+            profile = profile_all or j.get("profile", False)
+
+            with timing.span(f"{mod}.{action}"), profiling.profile(
+                f"{mod}.{action}", enabled=profile
+            ):
+                if mod == "strangler":
+                    if action == "buy":
+                        run_per_expr(po_buy, profile=profile)
+                    if action == "open_sells":
+                        po_open_sells()
+
+                if mod == "condorer":
+                    if action == "buy":
+                        run_per_expr(condor_buy, _type="condor", profile=profile)
+                    if action == "buy_all":
+                        condor_buy_all()
+                    if action == "set_sell_limits":
+                        condor_set_sell_limits()
+                    if action == "sell":
+                        condor_close()
+
+                if mod == "condorer_spy":
+                    if action == "buy":
+                        condor_buy_spy()
+                    if action == "monitor":
+                        condor_monitor_spy()
+
+                if mod == "iv":
+                    os.system("rm ivs*.csv")
+                    if action == "run":
+                        run_per_expr(iv_scrape, profile=profile)
+                    if action == "run_condor":
+                        run_per_expr(iv_scrape, _type="condor", profile=profile)
+
+                if mod == "strangle":
+                    if action == "log_active_strangles":
+                        log_active_strangles()
+                    if action == "eow_results":
+                        publish_eow_results()
+
+                if mod == "archive":
+                    if action == "run":
+                        archive_closed_positions()
+
+                if mod == "snapshots":
+                    if action == "compact":
+                        compact_chain_snapshots()
+
+                if mod == "date_helpers":
+                    if action == "expire_current_expr":
+                        dh.expire_current_expr()
+                        dh.expire_current_expr_dailies()
+                        timing.prune()
+
+            reset_order_cache(f"{mod}.{action}")
             _finish = time.perf_counter()
             log.info(f"Finished in {round(_finish-_start,2)} seconds")
 
         if dh.is_market_open_now():
-            for s in strangle.active_strangles():
-                strangler.close_strangle(s)
-
-            # temporarily swapping out due to race condition vulnerability
-            # for _p in spawn_processes_close(close_strangle):
-            #     _p.join()
+            close_active_strangles()
 
     except Exception as err:
         trace = pformat(traceback.format_exception(*sys.exc_info()))
         log.fatal(f"Program crashed:\n\n {pformat(err)}\n\n{trace}")
+
+    finally:
+        if watcher:
+            watcher.stop()
+        worker_pool.close()
+        reset_order_cache("oracle")
+
+
+if __name__ == "__main__":
+    if "--startup-profile" in sys.argv:
+        sys.exit(startup_profile([x for x in sys.argv[1:] if x != "--startup-profile"]))
+
+    # Necessary to run on linux
+    if sys.platform != "darwin":
+        multiprocessing.set_start_method("spawn")
+
+    main(profile_all="--profile" in sys.argv)
@@ -0,0 +1,154 @@
+from config import config  # pylint: disable=wrong-import-order
+
+import sys
+import threading
+import time
+
+import constants
+import discord_logging as dlog
+from helpers import key_join
+from models import order
+from mutex import NS_MUTEX, Mutex
+
+redis = config.redis
+
+# namespaces
+
+NS_ORDER_WATCHER = "order_watcher"
+
+WATCHED_ORDERS = key_join(NS_ORDER_WATCHER, "orders")
+ORDER_STREAM = key_join(NS_ORDER_WATCHER, "stream")
+
+_WATCHER_LOCK = "order_watcher"
+
+
+class OrderWatcher:
+    """
+    Single poll loop for every order a strategy is waiting on.
+
+    1. Strategies add order ids to the watched set (wait_for)
+    2. Watcher syncs the watched orders with one list call, publishes state /
+       fill changes to the order stream and drops orders once they reach a
+       final state
+    3. Strategies block on the stream instead of polling the API themselves
+
+    Only one watcher runs at a time (mutex), its lock doubles as a heartbeat
+    """
+
+    def __init__(self, interval=constants.ORDER_WATCHER_INTERVAL):
+        self.interval = interval
+        self.mutex = Mutex(_WATCHER_LOCK, constants.ORDER_WATCHER_LOCK_TTL_MS)
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread or not self.mutex.acquire():
+            return self
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if not self.thread:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+    # expects the mutex to be held
+    def run(self):
+        try:
+            while not self.stop_event.is_set() and self.mutex.extend():
+                try:
+                    self.poll()
+                except Exception as err:  # pylint: disable=broad-except
+                    dlog.error(f"Order watcher poll failed: {err!r}")
+                self.stop_event.wait(self.interval)
+        finally:
+            self.mutex.release()
+
+    def poll(self):
+        orders = []
+        for oid in redis.smembers(WATCHED_ORDERS):
+            try:
+                orders.append(order.OrderWrapper.find(oid))
+            except order.NotFoundError:
+                redis.srem(WATCHED_ORDERS, oid)
+
+        prev = {o.id: (o.state, o.processed_quantity) for o in orders}
+        for o in order.sync_many(orders):
+            if (o.state, o.processed_quantity) != prev[o.id]:
+                publish(o)
+            if o.state in order.RH_ORDER_FINAL_STATES:
+                redis.srem(WATCHED_ORDERS, o.id)
+
+
+def publish(o):
+    fields = {
+        "oid": o.id,
+        "state": o.state,
+        "processed_quantity": o.processed_quantity,
+    }
+    redis.xadd(
+        ORDER_STREAM, fields, maxlen=constants.ORDER_STREAM_MAXLEN, approximate=True
+    )
+
+
+def is_running():
+    return bool(redis.exists(key_join(NS_MUTEX, _WATCHER_LOCK)))
+
+
+def last_event_id():
+    if events := redis.xrevrange(ORDER_STREAM, count=1):
+        return events[0][0]
+    return "0-0"
+
+
+def wait_for(
+    o,
+    predicate,
+    timeout=constants.HOOD_API_MAX_RETRY_ATTEMPTS * constants.HOOD_API_RETRY_DELAY,
+    poll_delay=constants.HOOD_API_RETRY_DELAY,
+):
+    """
+    Blocks until predicate(o) is truthy or timeout seconds pass. Returns the
+    predicate result, None on timeout. The order is only watched while
+    someone waits on it
+
+    Without a running watcher falls back to sync() every poll_delay seconds
+    """
+    deadline = time.monotonic() + timeout
+    redis.sadd(WATCHED_ORDERS, o.id)
+    try:
+        # read the stream position before the order so no transition is missed
+        last_id = last_event_id()
+        while not (res := predicate(o.refresh())):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+
+            if not is_running():
+                time.sleep(min(poll_delay, remaining))
+                o.sync()
+                continue
+
+            block_ms = int(min(remaining, poll_delay) * 1000) or 1
+            streams = {ORDER_STREAM: last_id}
+            for _, events in redis.xread(streams, block=block_ms) or []:
+                last_id = events[-1][0]
+
+        return res
+    finally:
+        redis.srem(WATCHED_ORDERS, o.id)
+
+
+if __name__ == "__main__":
+    watcher = OrderWatcher()
+    if not watcher.mutex.acquire():
+        sys.exit("Order watcher already running")
+
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
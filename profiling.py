@@ -0,0 +1,80 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+
+import constants
+import discord_logging as log
+
+
+def artifact_path(name, now=None):
+    now = now or datetime.utcnow()
+    d = os.path.join(constants.PROFILES_DIR, now.date().isoformat())
+    os.makedirs(d, exist_ok=True)
+    return os.path.join(d, f"{name}_{now.strftime('%H%M%S')}_{os.getpid()}")
+
+
+def summary(stats_source, top=constants.PROFILE_TOP_N, sort="cumulative"):
+    stream = io.StringIO()
+    stats = pstats.Stats(stats_source, stream=stream)
+    stats.strip_dirs().sort_stats(sort).print_stats(top)
+    return stream.getvalue()
+
+
+def write(prof, name, top=constants.PROFILE_TOP_N):
+    path = artifact_path(name)
+    prof.dump_stats(f"{path}.prof")
+    with open(f"{path}.txt", "w") as f:
+        f.write(summary(prof, top))
+    return path
+
+
+# a failed write is reported once per process, not once per job
+_write_failed = False
+
+
+def write_failed(err):
+    global _write_failed  # pylint: disable=global-statement
+    if _write_failed:
+        return
+    _write_failed = True
+    log.error(f"profiling: could not write profile: {err!r}")
+
+
+@contextmanager
+def profile(name, enabled=True, top=constants.PROFILE_TOP_N):
+    """
+    cProfile whatever runs inside the block. Writes
+    profiles/<date>/<name>_<time>_<pid>.prof (open with snakeviz / pstats)
+    and a top-N cumulative summary next to it as .txt
+
+    Only the calling thread is profiled. Work submitted to a
+    ThreadPoolExecutor (the close loops, Select windows, buy_many) shows up
+    as time spent waiting on its futures
+    """
+    if not enabled:
+        yield None
+        return
+
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield prof
+    finally:
+        prof.disable()
+        # never replace the exception the profiled code is raising
+        try:
+            path = write(prof, name, top)
+            log.info(f"Profile written to {path}.prof")
+        except Exception as err:  # pylint: disable=broad-except
+            write_failed(err)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("Missing .prof file")
+
+    print(summary(sys.argv[1], *map(int, sys.argv[2:3])))
@@ -15,6 +15,7 @@ class Scheduler:
 
     # move jobs to yml?
     # higher priority jobs on top
+    # "profile": True writes a cProfile of the job to profiles/<date>/
     jobs = [
         {"module": "strangler", "action": "buy", "before_close": 6, "active": False},
         {"module": "iv", "action": "run", "before_close": 18, "active": False},
@@ -43,8 +44,20 @@ class Scheduler:
             "after_close": 15,
             "active": True,
         },
+        {"module": "archive", "action": "run", "after_close": 30, "active": True},
+        {
+            "module": "snapshots",
+            "action": "compact",
+            "after_close": 45,
+            "active": True,
+        },
         {"module": "iv", "action": "run_condor", "before_close": 150, "active": True},
-        {"module": "condorer", "action": "buy", "before_close": 135, "active": True},
+        {
+            "module": "condorer",
+            "action": "buy_all",
+            "before_close": 135,
+            "active": True,
+        },
         {
             "module": "condorer",
             "action": "set_sell_limits",
@@ -54,8 +67,9 @@ class Scheduler:
         #{"module": "condorer", "action": "sell", "before_close": 120, "active": True},
         {
             "module": "condorer_spy",
-            "action": "buy",
-            "before_expr_daily": 391,
+            "action": "monitor",
+            # SPY_MONITOR_WINDOW ahead of the old one-shot buy at 391
+            "before_expr_daily": 406,
             "active": True,
         },
     ]
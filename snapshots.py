@@ -0,0 +1,371 @@
+import glob
+import os
+import shutil
+from datetime import datetime
+
+import numpy as np
+
+import constants
+import optimizer
+from timing import timed
+
+# chain keys -> columns, one row per option per snapshot
+PRICE_FIELDS = {
+    "strike_price": "strike",
+    "ask_price": "ask",
+    "bid_price": "bid",
+    "mark_price": "mark",
+}
+# market data that is not always there (NaN then)
+MARKET_FIELDS = {
+    "implied_volatility": "iv",
+    "open_interest": "oi",
+    "volume": "volume",
+}
+TICK_FIELDS = optimizer.TICK_FIELDS
+# one value per snapshot instead of per row
+SNAPSHOT_FIELDS = ["taken_at", "underlying"]
+
+
+def expr_dir(ticker, expr):
+    return os.path.join(constants.SNAPSHOTS_DIR, ticker, expr)
+
+
+def day_path(ticker, expr, iso_date):
+    return os.path.join(expr_dir(ticker, expr), f"{iso_date}.npz")
+
+
+# single fetches land here until compact() folds them into the day file
+def parts_dir(ticker, expr, iso_date):
+    return os.path.join(expr_dir(ticker, expr), f"{iso_date}.parts")
+
+
+def part_paths(ticker, expr, iso_date):
+    return sorted(glob.glob(os.path.join(parts_dir(ticker, expr, iso_date), "*.npz")))
+
+
+def tickers():
+    paths = glob.glob(os.path.join(constants.SNAPSHOTS_DIR, "*"))
+    return sorted(os.path.basename(p) for p in paths)
+
+
+def exprs(ticker):
+    paths = glob.glob(os.path.join(constants.SNAPSHOTS_DIR, ticker, "*"))
+    return sorted(os.path.basename(p) for p in paths)
+
+
+def days(ticker, expr):
+    """
+    Recorded dates for ticker / expr (compacted or not), ascending
+    """
+    paths = glob.glob(os.path.join(expr_dir(ticker, expr), "*"))
+    names = [os.path.basename(p) for p in paths]
+    return sorted({n.split(".")[0] for n in names if n.endswith((".npz", ".parts"))})
+
+
+def columns(chain):
+    row_fields = [*PRICE_FIELDS.values(), *MARKET_FIELDS.values(), *TICK_FIELDS]
+    cols = {k: [] for k in ["type", *row_fields]}
+    for c in chain:
+        if None in (row := [c.get(k) for k in PRICE_FIELDS]):
+            continue
+        cols["type"].append(c.get("type").lower())
+        for k, v in zip(PRICE_FIELDS.values(), row):
+            cols[k].append(float(v))
+        for k, v in MARKET_FIELDS.items():
+            cols[v].append(float(c.get(k) or "nan"))
+        ticks = c.get("min_ticks") or {}
+        for k in TICK_FIELDS:
+            cols[k].append(float(ticks.get(k) or "nan"))
+    return {
+        k: np.asarray(v, dtype="U4" if k == "type" else float) for k, v in cols.items()
+    }
+
+
+def implied_underlying(cols):
+    """
+    Underlying price from put-call parity at the strike where call and put
+    marks are closest (S ~ K + C - P), so recording costs no quote call
+    """
+    strikes, prices = {}, {}
+    for t in ["call", "put"]:
+        rows = cols["type"] == t
+        strikes[t], prices[t] = cols["strike"][rows], cols["mark"][rows]
+    common, ic, ip = np.intersect1d(
+        strikes["call"], strikes["put"], return_indices=True
+    )
+    if not len(common):
+        return np.nan
+    diff = prices["call"][ic] - prices["put"][ip]
+    i = int(np.argmin(np.abs(diff)))
+    return float(common[i] + diff[i])
+
+
+def snapshot(taken_at, chain, underlying=None):
+    cols = columns(chain)
+    if underlying is None:
+        underlying = implied_underlying(cols)
+    return {
+        "taken_at": np.array([np.datetime64(taken_at, "s")]),
+        "underlying": np.array([underlying], dtype=float),
+        "snapshot": np.zeros(len(cols["type"]), dtype=int),
+    } | cols
+
+
+def merge(parts):
+    """
+    Column dicts (one or more snapshots each) -> one, snapshots in time
+    order and rows grouped by snapshot. Columns a part lacks are NaN
+    """
+    keys = list(dict.fromkeys(k for p in parts for k in p))
+    n_snapshots = np.cumsum([0] + [len(p["taken_at"]) for p in parts])
+
+    res = {}
+    for k in keys:
+        values = []
+        for p, offset in zip(parts, n_snapshots):
+            size = len(p["taken_at" if k in SNAPSHOT_FIELDS else "snapshot"])
+            v = p[k] if k in p else np.full(size, np.nan)
+            values.append(v + offset if k == "snapshot" else v)
+        res[k] = np.concatenate(values)
+
+    order = np.argsort(res["taken_at"], kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    res["snapshot"] = rank[res["snapshot"]]
+    rows = np.argsort(res["snapshot"], kind="stable")
+    return {k: v[order] if k in SNAPSHOT_FIELDS else v[rows] for k, v in res.items()}
+
+
+def save(path, cols):
+    # temp name first, readers never see half a file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, **cols)
+    os.replace(tmp, path)
+    return path
+
+
+def read(path):
+    with np.load(path) as z:
+        return {k: z[k] for k in z.files}
+
+
+def write_day(ticker, expr, iso_date, snapshots):
+    """
+    snapshots: [(taken_at, chain), ...] as returned by hood.get_option_chain.
+    Stored as one compressed array per column, rows of all snapshots
+    concatenated in time order (Day.offsets finds them again)
+    """
+    parts = [snapshot(t, chain) for t, chain in snapshots]
+    return save(day_path(ticker, expr, iso_date), merge(parts))
+
+
+############
+# RECORDER #
+############
+
+
+@timed
+def record(ticker, expr, chain, taken_at=None, underlying=None):
+    """
+    One chain fetch -> its own small part file (no read-modify-write, safe
+    from several processes at once). taken_at is naive UTC
+    """
+    taken_at = taken_at or datetime.utcnow()
+    name = f"{taken_at.strftime('%H%M%S%f')}_{os.getpid()}.npz"
+    path = os.path.join(parts_dir(ticker, expr, taken_at.date().isoformat()), name)
+    return save(path, snapshot(taken_at, chain, underlying))
+
+
+def compact(ticker, expr, iso_date):
+    """
+    Folds the day's part files into its day file. Its unpacked copy (if
+    any) is stale from here on and goes
+    """
+    if not (parts := part_paths(ticker, expr, iso_date)):
+        return 0
+
+    path = day_path(ticker, expr, iso_date)
+    existing = [read(path)] if os.path.exists(path) else []
+    save(path, merge(existing + [read(p) for p in parts]))
+    remove_unpacked(ticker, expr, iso_date)
+
+    for p in parts:
+        os.remove(p)
+    try:
+        os.rmdir(parts_dir(ticker, expr, iso_date))
+    except OSError:  # a fetch landed meanwhile, next compact takes it
+        pass
+    return len(parts)
+
+
+def today():
+    return datetime.utcnow().date().isoformat()
+
+
+def compact_all(before=None):
+    """
+    Compacts every recorded day before `before` (ISO date, default today
+    UTC): days still being recorded are left alone
+    """
+    before = before or today()
+    pattern = os.path.join(constants.SNAPSHOTS_DIR, "*", "*", "*.parts")
+    count = 0
+    for d in glob.glob(pattern):
+        expr_path, name = os.path.split(d)
+        iso_date = name[: -len(".parts")]
+        if iso_date < before:
+            ticker_path, expr = os.path.split(expr_path)
+            count += compact(os.path.basename(ticker_path), expr, iso_date)
+    return count
+
+
+##########
+# READER #
+##########
+
+
+def unpacked_dir(ticker, expr, iso_date):
+    return os.path.join(constants.SNAPSHOTS_DIR, ".mmap", ticker, expr, iso_date)
+
+
+def unpack(ticker, expr, iso_date):
+    """
+    Uncompressed .npy per column for a day file, so that processes reading
+    it np.load(mmap_mode="r") and share the same page cache instead of each
+    inflating a private copy. Skipped while the copy is newer than the file.
+
+    Only days compact_all has already folded (before today UTC) are unpacked,
+    compacting here would race the recorder and the nightly compact. Returns
+    None for the others, load_columns reads their files and parts as they are
+    """
+    path = day_path(ticker, expr, iso_date)
+    if iso_date >= today() or not os.path.exists(path):
+        return None
+
+    d = unpacked_dir(ticker, expr, iso_date)
+    if is_unpacked(ticker, expr, iso_date):
+        return d
+
+    os.makedirs(d, exist_ok=True)
+    for k, v in read(path).items():
+        np.save(os.path.join(d, f"{k}.tmp.npy"), v)
+        os.replace(os.path.join(d, f"{k}.tmp.npy"), os.path.join(d, f"{k}.npy"))
+    with open(os.path.join(d, ".done"), "w"):
+        pass
+    return d
+
+
+# open memory maps stay valid, later readers go back to the day file
+def remove_unpacked(ticker, expr, iso_date):
+    shutil.rmtree(unpacked_dir(ticker, expr, iso_date), ignore_errors=True)
+
+
+# the day file is rewritten by every compact, an older copy is stale
+def is_unpacked(ticker, expr, iso_date):
+    done = os.path.join(unpacked_dir(ticker, expr, iso_date), ".done")
+    path = day_path(ticker, expr, iso_date)
+    return (
+        os.path.exists(done)
+        and os.path.exists(path)
+        and os.path.getmtime(done) >= os.path.getmtime(path)
+    )
+
+
+def load_columns(ticker, expr, iso_date):
+    parts = part_paths(ticker, expr, iso_date)
+    d = unpacked_dir(ticker, expr, iso_date)
+    if not parts and is_unpacked(ticker, expr, iso_date):
+        return {
+            os.path.basename(f)[: -len(".npy")]: np.load(f, mmap_mode="r")
+            for f in glob.glob(os.path.join(d, "*.npy"))
+        }
+
+    path = day_path(ticker, expr, iso_date)
+    files = ([path] if os.path.exists(path) else []) + parts
+    if len(files) == 1:
+        return read(files[0])
+    return merge([read(f) for f in files])
+
+
+def at(ticker, expr, when):
+    """
+    Random access: (Day, index) of the last snapshot taken at / before
+    `when` (naive UTC datetime), None if there is none that day
+    """
+    iso_date = when.date().isoformat()
+    if iso_date not in days(ticker, expr):
+        return None
+    day = Day(ticker, expr, iso_date)
+    i = int(np.searchsorted(day.taken_at, np.datetime64(when, "s"), side="right")) - 1
+    return (day, i) if i >= 0 else None
+
+
+class Day:
+    """
+    Every snapshot of one ticker / expr recorded on one date. Chains are only
+    built (and cached) for the snapshots asked for, price lookups for a fixed
+    strike run over all snapshots at once
+    """
+
+    def __init__(self, ticker, expr, iso_date):
+        self.ticker = ticker
+        self.expr = expr
+        self.date = iso_date
+
+        self.cols = load_columns(ticker, expr, iso_date)
+        self.taken_at = self.cols.pop("taken_at")
+        self.underlying = self.cols.pop(
+            "underlying", np.full(len(self.taken_at), np.nan)
+        )
+        # rows of snapshot i are offsets[i]:offsets[i + 1]
+        self.offsets = np.searchsorted(
+            self.cols["snapshot"], np.arange(len(self.taken_at) + 1)
+        )
+        self.chains = {}
+
+    def __len__(self):
+        return len(self.taken_at)
+
+    def first_at(self, hhmm=None):
+        """
+        Index of the first snapshot taken at / after hh:mm (None if there is
+        none). Timestamps are stored as naive UTC
+        """
+        if not hhmm:
+            return 0 if len(self) else None
+        t = np.datetime64(datetime.fromisoformat(f"{self.date}T{hhmm}"), "s")
+        i = int(np.searchsorted(self.taken_at, t))
+        return i if i < len(self) else None
+
+    def chain(self, i):
+        if i not in self.chains:
+            rows = slice(self.offsets[i], self.offsets[i + 1])
+            self.chains[i] = optimizer.Chain.from_columns(
+                {k: v[rows] for k, v in self.cols.items()}, self.ticker
+            )
+        return self.chains[i]
+
+    def prices(self, o_type, strike, field):
+        """
+        field (ask / bid / mark) of one option for every snapshot, NaN where
+        the option is missing
+        """
+        res = np.full(len(self), np.nan)
+        mask = (self.cols["type"] == o_type) & (self.cols["strike"] == strike)
+        ix = np.flatnonzero(mask)
+        res[self.cols["snapshot"][ix]] = self.cols[field][ix]
+        return res
+
+    def snapshot(self, i):
+        """
+        Every stored column of snapshot i (iv, oi, volume, ...) plus its
+        underlying price, for post-trade analysis
+        """
+        rows = slice(self.offsets[i], self.offsets[i + 1])
+        return {k: v[rows] for k, v in self.cols.items() if k != "snapshot"} | {
+            "taken_at": self.taken_at[i],
+            "underlying": float(self.underlying[i]),
+        }
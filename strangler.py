@@ -1,11 +1,14 @@
 from config import config  # pylint: disable=wrong-import-order
 
+import contextvars
 import multiprocessing
 import operator
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime as dt
 from pprint import pformat, pprint  # pylint: disable=unused-import
 
+import constants
 import date_helpers as dh
 import discord_logging as dlog
 import helpers
@@ -13,6 +16,9 @@ import hood
 from aggregator import aggregator
 from decorators import log, retry
 from models import order, strangle
+import optimizer
+import order_watcher
+from timing import timed
 
 redis = config.redis
 
@@ -74,24 +80,27 @@ class Buy:
         else:
             self.handle_confirm_error()
 
+    @timed
     @log
-    @retry(skip_first_delay=False)
     def confirm_order(self, o_type):
         self.buy_orders[o_type] = (
             order.find(self.buy_call_oid)
             if o_type == "call"
             else order.find(self.buy_put_oid)
         )
-        return self.buy_orders[o_type].sync().is_filled()
+        return order_watcher.wait_for(
+            self.buy_orders[o_type], order.OrderWrapper.is_filled
+        )
 
-    # using multiprocessing to execute orders in parallel ->
-    # reducing chance that ask prices slide
+    # using threads to execute orders in parallel ->
+    # reducing chance that ask prices slide. Not a process pool: po_buy runs
+    # in a daemonic oracle pool worker, which can't have children
+    @timed
     @log
     def open_orders(self):
-        with multiprocessing.Pool() as p:
-            self.buy_call_oid, self.buy_put_oid = p.map(
-                self.open_order, ["call", "put"]
-            )
+        self.buy_call_oid, self.buy_put_oid = self.map_legs(
+            self.open_order, ["call", "put"]
+        )
 
     @log
     def open_order(self, o_type):
@@ -103,8 +112,16 @@ class Buy:
 
     @log
     def cancel_orders(self):
-        with multiprocessing.Pool() as p:
-            p.map(self.cancel_order, [self.buy_call_oid, self.buy_put_oid])
+        self.map_legs(self.cancel_order, [self.buy_call_oid, self.buy_put_oid])
+
+    # both legs are broker round trips - run them side by side
+    @staticmethod
+    def map_legs(f, args):
+        with ThreadPoolExecutor(max_workers=len(args)) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, f, arg) for arg in args
+            ]
+            return [future.result() for future in futures]
 
     @log
     def cancel_order(self, oid):
@@ -159,6 +176,7 @@ class Select:
     def __init__(self, expr):
         self.expr = expr
 
+    @timed
     def choose_play(self, max_plays=50):
         for ticker in self.get_tickers()[:max_plays]:
             if strangle.exists(ticker, self.expr):
@@ -181,66 +199,16 @@ class Select:
     def get_option_chain(self, ticker):
         return hood.get_option_chain(ticker, self.expr)
 
+    @timed
     def get_optimal_strikes(
         self, ticker, multiplier=_OPTIMAL_STRIKE_MULTIPLIER, slack=_SLACK_MULTIPLIER
     ):
         if not (chain := hood.get_option_chain(ticker, self.expr)):
             return None
 
-        d = {"call": {}, "put": {}}
-        roi = (1 + multiplier / 100) * 2
-
-        optimal_call_val = sys.maxsize
-        optimal_put_val = 0
-
-        strike = None
-        for c in chain:
-            try:
-                o_type = c.get("type").lower()
-                strike = float(c.get("strike_price"))
-                ask = float(c.get("ask_price"))
-                bid = float(c.get("bid_price"))
-                mark = float(c.get("mark_price"))
-                min_ticks = c.get("min_ticks")
-            except TypeError:
-                dlog.warn(f"get_optimal_strikes: bad option - {ticker} ${strike}")
-                continue
-
-            # to maximize odds of a complete fill price is set to ask
-            # also "slack" is extra few cents added to price
-            # again with the purpose of avoiding partial fills
-            price = ask
-            if price > float(min_ticks["cutoff_price"]):
-                price += slack * float(min_ticks["above_tick"])
-            else:
-                price += slack * float(min_ticks["below_tick"])
-
-            if o_type == "call":
-                target = strike + roi * mark
-                if target < optimal_call_val:
-                    optimal_call_val = target
-                    d[o_type] = {
-                        "strike": strike,
-                        "ask": round(price, 2),
-                        "bid": bid,
-                        "mark": mark,
-                        "target": optimal_call_val,
-                        "min_ticks": min_ticks,
-                    }
-            else:
-                target = strike - roi * mark
-                if target > optimal_put_val:
-                    optimal_put_val = target
-                    d[o_type] = {
-                        "strike": strike,
-                        "ask": round(price, 2),
-                        "bid": bid,
-                        "mark": mark,
-                        "target": optimal_call_val,
-                        "min_ticks": min_ticks,
-                    }
-
-        return d
+        return optimizer.optimal_strangle(
+            optimizer.Chain(chain, ticker), multiplier, slack
+        )
 
     def validate(self, d):
         call_data = d["call"]
@@ -286,6 +254,12 @@ class Cache:
 
     namespace = "pending_orders"
 
+    # pending order keys sorted by expiration, replaces a keyspace SCAN
+    index = helpers.key_join("i", namespace)
+    # set once keys cached before the index existed are in it. An empty
+    # ZSET is deleted by redis, so the index itself can't tell
+    index_built = helpers.key_join(index, "built")
+
     @classmethod
     def exec(cls, expr, ticker, call_oid, put_oid):
         cls(expr, ticker, call_oid, put_oid).cache_order()
@@ -301,18 +275,33 @@ class Cache:
 
     def cache_order(self):
         h = {"call_oid": self.call_oid, "put_oid": self.put_oid}
-        redis.hset(self.key(), mapping=h)
+        with redis.pipeline() as pipe:
+            pipe.hset(self.key(), mapping=h)
+            pipe.zadd(self.index, {self.key(): helpers.date_score(self.expr)})
+            pipe.execute()
 
     @classmethod
     def get_orders(cls):
-        return [
-            {x: redis.hgetall(x)} for x in config.redis.scan_iter(f"*{cls.namespace}*")
-        ]
+        # keys cached before the index existed
+        if not redis.exists(cls.index_built):
+            for k in redis.scan_iter(f"{cls.namespace}:*"):
+                redis.zadd(cls.index, {k: helpers.date_score(k.split(":")[1])})
+            redis.set(cls.index_built, 1)
+
+        keys = redis.zrange(cls.index, 0, -1)
+        with redis.pipeline(transaction=False) as pipe:
+            for k in keys:
+                pipe.hgetall(k)
+            res = pipe.execute()
+        return [{k: h} for k, h in zip(keys, res) if h]
 
     @classmethod
     def delete_strangle_key(cls, s):
         k = helpers.key_join(cls.namespace, s.expr, s.ticker)
-        redis.delete(k)
+        with redis.pipeline() as pipe:
+            pipe.delete(k)
+            pipe.zrem(cls.index, k)
+            pipe.execute()
 
 
 class Sell:
@@ -362,10 +351,13 @@ class Sell:
             else:
                 pass  # error handle
 
+    @timed
     @log
-    @retry(skip_first_delay=False)
     def confirm(self, o):
-        o.sync()
+        return order_watcher.wait_for(o, self.is_sell_placed)
+
+    @staticmethod
+    def is_sell_placed(o):
         try:
             return o.is_confirmed() or o.is_filled() or o.is_partially_filled()
         except AttributeError:
@@ -450,14 +442,17 @@ class Close:
 
     @classmethod
     def exec(cls, s):
-        if not s.locked:
-            s.lock()
+        if not s.lock():
+            return
+        try:
             cls(s).run()
+        finally:
             s.unlock()
 
     def __init__(self, _strangle):
         self.strangle = _strangle
 
+    @timed
     def run(self):
         self.strangle.sync()
         if self.close_if_filled():
@@ -484,6 +479,7 @@ class Close:
             return True
         return False
 
+    @timed
     @log
     @retry(19, 3, skip_first_delay=False)
     def confirm_sells_filled(self):
@@ -499,7 +495,11 @@ class Close:
         self.eject(self.strangle.most_recent_sell_order("call"))
         self.eject(self.strangle.most_recent_sell_order("put"))
 
+    @timed
     def eject(self, o):
+        if not self.strangle.refresh_lock():
+            dlog.warn(f"{self.strangle.pk} - lock expired, skipping eject")
+            return
         if js := self.cancel_and_sell(o):
             eject_o = order.create(js)
             self.strangle.append_sell_order(eject_o)
@@ -546,6 +546,20 @@ def close_strangle(s):
     Close.exec(s)
 
 
+# close checks are mostly waiting on the hood API so threads are enough.
+# Close.exec takes a per-strangle lock so overlapping runs never double eject
+def close_strangles(strangles, max_workers=constants.CLOSE_MAX_WORKERS):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # own context copy per task keeps timing spans nested
+        futures = {
+            executor.submit(contextvars.copy_context().run, close_strangle, s): s
+            for s in strangles
+        }
+        for future in as_completed(futures):
+            if err := future.exception():
+                dlog.error(f"{futures[future].pk} - close failed: {err!r}")
+
+
 def log_active_strangles():
     strangle.notifications.active_strangle_status(strangle.active_strangles())
 
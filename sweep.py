@@ -0,0 +1,134 @@
+import csv
+import itertools
+import multiprocessing
+import os
+import random
+import sys
+from datetime import datetime
+
+import backtest
+import constants
+import snapshots
+
+# settings.yml condor keys -> values tried, grid = every combination
+CONDOR_SPACE = {
+    "optimal_strike_multiplier_buy": [25.0, 50.0, 75.0, 100.0, 125.0, 150.0],
+    "optimal_strike_multiplier_sell": [0.0, 25.0, 50.0, 75.0, 100.0],
+    "min_credit_collateral_ratio": [20.0, 30.0, 40.0, 50.0, 60.0, 70.0, 80.0],
+    "target_roi": [30.0, 50.0, 70.0, 90.0],
+    "buy_slack": [0, 1, 2],
+    "sell_slack": [0, 3, 6],
+}
+STRANGLE_SPACE = {
+    "optimal_strike_multiplier": [10.0, 20.0, 30.0, 40.0, 50.0, 60.0],
+    "roi_multiplier": [10.0, 25.0, 50.0, 75.0, 100.0],
+    "max_bid": [0.5, 1.0, 2.0],
+}
+
+
+def space_for(strategy):
+    return STRANGLE_SPACE if strategy == "strangle" else CONDOR_SPACE
+
+
+def grid(space):
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*space.values())]
+
+
+def sample(space, n=constants.SWEEP_RANDOM_SAMPLES, seed=None):
+    rng = random.Random(seed)
+    combos = {tuple(rng.choice(v) for v in space.values()) for _ in range(n)}
+    return [dict(zip(space, values)) for values in sorted(combos)]
+
+
+def chunks(param_sets, size=constants.SWEEP_CHUNK):
+    """
+    Sets sharing strike multipliers go to the same task, so a worker's
+    cached strike selections are reused by the rest of its chunk
+    """
+    param_sets = sorted(
+        param_sets, key=lambda p: [v for k, v in p.items() if "multiplier" in k]
+    )
+    return [param_sets[i : i + size] for i in range(0, len(param_sets), size)]
+
+
+def prepare(strategy, tickers=None, start=None, end=None):
+    """
+    Unpacks every compacted day file the sweep reads, workers then
+    memory-map the same columns instead of each decompressing their own
+    copy. Returns the unpacked days
+    """
+    res = []
+    for ticker, expr in backtest.positions(strategy, tickers, start, end):
+        for iso_date in snapshots.days(ticker, expr):
+            if snapshots.unpack(ticker, expr, iso_date):
+                res.append((ticker, expr, iso_date))
+    return res
+
+
+def evaluate(args):
+    strategy, param_sets, tickers, start, end = args
+    rows = []
+    for params in param_sets:
+        res = backtest.run(strategy, params, tickers, start, end)
+        rows.append(
+            params | {k: v for k, v in res.items() if k not in ["params", "trades"]}
+        )
+    return rows
+
+
+def rank(rows, metric="pnl"):
+    return sorted(rows, key=lambda r: (-r[metric], r["max_drawdown"]))
+
+
+def write(rows, strategy):
+    os.makedirs(constants.SWEEP_DIR, exist_ok=True)
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    path = os.path.join(constants.SWEEP_DIR, f"{strategy}_{stamp}.csv")
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+
+def run(
+    strategy,
+    param_sets,
+    tickers=None,
+    start=None,
+    end=None,
+    processes=None,
+    metric="pnl",
+):
+    """
+    Backtests every parameter set (dicts of settings.yml keys, the rest
+    keep their live values) on all cores. Rows come back best first
+    """
+    unpacked = prepare(strategy, tickers, start, end)
+
+    tasks = [(strategy, c, tickers, start, end) for c in chunks(param_sets)]
+    ctx = multiprocessing.get_context()
+    try:
+        with ctx.Pool(processes or os.cpu_count()) as pool:
+            rows = [r for res in pool.imap_unordered(evaluate, tasks) for r in res]
+    finally:
+        # uncompressed copies are several times the day files, don't keep them
+        for day in unpacked:
+            snapshots.remove_unpacked(*day)
+
+    return rank(rows, metric)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("Usage: sweep.py <strategy> [grid|random] [start] [end]")
+
+    _strategy, mode = sys.argv[1], (sys.argv[2:3] or ["grid"])[0]
+    space = space_for(_strategy)
+    sets = grid(space) if mode == "grid" else sample(space)
+
+    ranked = run(_strategy, sets, None, *sys.argv[3:5])
+    print(f"{len(ranked)} parameter sets -> {write(ranked, _strategy)}\n")
+    for row in ranked[:10]:
+        print(row)
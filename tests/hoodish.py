@@ -39,6 +39,12 @@ def get_open_orders():
     return rh.get_open_option_positions()
 
 
+def get_orders_since(timestamp):
+    url = rh.urls.option_orders_url()
+    res = rh.helper.request_get(url, "pagination", {"updated_at[gte]": timestamp})
+    return [js for js in res or [] if js]
+
+
 def get_price(ticker):
     return rh.stocks.get_latest_price(ticker)[0]
 
@@ -77,6 +83,18 @@ def get_option_chain_by_strike(ticker, expr, strike):
         return []
 
 
+def get_option_instruments(chain_id, expr):
+    url = rh.urls.option_instruments_url()
+    params = {"chain_id": chain_id, "expiration_dates": expr, "state": "active"}
+    return [js for js in rh.helper.request_get(url, "pagination", params) or [] if js]
+
+
+def get_option_quotes(ids):
+    url = rh.urls.marketdata_options_url()
+    res = rh.helper.request_get(url, "results", {"ids": ",".join(ids)})
+    return [js for js in res or [] if js]
+
+
 def get_market_hours(iso_date):
     return rh.get_market_hours(_MIC, iso_date)
 
@@ -0,0 +1,46 @@
+# pylint: skip-file
+import threading
+import time
+
+import aggregator
+
+# expiration -> tickers its ivs file ranks
+_RANKED = {"2023-05-12": ["A", "B"], "2023-05-19": ["C", "D"]}
+
+
+def test_concurrent_rankings_keep_their_own_tickers(monkeypatch):
+    ag = aggregator
+    monkeypatch.setattr(ag.dh, "current_monthly_expr", lambda: "2023-05-19")
+    monkeypatch.setattr(ag.dh, "next_expr", lambda: "2023-05-12")
+    monkeypatch.setattr(ag, "parse_monthlies_csv", lambda: list("ABCD"))
+    monkeypatch.setattr(ag, "parse_weeklies_csv", lambda: list("ABCD"))
+    monkeypatch.setattr(ag, "parse_blacklist_csv", lambda: [])
+    monkeypatch.setattr(ag, "expires_this_week", lambda expr: False)
+    monkeypatch.setattr(ag, "parse_aggregate_csv", lambda tickers, this_week: None)
+
+    def parse_ivs_csv(ivs_csv):
+        for i, ticker in enumerate(_RANKED[ivs_csv[len("ivs_") : -len(".csv")]]):
+            ag.d[ticker] = {"zscore_no_outliers": -i}
+            time.sleep(0.01)  # the other thread gets in here without the lock
+
+    monkeypatch.setattr(ag, "parse_ivs_csv", parse_ivs_csv)
+    for stage in [
+        "remove_range_outliers",
+        "add_statistics",
+        "add_weighted_averages",
+        "add_expected_ranges",
+        "add_zscores",
+    ]:
+        monkeypatch.setattr(ag, stage, lambda: time.sleep(0.01))
+
+    res = {}
+
+    def rank(expr):
+        res[expr] = ag.aggregator(expr)
+
+    threads = [threading.Thread(target=rank, args=(expr,)) for expr in _RANKED]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert res == _RANKED
@@ -0,0 +1,70 @@
+# pylint: skip-file
+import os
+
+import numpy as np
+import pytest
+
+import archive
+
+
+def position(pk, expr, pnl):
+    return {
+        "pk": pk,
+        "ticker": pk.split(":")[0],
+        "expr": np.datetime64(expr, "D"),
+        "created_at": np.datetime64(f"{expr}T14:00:00", "s"),
+        "result": "filled",
+        "quantity": 1.0,
+        "open_premium": 100.0,
+        "close_premium": 100.0 + pnl,
+        "pnl": pnl,
+    }
+
+
+@pytest.fixture()
+def archived(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive.constants, "ARCHIVE_DIR", str(tmp_path))
+    rows = {
+        "2023-05-05": [position("SPY:2023-05-05", "2023-05-05", 40.0)],
+        "2023-05-12": [
+            position("SPY:2023-05-12", "2023-05-12", -25.0),
+            position("QQQ:2023-05-12", "2023-05-12", 0.0),
+        ],
+    }
+    for expr, r in rows.items():
+        archive.write_part(archive.part_path("condor", expr, "positions"), r)
+
+
+def test_win_rate(archived):
+    assert archive.win_rate("condor") == {
+        "wins": 1,
+        "losses": 1,
+        "draws": 1,
+        "win_rate": 0.3333,
+        "pnl": 15.0,
+    }
+
+
+def test_pnl_by_expiration_and_range(archived):
+    assert archive.pnl("condor") == {"2023-05-05": 40.0, "2023-05-12": -25.0}
+    assert archive.pnl("condor", start="2023-05-06") == {"2023-05-12": -25.0}
+
+
+def test_rerun_duplicates_dropped(archived):
+    dup = [position("SPY:2023-05-05", "2023-05-05", 40.0)]
+    archive.write_part(archive.part_path("condor", "2023-05-05", "positions"), dup)
+    assert len(archive.load("condor")["pk"]) == 3
+
+
+def test_dailies_share_a_weekly_directory(archived):
+    for expr, pnl in [("2023-05-09", 5.0), ("2023-05-10", 7.0)]:
+        rows = [position(f"SPY:{expr}", expr, pnl)]
+        archive.write_part(archive.part_path("condor", expr, "positions"), rows)
+
+    weeks = os.listdir(os.path.join(archive.constants.ARCHIVE_DIR, "condor"))
+    assert sorted(weeks) == ["2023-W18", "2023-W19"]
+    # a range ending mid week leaves that week's later expirations out
+    assert archive.pnl("condor", start="2023-05-09", end="2023-05-10") == {
+        "2023-05-09": 5.0,
+        "2023-05-10": 7.0,
+    }
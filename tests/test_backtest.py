@@ -0,0 +1,122 @@
+# pylint: skip-file
+from datetime import datetime
+
+import pytest
+
+import backtest
+import optimizer
+import snapshots
+
+_MIN_TICKS = {"cutoff_price": "3.00", "above_tick": "0.05", "below_tick": "0.01"}
+
+# strike: (call mark, put mark)
+_MARKS = {
+    400: (12.0, 0.2),
+    405: (7.5, 0.6),
+    410: (3.5, 1.6),
+    415: (1.1, 4.2),
+    420: (0.3, 8.4),
+    425: (0.1, 13.2),
+}
+
+_PARAMS = {
+    "max_condors": 1,
+    "max_collateral": 5.0,
+    "min_credit_collateral_ratio": 50.0,
+    "target_roi": 50.0,
+    "optimal_strike_multiplier_buy": 100.0,
+    "optimal_strike_multiplier_sell": 0.0,
+    "buy_slack": 0,
+    "sell_slack": 3,
+    "entry_time": None,
+    "fill_ratio": 0.5,
+    "fill_window": 3,
+}
+
+
+def chain(scale=1.0):
+    rows = []
+    for strike, marks in _MARKS.items():
+        for o_type, mark in zip(["call", "put"], marks):
+            mark = round(mark * scale, 2)
+            rows.append(
+                {
+                    "type": o_type,
+                    "strike_price": f"{strike:.4f}",
+                    "mark_price": str(mark),
+                    "ask_price": str(round(mark + 0.05, 2)),
+                    "bid_price": str(round(max(mark - 0.05, 0), 2)),
+                    "min_ticks": _MIN_TICKS,
+                }
+            )
+    return rows
+
+
+@pytest.fixture()
+def recorded(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots.constants, "SNAPSHOTS_DIR", str(tmp_path))
+    backtest.load_path.cache_clear()
+
+    def record(expr, day2_scale):
+        snapshots.write_day(
+            "SPY", expr, "2023-05-08", [(datetime(2023, 5, 8, 14), chain())]
+        )
+        snapshots.write_day(
+            "SPY", expr, "2023-05-09", [(datetime(2023, 5, 9, 14), chain(day2_scale))]
+        )
+
+    yield record
+    backtest.load_path.cache_clear()
+
+
+def strikes(d):
+    return [d[t][s]["strike"] for t in ["call", "put"] for s in ["buy", "sell"]]
+
+
+def test_stored_chain_selects_same_strikes(recorded):
+    recorded("2023-05-09", 1.0)
+    day = snapshots.Day("SPY", "2023-05-09", "2023-05-08")
+    stored = optimizer.optimal_condor(day.chain(0), 100, 0, 1)
+    live = optimizer.optimal_condor(optimizer.Chain(chain(), "SPY"), 100, 0, 1)
+    assert strikes(stored) == strikes(live)
+    assert stored["credit_with_slack"] == live["credit_with_slack"]
+    assert day.prices("put", 405.0, "ask").tolist() == [0.65]
+
+
+@pytest.mark.parametrize(
+    "scale, exit, pnl",
+    [
+        (0.5, "target", 90.0),  # credit 3.2, target (3.2 * 150 - 250) / 100 = 2.3
+        (1.5, "eject", -180.0),  # natural debit 5.3 -> capped at collateral 5
+    ],
+)
+def test_condor_replay(recorded, scale, exit, pnl):
+    recorded("2023-05-09", scale)
+    res = backtest.run("condor", _PARAMS, tickers=["SPY"])
+    (trade,) = res["trades"]
+    assert trade["filled"] and trade["credit"] == 3.2
+    assert (trade["exit"], trade["pnl"]) == (exit, pnl)
+    assert res["win_rate"] == (1.0 if pnl > 0 else 0.0)
+
+
+def test_one_play_per_expiration(recorded):
+    recorded("2023-05-09", 0.5)
+    snapshots.write_day(
+        "AAA", "2023-05-09", "2023-05-08", [(datetime(2023, 5, 8, 14), chain())]
+    )
+    for tickers in [["SPY", "AAA"], ["AAA", "SPY"]]:
+        res = backtest.run("condor", _PARAMS, tickers=tickers)
+        assert [t["ticker"] for t in res["trades"]] == tickers[:1]
+
+
+def test_stats_drawdown():
+    trades = [
+        {"expr": e, "filled": True, "pnl": p}
+        for e, p in [("2023-05-01", 50), ("2023-05-02", -80), ("2023-05-03", 20)]
+    ]
+    trades.append({"expr": "2023-05-04", "filled": False, "pnl": 0.0})
+    res = backtest.stats(trades)
+    assert res["filled"] == 3
+    assert res["pnl"] == -10
+    assert res["max_drawdown"] == 80
+    assert res["win_rate"] == round(2 / 3, 4)
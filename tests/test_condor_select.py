@@ -0,0 +1,77 @@
+# pylint: skip-file
+import random
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import condorer
+
+# ticker -> collateral, tickers without one have no valid play
+_PLAYS = {"B": 1.0, "D": 2.0, "E": 0.5}
+
+
+@pytest.fixture()
+def candidates(monkeypatch):
+    tickers = list("ABCDEF")
+    monkeypatch.setattr(condorer.Select, "get_tickers", lambda self: tickers)
+
+    def evaluate(self, ticker, max_collateral, max_quantity, dry_run):
+        time.sleep(random.uniform(0, 0.01))  # finish out of order
+        if ticker not in _PLAYS:
+            return None
+        collateral = _PLAYS[ticker]
+        quantity = min(max_quantity, max_collateral // collateral)
+        return {"ticker": ticker, "collateral": collateral, "quantity": quantity}
+
+    monkeypatch.setattr(condorer.Select, "evaluate", evaluate)
+
+
+def test_choose_play_keeps_rank_order(candidates):
+    d = condorer.Select("2023-05-12", 0).choose_play(max_collateral=2.0, window=4)
+    assert d["ticker"] == "B"
+
+
+def test_multi_select_shares_collateral(candidates):
+    plays = condorer.MultiSelect(["2023-05-19", "2023-05-12"], 0).choose_plays(
+        max_collateral=2.5, max_quantity=2, window=3
+    )
+    # nearest expiration first: B x2 (2.0), then D does not fit in 0.5 -> E x1
+    assert plays["2023-05-12"]["ticker"] == "B"
+    assert plays["2023-05-12"]["quantity"] == 2
+    assert plays["2023-05-19"]["ticker"] == "E"
+    assert plays["2023-05-19"]["quantity"] == 1
+
+
+def test_buy_ladder_reuses_selection_for_one_confirm_window(monkeypatch):
+    # @log decorators post every call to the discord webhooks
+    monkeypatch.setattr(condorer.dlog, "send_notification", lambda *args: None)
+    clock = [1000.0]
+    monkeypatch.setattr(condorer.time, "monotonic", lambda: clock[0])
+
+    def wait_for(o, predicate, timeout, *args):
+        clock[0] += timeout  # never filled, the rung waits out its window
+        return None
+
+    selects, prices = [], []
+
+    def select(expr, slack, max_collateral):
+        selects.append(slack)
+        return {"ticker": "B", "credit": 0.5, "collateral": 1.0}
+
+    monkeypatch.setattr(condorer.order_watcher, "wait_for", wait_for)
+    monkeypatch.setattr(condorer.Select, "exec", select)
+
+    def open_order(self):
+        prices.append(self.buy_data.get("credit_with_slack"))
+        return SimpleNamespace(id=len(prices))
+
+    monkeypatch.setattr(condorer.Buy, "open_order", open_order)
+    monkeypatch.setattr(condorer.Buy, "cancel_order", lambda self, oid: None)
+    monkeypatch.setattr(condorer, "_BUY_SLACK", 0)
+
+    b = condorer.Buy("2023-05-12", {"ticker": "B", "credit": 0.5, "collateral": 1.0})
+    b.run()
+    # rung 0: handed over play, rung 1: repriced, rung 2: stale -> reselected
+    assert selects == [2]
+    assert prices[1] == pytest.approx(0.5 - 0.01)
@@ -0,0 +1,83 @@
+# pylint: skip-file
+from types import SimpleNamespace
+
+import pytest
+
+import condorer
+
+# strike, type, side at open, bid, ask
+_LEGS = [
+    (415.0, "call", "buy", 0.10, 0.14),
+    (410.0, "call", "sell", 0.60, 0.70),
+    (405.0, "put", "buy", 0.08, 0.12),
+    (400.0, "put", "sell", 0.90, 1.00),
+]
+
+
+@pytest.fixture()
+def ladder(monkeypatch):
+    o = SimpleNamespace(
+        chain_id="chain",
+        legs=[
+            {"strike_price": f"{k:.4f}", "option_type": t, "side": side}
+            for k, t, side, _, _ in _LEGS
+        ],
+        above_tick=0.05,
+        below_tick=0.01,
+        cutoff_price=3.0,
+    )
+    c = SimpleNamespace(o=o, expr="2023-05-09", collateral=5.0)
+
+    calls = []
+    monkeypatch.setattr(
+        condorer.hood,
+        "get_option_instruments",
+        lambda chain_id, expr: [
+            {"id": f"{t}{k:.0f}", "strike_price": f"{k:.4f}", "type": t}
+            for k, t, *_ in _LEGS
+        ],
+    )
+
+    def quotes(ids):
+        calls.append(ids)
+        return [
+            {"instrument_id": f"{t}{k:.0f}", "bid_price": str(b), "ask_price": str(a)}
+            for k, t, _, b, a in _LEGS
+        ]
+
+    monkeypatch.setattr(condorer.hood, "get_option_quotes", quotes)
+    ladder = condorer.ExitLadder(c, slack=3)
+    ladder.calls = calls
+    return ladder
+
+
+def test_mid_from_one_quote(ladder):
+    assert ladder.quote()
+    assert len(ladder.calls) == 1 and len(ladder.calls[0]) == 4
+    # bought back: 0.65 + 0.95 mid, sold: 0.12 + 0.10 mid
+    assert ladder.mid == pytest.approx(1.38)
+
+
+def test_steps_grow_near_the_close(ladder, monkeypatch):
+    # a rung is a cancel, a replace and a confirm window: 14s, not just the 5s
+    # window. Three rungs hours before the close, then the last minute
+    rung = 14
+    clock, left = [0.0], [3600 * 5]
+    monkeypatch.setattr(condorer.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(
+        condorer.dh, "absolute_seconds_until_expr", lambda expr: left[0]
+    )
+    prices, lefts = [], []
+    for price in ladder.prices():
+        prices.append(price)
+        lefts.append(left[0])
+        clock[0] += rung
+        left[0] = 60 if len(prices) == 4 else left[0] - rung
+
+    assert prices[0] == 1.35  # mid less 3 cents slack
+    assert prices[1:4] == [1.36, 1.37, 1.38]
+    assert prices[4] - prices[3] >= 0.10 - 1e-9
+    assert prices == sorted(prices) and prices[-1] < 5.0
+    # the rest of the way fits in the rungs of the last minute
+    assert lefts[-1] > 0
+    assert ladder.rung_seconds == rung
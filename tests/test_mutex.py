@@ -0,0 +1,80 @@
+# pylint: skip-file
+import pytest
+
+import mutex
+
+_NAME = "test:SPY:2023-05-09"
+
+
+@pytest.fixture()
+def locks():
+    a, b = mutex.Mutex(_NAME), mutex.Mutex(_NAME)
+    yield a, b
+    mutex.redis.delete(a.key, a.fence_key)
+
+
+def test_second_acquire_fails(locks):
+    a, b = locks
+    assert a.acquire()
+    assert b.acquire() is None
+    assert a.is_held()
+    assert not b.is_held()
+
+
+def test_fencing_tokens_increase(locks):
+    a, b = locks
+    t1 = a.acquire()
+    a.release()
+    t2 = b.acquire()
+    assert t2 > t1
+
+
+def test_release_only_by_holder(locks):
+    a, b = locks
+    a.acquire()
+    assert not b.release()
+    assert a.is_held()
+    assert a.release()
+    assert b.acquire()
+
+
+def test_expired_holder_cannot_release_new_holder(locks):
+    a, b = locks
+    a.acquire()
+    mutex.redis.delete(a.key)  # simulate TTL expiry
+    assert b.acquire()
+    assert not a.is_held()
+    assert not a.extend()
+    assert not a.release()
+    assert b.is_held()
+
+
+def _queue(pipe):
+    pipe.set(f"{_NAME}:written", 1)
+
+
+def test_fenced_writes_only_while_held(locks):
+    a, b = locks
+    a.acquire()
+    with mutex.redis.pipeline() as pipe:
+        assert a.fenced(pipe, _queue) == [True]
+
+    mutex.redis.delete(f"{_NAME}:written", a.key)  # simulate TTL expiry
+    assert b.acquire()
+    with mutex.redis.pipeline() as pipe, pytest.raises(mutex.LockLost):
+        a.fenced(pipe, _queue)
+    assert not mutex.redis.exists(f"{_NAME}:written")
+
+
+def test_fenced_write_fails_if_the_lock_moves_before_exec(locks):
+    a, b = locks
+    a.acquire()
+
+    def queue(pipe):
+        _queue(pipe)
+        mutex.redis.delete(a.key)  # expires between the check and EXEC
+        b.acquire()
+
+    with mutex.redis.pipeline() as pipe, pytest.raises(mutex.LockLost):
+        a.fenced(pipe, queue)
+    assert not mutex.redis.exists(f"{_NAME}:written")
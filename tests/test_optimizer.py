@@ -0,0 +1,117 @@
+# pylint: skip-file
+import random
+
+import pytest
+
+import optimizer
+
+_MIN_TICKS = {"cutoff_price": "3.00", "above_tick": "0.05", "below_tick": "0.01"}
+
+# strike: (call mark, put mark)
+_MARKS = {
+    400: (12.0, 0.2),
+    405: (7.5, 0.6),
+    410: (3.5, 1.6),
+    415: (1.1, 4.2),
+    420: (0.3, 8.4),
+    425: (0.1, 13.2),
+}
+
+
+def row(o_type, strike, mark):
+    return {
+        "type": o_type,
+        "strike_price": f"{strike:.4f}",
+        "mark_price": str(mark),
+        "ask_price": str(round(mark + 0.05, 2)),
+        "bid_price": str(round(mark - 0.05, 2)),
+        "min_ticks": _MIN_TICKS,
+    }
+
+
+@pytest.fixture()
+def chain():
+    rows = []
+    for strike, (call, put) in _MARKS.items():
+        rows += [row("call", strike, call), row("put", strike, put)]
+    return optimizer.Chain(rows, "SPY")
+
+
+def test_picks_lowest_call_and_highest_put_target(chain):
+    assert chain.data["call"]["strike"][chain.best("call", 2)] == 410
+    assert chain.data["put"]["strike"][chain.best("put", 2)] == 410
+    assert chain.data["call"]["strike"][chain.best("call", 4)] == 415
+
+
+def test_condor_shape(chain):
+    d = optimizer.optimal_condor(chain, 100, 0, slack=1)
+    assert d["call"]["sell"]["strike"] == 410.0
+    assert d["call"]["buy"]["strike"] == 415.0
+    assert d["put"]["sell"]["strike"] == 410.0
+    # same strike as the sell leg -> moved one strike out
+    assert d["put"]["buy"]["strike"] == 405.0
+    assert d["put"]["buy"]["ask"] == 0.65
+    assert d["collateral"] == 5.0
+    assert d["call"]["credit"] == 2.3
+    assert d["credit_with_slack"] == d["credit"] - 0.05
+    assert d["min_ticks"] == _MIN_TICKS
+
+
+def test_apply_slack_matches_fresh_selection(chain):
+    d = optimizer.optimal_condor(chain, 100, 0, slack=0)
+    assert optimizer.apply_slack(d, 2) == optimizer.optimal_condor(
+        chain, 100, 0, slack=2
+    )
+
+
+def test_adjacent_wings_move_buy_one_strike_out(chain):
+    d = optimizer.optimal_condor(chain, 0, 0, slack=0, adjacent_wings=True)
+    assert d["call"]["buy"]["strike"] == d["call"]["sell"]["strike"] + 5
+    assert d["put"]["buy"]["strike"] == d["put"]["sell"]["strike"] - 5
+
+
+def test_bad_rows_are_skipped():
+    rows = [row("call", 400, 1.0), row("put", 400, 1.0) | {"ask_price": None}]
+    chain = optimizer.Chain(rows, "SPY")
+    assert len(chain) == 1
+    assert optimizer.optimal_strangle(chain, 0, 0)["put"] == {}
+
+
+@pytest.mark.parametrize("multipliers, adjacent", [((100, 0), False), ((0, 0), True)])
+def test_running_condor_matches_full_search(multipliers, adjacent):
+    rows = []
+    for strike, (call, put) in _MARKS.items():
+        rows += [row("call", strike, call), row("put", strike, put)]
+    for r in rows:
+        r["id"] = f"{r['type']}{r['strike_price']}"
+
+    state = optimizer.ChainState(rows, "SPY")
+    running = optimizer.RunningCondor(state, *multipliers, 1, adjacent)
+    rng = random.Random(7)
+    for _ in range(200):
+        quotes = []
+        for r in rng.sample(rows, 3):
+            mark = float(r["mark_price"])
+            if rng.random() < 0.5:  # mark moves, else only the bid
+                mark = max(round(mark + rng.choice([-0.2, -0.05, 0.05, 0.2]), 2), 0.05)
+                r |= {"mark_price": str(mark), "ask_price": str(round(mark + 0.05, 2))}
+            r["bid_price"] = str(round(mark - rng.choice([0.0, 0.05]), 2))
+            quotes.append({"instrument_id": r["id"]} | {k: r[k] for k in state.fields})
+
+        changed = state.apply(quotes)
+        assert state.stats["last"] == sum(len(c) for c in changed.values())
+        d = running.update(changed)
+        fresh = optimizer.optimal_condor(
+            optimizer.Chain(rows, "SPY"), *multipliers, 1, adjacent_wings=adjacent
+        )
+        assert (d is None) == (fresh is None)
+        if fresh:
+            for k in ["credit", "collateral", "credit_with_slack"]:
+                assert d[k] == pytest.approx(fresh[k])
+            for t in ["call", "put"]:
+                legs = [fresh[t][side]["strike"] for side in ["buy", "sell"]]
+                assert running.leg_strikes(t) == legs
+
+    assert state.stats["polls"] == 200
+    # most polls only move strikes the condor does not depend on
+    assert running.stats["recomputed"] < 200
@@ -0,0 +1,38 @@
+# pylint: skip-file
+import multiprocessing
+from types import SimpleNamespace
+
+import oracle
+import strangler
+from models import order
+
+
+def test_work_items_start_with_an_empty_identity_map(monkeypatch):
+    monkeypatch.setattr(oracle.log, "debug", lambda msg: None)
+    order.identity_map.clear()
+    seen = []
+
+    def job(expr):
+        seen.append(len(order.identity_map.orders))
+        order.identity_map.add(SimpleNamespace(id=f"order-{expr}"))
+        order.identity_map.get(f"order-{expr}")
+
+    for expr in ["2023-05-09", "2023-05-10"]:
+        oracle.run_work_item(job, expr)
+    assert seen == [0, 0]
+    assert order.identity_map.stats()["size"] == 0
+
+
+def _open_legs(expr):
+    b = strangler.Buy(expr)
+    b.open_orders()
+    b.cancel_orders()
+    return b.buy_call_oid, b.buy_put_oid
+
+
+# po_buy runs in a daemonic pool worker, which can't start processes of its own
+def test_strangle_legs_open_inside_a_pool_worker(monkeypatch):
+    monkeypatch.setattr(strangler.Buy, "open_order", lambda self, t: f"{t}-oid")
+    monkeypatch.setattr(strangler.Buy, "cancel_order", lambda self, oid: None)
+    with multiprocessing.get_context("fork").Pool(1) as p:
+        assert p.apply(_open_legs, ("2023-05-09",)) == ("call-oid", "put-oid")
@@ -0,0 +1,71 @@
+# pylint: skip-file
+from models import order
+
+_LEGS = [
+    {
+        "expiration_date": "2023-05-09",
+        "option_type": "call",
+        "strike_price": "410.0000",
+        "side": "sell",
+        "position_effect": "open",
+    }
+]
+
+# a leg as the hood API returns it, packing keeps only LEG_FIELDS
+_API_LEGS = [
+    _LEGS[0]
+    | {
+        "id": "leg-test",
+        "option": "https://api.robinhood.com/options/instruments/option-test/",
+        "ratio_quantity": 1,
+        "executions": [{"price": "1.00", "quantity": "1.00"}],
+    }
+]
+
+
+def test_legs_round_trip():
+    packed = order.pack_legs(_LEGS * 2)
+    assert packed.count(";") == 1
+    assert order.unpack_legs(packed) == _LEGS * 2
+
+
+def order_doc():
+    return {
+        "pk": "encoding-test",
+        "chain_symbol": "SPY",
+        "chain_id": "chain-test",
+        "direction": "credit",
+        "state": "filled",
+        "price": "1.0",
+        "quantity": "1.0",
+        "pending_quantity": "0.0",
+        "processed_quantity": "1.0",
+        "premium": "100.0",
+        "processed_premium": "100.0",
+        "cutoff_price": "0.0",
+        "above_tick": "0.01",
+        "below_tick": "0.01",
+        "created_at": "2023-05-08T14:00:00+00:00",
+        "updated_at": "2023-05-08T14:00:00+00:00",
+        "legs": order.json.dumps(_API_LEGS),
+    }
+
+
+def test_compact_hash_decodes_to_same_record():
+    full = order.OrderWrapper(order_doc())
+    compact = order.OrderWrapper(full.to_compact_hash())
+
+    # every field but the legs, which lose the keys nothing reads
+    assert {k: v for k, v in compact.to_dict().items() if k != "legs"} == {
+        k: v for k, v in full.to_dict().items() if k != "legs"
+    }
+    assert compact.legs == _LEGS
+    assert compact.option_type == "call" and compact.expr == "2023-05-09"
+
+
+def test_revert_writes_json_legs():
+    compact = order.OrderWrapper(order.OrderWrapper(order_doc()).to_compact_hash())
+    # legs never accessed, still the packed string
+    reverted = order.OrderWrapper(compact.to_hash())
+    assert order.json.loads(compact.to_hash()["legs"]) == _LEGS
+    assert reverted.legs == _LEGS
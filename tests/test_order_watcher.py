@@ -0,0 +1,95 @@
+# pylint: skip-file
+import pytest
+
+import order_watcher
+from models import order
+
+
+def order_js(oid, state):
+    leg = {
+        "expiration_date": "2023-05-09",
+        "option_type": "call",
+        "strike_price": "410.0",
+        "side": "buy",
+        "position_effect": "open",
+    }
+    return {
+        "id": oid,
+        "chain_symbol": "SPY",
+        "chain_id": "chain-test",
+        "direction": "debit",
+        "state": state,
+        "price": "1.00",
+        "quantity": "1.00",
+        "pending_quantity": "1.00",
+        "processed_quantity": "0.00",
+        "premium": "100.00",
+        "processed_premium": "0.00",
+        "created_at": "2023-05-08T14:00:00Z",
+        "updated_at": "2023-05-08T14:00:00Z",
+        "legs": [leg],
+        "cutoff_price": "0.00",
+        "above_tick": "0.01",
+        "below_tick": "0.01",
+    }
+
+
+@pytest.fixture()
+def watched(monkeypatch):
+    js = order_js("watcher-test", "queued")
+    o = order.create(js)
+    monkeypatch.setattr(order.hood, "get_orders_since", lambda ts: [js])
+    monkeypatch.setattr(order.hood, "get_order_by_id", lambda oid: js)
+    yield o, js
+    order_watcher.redis.delete(order_watcher.WATCHED_ORDERS, order_watcher.ORDER_STREAM)
+    o.delete()
+
+
+def test_poll_publishes_transitions(watched):
+    o, js = watched
+    order_watcher.redis.sadd(order_watcher.WATCHED_ORDERS, o.id)
+    w = order_watcher.OrderWatcher()
+
+    w.poll()
+    assert order_watcher.redis.xlen(order_watcher.ORDER_STREAM) == 0
+
+    js |= {"state": "filled", "processed_quantity": js["quantity"]}
+    w.poll()
+    ((_, event),) = order_watcher.redis.xrange(order_watcher.ORDER_STREAM)
+    assert event["oid"] == o.id and event["state"] == "filled"
+    assert not order_watcher.redis.sismember(order_watcher.WATCHED_ORDERS, o.id)
+
+
+def test_wait_for_times_out(watched):
+    o, _ = watched
+    assert order_watcher.wait_for(o, order.OrderWrapper.is_filled, 0.2, 0.1) is None
+    assert not order_watcher.redis.sismember(order_watcher.WATCHED_ORDERS, o.id)
+
+
+def test_sync_many_skips_final_and_caps_lookback(monkeypatch):
+    now = order.dt.datetime.now(order.dt.timezone.utc)
+    recent = order_js("sync-recent", "queued") | {"updated_at": now.isoformat()}
+    orders = [
+        order.create(order_js("sync-final", "filled")),
+        order.create(order_js("sync-stale", "queued")),
+        order.create(recent),
+    ]
+
+    since, by_id = [], []
+    monkeypatch.setattr(
+        order.hood,
+        "get_orders_since",
+        lambda ts: since.append(ts) or [recent | {"state": "confirmed"}],
+    )
+    monkeypatch.setattr(
+        order.hood,
+        "get_order_by_id",
+        lambda oid: by_id.append(oid) or order_js(oid, "cancelled"),
+    )
+    order.sync_many(orders)
+
+    assert by_id == ["sync-stale"]
+    assert since == [now.isoformat()]
+    assert [o.state for o in orders] == ["filled", "cancelled", "confirmed"]
+    for o in orders:
+        o.delete()
@@ -0,0 +1,31 @@
+# pylint: skip-file
+from types import SimpleNamespace
+
+import pytest
+
+import strangler
+
+Cache = strangler.Cache
+
+
+@pytest.fixture()
+def pending():
+    r = strangler.redis
+    r.delete(Cache.index, Cache.index_built)
+    # cached before the index existed
+    r.hset("pending_orders:2023-05-09:SPY", mapping={"call_oid": "c", "put_oid": "p"})
+    yield r
+    r.delete(Cache.index, Cache.index_built, "pending_orders:2023-05-09:SPY")
+
+
+def test_backfill_scans_once(pending, monkeypatch):
+    assert list(Cache.get_orders()[0]) == ["pending_orders:2023-05-09:SPY"]
+
+    Cache.delete_strangle_key(SimpleNamespace(expr="2023-05-09", ticker="SPY"))
+    assert not pending.exists(Cache.index)
+
+    def scan_iter(*args, **kwargs):
+        raise AssertionError("keyspace scanned again")
+
+    monkeypatch.setattr(pending, "scan_iter", scan_iter)
+    assert Cache.get_orders() == []
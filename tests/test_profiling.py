@@ -0,0 +1,28 @@
+# pylint: skip-file
+import pytest
+
+import profiling
+
+
+def test_failed_profile_write_keeps_the_original_error(monkeypatch):
+    def write(prof, name, top):
+        raise OSError("disk full")
+
+    errors = []
+    monkeypatch.setattr(profiling, "write", write)
+    monkeypatch.setattr(profiling.log, "error", errors.append)
+    monkeypatch.setattr(profiling, "_write_failed", False)
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            with profiling.profile("job"):
+                raise ValueError("trading error")
+    assert len(errors) == 1
+
+
+def test_profile_path_is_logged(tmp_path, monkeypatch):
+    infos = []
+    monkeypatch.setattr(profiling.constants, "PROFILES_DIR", str(tmp_path))
+    monkeypatch.setattr(profiling.log, "info", infos.append)
+    with profiling.profile("job"):
+        sum(range(10))
+    assert len(infos) == 1 and infos[0].endswith(".prof")
@@ -0,0 +1,126 @@
+# pylint: skip-file
+from types import SimpleNamespace
+
+import pytest
+
+from models import order, strangle
+
+_EXPR = "2023-05-09"
+
+
+def order_js(oid, o_type, direction, quantity, processed):
+    leg = {
+        "expiration_date": _EXPR,
+        "option_type": o_type,
+        "strike_price": "410.0",
+        "side": "sell" if direction == "credit" else "buy",
+        "position_effect": "close" if direction == "credit" else "open",
+    }
+    return {
+        "id": oid,
+        "chain_symbol": "SPY",
+        "chain_id": "chain-test",
+        "direction": direction,
+        "state": "filled" if processed == quantity else "partially_filled",
+        "price": "1.00",
+        "quantity": str(quantity),
+        "pending_quantity": str(quantity - processed),
+        "processed_quantity": str(processed),
+        "premium": str(100.0 * quantity),
+        "processed_premium": str(100.0 * processed),
+        "created_at": "2023-05-08T14:00:00Z",
+        "updated_at": "2023-05-08T14:00:00Z",
+        "legs": [leg],
+        "cutoff_price": "0.00",
+        "above_tick": "0.01",
+        "below_tick": "0.01",
+    }
+
+
+@pytest.fixture()
+def legacy_strangle(monkeypatch):
+    """
+    Strangle opened before sell totals were kept: two filled call sells
+    on record, no totals hash
+    """
+    monkeypatch.setattr(
+        strangle.dh, "datetime_until_expr_from_market_seconds", lambda sec, expr: None
+    )
+    buys = {
+        f"totals-buy-{t}": order.create(order_js(f"totals-buy-{t}", t, "debit", 3, 3))
+        for t in ["call", "put"]
+    }
+    sells = [
+        order.create(order_js(f"totals-sell-{i}", "call", "credit", 1, 1))
+        for i in range(2)
+    ]
+    key = order.sell_totals_key("SPY", _EXPR)
+    order.redis.delete(key)
+
+    s = SimpleNamespace(
+        pk=f"SPY:{_EXPR}",
+        buy_call_oid="totals-buy-call",
+        buy_put_oid="totals-buy-put",
+        sell_call_oids=strangle.zset_key(sells[0]),
+        sell_put_oids=f"sell_orders:puts:SPY:{_EXPR}",
+        eject_sec_to_expr=0,
+    )
+    w = strangle.StrangleWrapper(s, state="active", orders=buys)
+    for o in sells:
+        w.append_sell_order(o)
+
+    yield w, key
+    for o in [*buys.values(), *sells]:
+        o.delete()
+    order.redis.delete(key, s.sell_call_oids, s.sell_put_oids)
+    order.identity_map.clear()
+
+
+def test_first_save_after_deploy_keeps_earlier_fills(legacy_strangle):
+    w, key = legacy_strangle
+
+    o = order.create(order_js("totals-sell-2", "call", "credit", 1, 0))
+    w.append_sell_order(o)
+    o.save({"processed_quantity": 1, "processed_premium": 100.0, "state": "filled"})
+    # no partial hash holding just this order's delta
+    assert not order.redis.exists(key)
+
+    assert w.get_sell_processed_quantity("call") == 3
+    assert w.sell_is_filled("call")
+
+    # from here on saves move the rebuilt totals
+    o.save({"processed_premium": 110.0})
+    assert w.get_sell_processed_premium("call") == pytest.approx(310.0)
+    o.delete()
+
+
+def test_rebuild_reads_stored_orders_not_the_identity_map(legacy_strangle):
+    w, key = legacy_strangle
+
+    o = order.create(order_js("totals-sell-2", "call", "credit", 1, 0))
+    w.append_sell_order(o)
+    # filled by another process, the identity map still holds the open order
+    other = order.OrderWrapper.find(o.id)
+    other.save({"processed_quantity": 1, "processed_premium": 100.0})
+    assert o.processed_quantity == 0
+
+    assert w.get_sell_processed_quantity("call") == 3
+    assert w.get_sell_processed_premium("call") == pytest.approx(300.0)
+    assert float(order.redis.hget(key, "put:quantity")) == 0
+    o.delete()
+
+
+def test_expired_dead_orders_leave_the_sell_zset(legacy_strangle):
+    w, _ = legacy_strangle
+
+    js = order_js("totals-sell-dead", "call", "credit", 1, 0) | {"state": "cancelled"}
+    w.append_sell_order(order.create(js))
+    # DEAD_ORDER_TTL ran out
+    order.redis.delete(order.OrderWrapper.Order.make_primary_key("totals-sell-dead"))
+    order.identity_map.clear()
+
+    live = ["totals-sell-0", "totals-sell-1"]
+    assert [o.id for o in w.get_sell_orders("call")] == live
+    assert order.redis.zrange(w.sell_call_oids, 0, -1) == live
+    assert w.most_recent_sell_order("call").id == "totals-sell-1"
+    assert w.get_sell_processed_quantity("call") == 2
@@ -0,0 +1,84 @@
+# pylint: skip-file
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import snapshots
+from tests.test_backtest import chain
+
+_EXPR = "2023-05-09"
+_DAY = "2023-05-08"
+
+
+@pytest.fixture(autouse=True)
+def snapshots_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots.constants, "SNAPSHOTS_DIR", str(tmp_path))
+
+
+def record(hour, scale=1.0, **extra):
+    rows = [c | extra for c in chain(scale)]
+    return snapshots.record("SPY", _EXPR, rows, taken_at=datetime(2023, 5, 8, hour))
+
+
+def test_parts_are_readable_before_and_after_compaction():
+    record(15, 2.0)
+    record(14, implied_volatility="0.25", open_interest="120", volume="7")
+    assert snapshots.days("SPY", _EXPR) == [_DAY]
+
+    before = snapshots.Day("SPY", _EXPR, _DAY)
+    assert snapshots.compact("SPY", _EXPR, _DAY) == 2
+    assert snapshots.part_paths("SPY", _EXPR, _DAY) == []
+    after = snapshots.Day("SPY", _EXPR, _DAY)
+
+    for day in [before, after]:
+        assert len(day) == 2
+        # stored in time order, not in the order they were recorded
+        assert day.prices("call", 410.0, "mark").tolist() == [3.5, 7.0]
+        first = day.snapshot(0)
+        assert first["iv"][0] == 0.25 and first["oi"][0] == 120
+        assert np.isnan(day.snapshot(1)["volume"]).all()
+
+
+def test_underlying_from_put_call_parity():
+    record(14)
+    day = snapshots.Day("SPY", _EXPR, _DAY)
+    # closest call / put marks at 410: 410 + 3.5 - 1.6
+    assert day.underlying[0] == pytest.approx(411.9)
+
+
+def test_random_access_by_time():
+    record(14)
+    record(16, 2.0)
+    snapshots.compact("SPY", _EXPR, _DAY)
+
+    day, i = snapshots.at("SPY", _EXPR, datetime(2023, 5, 8, 15, 30))
+    assert day.taken_at[i] == np.datetime64("2023-05-08T14:00:00")
+    assert snapshots.at("SPY", _EXPR, datetime(2023, 5, 8, 13)) is None
+    assert snapshots.at("SPY", _EXPR, datetime(2023, 5, 7, 15)) is None
+
+
+def test_unpacked_copy_goes_stale_on_compact():
+    record(14)
+    snapshots.compact("SPY", _EXPR, _DAY)
+    snapshots.unpack("SPY", _EXPR, _DAY)
+    assert len(snapshots.Day("SPY", _EXPR, _DAY)) == 1
+
+    record(15, 2.0)
+    snapshots.compact("SPY", _EXPR, _DAY)
+    assert not snapshots.is_unpacked("SPY", _EXPR, _DAY)
+    assert len(snapshots.Day("SPY", _EXPR, _DAY)) == 2
+
+
+def test_unpack_leaves_days_being_recorded_alone(monkeypatch):
+    record(14)
+    # parts only: nothing compacted yet, not even for a past day
+    assert snapshots.unpack("SPY", _EXPR, _DAY) is None
+    assert snapshots.part_paths("SPY", _EXPR, _DAY)
+
+    snapshots.compact("SPY", _EXPR, _DAY)
+    record(15, 2.0)
+    monkeypatch.setattr(snapshots, "today", lambda: _DAY)
+    assert snapshots.unpack("SPY", _EXPR, _DAY) is None
+    assert len(snapshots.part_paths("SPY", _EXPR, _DAY)) == 1
+    assert len(snapshots.Day("SPY", _EXPR, _DAY)) == 2
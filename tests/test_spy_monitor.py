@@ -0,0 +1,119 @@
+# pylint: skip-file
+import pytest
+
+import condorer_spy
+
+_TICKS = {"cutoff_price": "3.00", "above_tick": "0.05", "below_tick": "0.01"}
+
+
+def _mark(o_type, strike):
+    # best sell targets (roi 2): call 410 (420), put 400 (390)
+    return 50 / (strike - 400) if o_type == "call" else 50 / (410 - strike)
+
+
+def _strikes(o_type):
+    return range(401, 441) if o_type == "call" else range(370, 410)
+
+
+@pytest.fixture()
+def market(monkeypatch):
+    prices = {
+        f"{t}{k}": _mark(t, k) for t in ["call", "put"] for k in _strikes(t)
+    }  # id -> mark, bid / ask a cent around it
+    bids = {}
+
+    def quote(i):
+        return {"ask": prices[i] + 0.01, "bid": bids.get(i, prices[i] - 0.01)}
+
+    monkeypatch.setattr(
+        condorer_spy.hood,
+        "get_option_chain",
+        lambda ticker, expr: [
+            {
+                "id": f"{t}{k}",
+                "type": t,
+                "strike_price": f"{k:.4f}",
+                "ask_price": str(quote(f"{t}{k}")["ask"]),
+                "bid_price": str(quote(f"{t}{k}")["bid"]),
+                "mark_price": str(prices[f"{t}{k}"]),
+                "min_ticks": _TICKS,
+            }
+            for t in ["call", "put"]
+            for k in _strikes(t)
+        ],
+    )
+
+    polled = []
+
+    def quotes(ids):
+        polled.append(ids)
+        return [
+            {
+                "instrument_id": i,
+                "ask_price": str(quote(i)["ask"]),
+                "bid_price": str(quote(i)["bid"]),
+                "mark_price": str(prices[i]),
+            }
+            for i in ids
+        ]
+
+    monkeypatch.setattr(condorer_spy.hood, "get_option_quotes", quotes)
+    return prices, bids, polled
+
+
+def _monitor():
+    m = condorer_spy.Monitor("2023-05-09", 0, band=3, multiplier_sell=0)
+    assert m.load()
+    return m
+
+
+def test_only_moving_changes_recompute(market):
+    prices, bids, polled = market
+    m = _monitor()
+    # legs +- 3 strikes: puts 396-409, calls 401-414
+    assert len(m.state) == 14 + 14
+    assert (m.d["call"]["sell"]["strike"], m.d["put"]["sell"]["strike"]) == (410, 400)
+    recomputed = m.stats["recomputed"]
+
+    m.poll()
+    assert len(polled[0]) == len(m.state)
+    assert m.stats["changed"] == 0 and m.stats["recomputed"] == recomputed
+
+    prices["call414"] += 0.01  # target 421.1, still behind the 410 call
+    m.poll()
+    assert m.stats["changed"] == 1 and m.stats["recomputed"] == recomputed
+
+    # a leg's bid only reprices
+    credit = m.d["credit"]
+    bids["call410"] = prices["call410"] + 0.05
+    m.poll()
+    assert m.stats["repriced"] == 1 and m.stats["recomputed"] == recomputed
+    assert m.d["credit"] == pytest.approx(credit + 0.06)
+
+    # a cheaper 412 call now has the best target
+    prices["call412"] -= 0.5
+    m.poll()
+    assert m.stats["recomputed"] == recomputed + 1
+    assert m.d["call"]["sell"]["strike"] == 412
+
+
+def test_run_returns_once_the_ratio_crosses(market, monkeypatch):
+    prices, bids, polled = market
+    m = _monitor()
+    ratio = m.d["credit_collateral_ratio"] + 5
+    assert m.run(window=0, cadence=0, ratio=ratio) is None
+
+    # the put leg bid jumps on the third poll
+    quotes = condorer_spy.hood.get_option_quotes
+
+    def later(ids):
+        if len(polled) == 2:
+            bids["put400"] = prices["put400"] + 0.05
+        return quotes(ids)
+
+    monkeypatch.setattr(condorer_spy.hood, "get_option_quotes", later)
+    polled.clear()
+    d = m.run(window=5, cadence=0, ratio=ratio)
+    assert len(polled) == 3
+    assert d["credit_collateral_ratio"] >= ratio
+    assert d["ticker"] == "SPY" and d["quantity"] >= 1
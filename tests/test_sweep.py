@@ -0,0 +1,64 @@
+# pylint: skip-file
+from datetime import datetime
+
+import numpy as np
+
+import snapshots
+import sweep
+from tests.test_backtest import chain
+
+_SPACE = {
+    "optimal_strike_multiplier_buy": [50.0, 100.0],
+    "optimal_strike_multiplier_sell": [0.0, 50.0],
+    "target_roi": [30.0, 50.0, 70.0],
+}
+
+
+def test_grid_and_sample():
+    assert len(sweep.grid(_SPACE)) == 12
+    sets = sweep.sample(_SPACE, 50, seed=1)
+    assert sets == sweep.sample(_SPACE, 50, seed=1)
+    assert all(p in sweep.grid(_SPACE) for p in sets)
+
+
+def test_chunks_keep_multipliers_together():
+    chunks = sweep.chunks(sweep.grid(_SPACE), size=3)
+    for c in chunks:
+        assert len({p["optimal_strike_multiplier_buy"] for p in c}) == 1
+        assert len({p["optimal_strike_multiplier_sell"] for p in c}) == 1
+
+
+def test_rank_breaks_ties_on_drawdown():
+    rows = [
+        {"pnl": 10.0, "max_drawdown": 5.0},
+        {"pnl": 20.0, "max_drawdown": 50.0},
+        {"pnl": 10.0, "max_drawdown": 1.0},
+    ]
+    assert [r["max_drawdown"] for r in sweep.rank(rows)] == [50.0, 1.0, 5.0]
+
+
+def test_unpacked_day_is_memory_mapped(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots.constants, "SNAPSHOTS_DIR", str(tmp_path))
+    snapshots.write_day(
+        "SPY", "2023-05-09", "2023-05-08", [(datetime(2023, 5, 8), chain())]
+    )
+    packed = snapshots.Day("SPY", "2023-05-09", "2023-05-08")
+
+    snapshots.unpack("SPY", "2023-05-09", "2023-05-08")
+    mapped = snapshots.Day("SPY", "2023-05-09", "2023-05-08")
+    assert isinstance(mapped.cols["strike"], np.memmap)
+    assert mapped.prices("call", 410.0, "bid") == packed.prices("call", 410.0, "bid")
+
+
+def test_run_removes_its_unpacked_copies(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots.constants, "SNAPSHOTS_DIR", str(tmp_path))
+    snapshots.write_day(
+        "SPY", "2023-05-09", "2023-05-08", [(datetime(2023, 5, 8), chain())]
+    )
+    day = ("SPY", "2023-05-09", "2023-05-08")
+    monkeypatch.setattr(sweep.backtest, "positions", lambda *args: [day[:2]])
+
+    assert sweep.prepare("condor") == [day]
+    assert snapshots.is_unpacked(*day)
+    assert sweep.run("condor", [], processes=1) == []
+    assert not snapshots.is_unpacked(*day)
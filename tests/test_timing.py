@@ -0,0 +1,34 @@
+# pylint: skip-file
+import pytest
+
+import strangler
+import timing
+
+
+@pytest.fixture()
+def spans(monkeypatch):
+    lines = []
+    monkeypatch.setattr(timing, "record", lambda path, ms, ok, tags: lines.append(path))
+    return lines
+
+
+def test_failed_span_write_keeps_the_original_error(monkeypatch):
+    def record(path, ms, ok, tags):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(timing, "record", record)
+    monkeypatch.setattr(timing, "_record_failed", True)  # nothing to report to
+    with pytest.raises(ValueError):
+        with timing.span("trade"):
+            raise ValueError("trading error")
+
+
+def test_close_loop_threads_keep_the_span_path(spans, monkeypatch):
+    def close(s):
+        with timing.span("close"):
+            pass
+
+    monkeypatch.setattr(strangler, "close_strangle", close)
+    with timing.span("oracle"):
+        strangler.close_strangles(["a", "b"], max_workers=2)
+    assert spans.count(("oracle", "close")) == 2
@@ -0,0 +1,146 @@
+import contextvars
+import glob
+import json
+import math
+import os
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import wraps
+
+import constants
+
+# current span path, e.g.
+# ("condorer.buy", "condorer.Select.exec", "hood.get_option_chain")
+_path = contextvars.ContextVar("timing_path", default=())
+
+
+def spans_file(iso_date):
+    return os.path.join(constants.SPANS_DIR, f"spans_{iso_date}.jsonl")
+
+
+# a failed write is reported once per process, not once per span
+_record_failed = False
+
+
+def record(path, ms, ok, tags):
+    line = {
+        "t": round(time.time(), 3),
+        "span": "/".join(path),
+        "stage": path[-1],
+        "ms": round(ms, 3),
+        "ok": ok,
+        "pid": os.getpid(),
+    }
+    line |= tags
+
+    os.makedirs(constants.SPANS_DIR, exist_ok=True)
+    # single short append per span - safe enough across pool workers
+    with open(spans_file(datetime.utcnow().date().isoformat()), "a") as f:
+        f.write(json.dumps(line, default=str) + "\n")
+
+
+@contextmanager
+def span(name, **tags):
+    path = _path.get() + (name,)
+    token = _path.set(path)
+    ok = True
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        ms = (time.perf_counter() - start) * 1000
+        _path.reset(token)
+        # never replace the exception the timed code is raising
+        try:
+            record(path, ms, ok, tags)
+        except Exception as err:  # pylint: disable=broad-except
+            record_failed(err)
+
+
+def record_failed(err):
+    global _record_failed  # pylint: disable=global-statement
+    if _record_failed:
+        return
+    _record_failed = True
+    try:
+        import discord_logging as dlog  # pylint: disable=import-outside-toplevel
+
+        dlog.error(f"timing: could not write spans: {err!r}")
+    except Exception:  # pylint: disable=broad-except
+        print(f"timing: could not write spans: {err!r}", file=sys.stderr)
+
+
+def timed(func):
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+###########
+# REPORTS #
+###########
+
+
+def read_spans(iso_date):
+    try:
+        with open(spans_file(iso_date), "r") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+# nearest rank
+def percentile(sorted_values, p):
+    i = max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[i]
+
+
+def stats(iso_date, by="span"):
+    grouped = defaultdict(list)
+    for s in read_spans(iso_date):
+        grouped[s[by]].append(s["ms"])
+
+    res = {}
+    for k, values in grouped.items():
+        values.sort()
+        res[k] = {
+            "count": len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "max": values[-1],
+        }
+    return res
+
+
+def report(iso_date, by="span"):
+    lines = [f"{'count':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}  {by}"]
+    for k, v in sorted(stats(iso_date, by).items()):
+        percentiles = " ".join(f"{v[p]:>10.1f}" for p in ["p50", "p95", "p99"])
+        lines.append(f"{v['count']:>6} {percentiles}  {k}")
+    return "\n".join(lines)
+
+
+def prune(days=constants.SPANS_RETENTION_DAYS):
+    cutoff = (datetime.utcnow().date() - timedelta(days)).isoformat()
+    for f in glob.glob(spans_file("*")):
+        if os.path.basename(f)[len("spans_") : -len(".jsonl")] < cutoff:
+            os.remove(f)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("Missing date")
+
+    print(report(*sys.argv[1:3]))